@@ -0,0 +1,9 @@
+"""
+Benchmarks of the obvci planner against synthetic recipe trees and indices,
+of its anaconda.org interactions against a fake anaconda.org, and of the
+startup of its entry points.
+
+Run with ``python -m benchmarks.run`` from the root of the repository (with
+conda and conda-build installed). See ``python -m benchmarks.run --help``.
+
+"""
@@ -0,0 +1,118 @@
+"""
+Time the uploads and existence checks of obvci against a fake anaconda.org
+(see :mod:`obvci.tests.fake_binstar`) with a configurable latency and
+bandwidth.
+
+"""
+from __future__ import print_function
+
+from collections import OrderedDict
+import os
+import random
+import shutil
+import tempfile
+
+from .planner import best_of
+
+
+class SyntheticMeta(object):
+    """The parts of a conda-build MetaData which the binstar functions use."""
+    def __init__(self, name, version):
+        self._name = name
+        self._version = version
+
+    def name(self):
+        return self._name
+
+    def version(self):
+        return self._version
+
+    def dist(self):
+        return '{}-{}-0'.format(self._name, self._version)
+
+
+def make_content(rand, size, block_size=4096):
+    """Return size (incompressible) bytes, from the given random number generator."""
+    block = bytes(bytearray(rand.getrandbits(8) for _ in range(min(size, block_size))))
+    return (block * (size // block_size + 1))[:size]
+
+
+def upload_all(cli, owner, metas, fnames, channels=('main',)):
+    """Upload the given files as the distribution of each of the metas."""
+    import binstar_client
+
+    from obvci.conda_tools.inspect_binstar import distribution_fname
+    from obvci.conda_tools.streaming_upload import stream_upload
+
+    for meta, fname in zip(metas, fnames):
+        try:
+            cli.package(owner, meta.name())
+        except binstar_client.NotFound:
+            cli.add_package(owner, meta.name(), 'A synthetic package', 'BSD', public=True)
+        cli.add_release(owner, meta.name(), meta.version(), requirements=[],
+                        announce=None, description='')
+        stream_upload(cli, owner, meta.name(), meta.version(), distribution_fname(meta),
+                      fname, 'conda', channels=channels)
+
+
+def promote(cli, owner, metas, channel):
+    """Add the distributions of the metas to the channel, in a batch."""
+    from obvci.conda_tools.channel_promotion import ChannelListingCache, PromotionBatch
+
+    batch = PromotionBatch(cli)
+    for meta in metas:
+        batch.add(owner, meta, channel)
+    return batch.apply(ChannelListingCache(cli))
+
+
+def run_benchmarks(n_files, file_size=2 ** 20, latency=0.01, bandwidth=None,
+                   repeat=3, seed=0, owner='benchmarks', resumable=False):
+    """
+    Return an ordered dictionary of operation to the best time (in seconds)
+    of doing it for n_files distributions (of file_size bytes) against a fake
+    anaconda.org of the given latency (in seconds) and bandwidth (in bytes
+    per second), which offers resumable uploads if resumable.
+
+    """
+    from obvci.conda_tools import inspect_binstar
+    from obvci.tests.fake_binstar import FakeBinstar
+
+    directory = tempfile.mkdtemp(prefix='obvci_benchmark_')
+    rand = random.Random(seed)
+    names = ['package{:05}'.format(i) for i in range(n_files)]
+    fnames = [os.path.join(directory, name) for name in names]
+    for fname in fnames:
+        with open(fname, 'wb') as fh:
+            fh.write(make_content(rand, file_size))
+
+    server = FakeBinstar(login=owner, latency=latency, bandwidth=bandwidth,
+                         resumable=resumable)
+    try:
+        with server:
+            cli = server.client()
+            results = OrderedDict()
+
+            # Each repetition uploads a new release of every package.
+            releases = iter(range(repeat))
+
+            def upload_release():
+                version = '1.0.{}'.format(next(releases))
+                metas = [SyntheticMeta(name, version) for name in names]
+                upload_all(cli, owner, metas, fnames, channels=['testing'])
+                return metas
+
+            results['upload'], metas = best_of(upload_release, repeat)
+            results['distribution_exists'], _ = best_of(
+                lambda: [inspect_binstar.distribution_exists(cli, owner, meta)
+                         for meta in metas], repeat)
+            results['distribution_exists_on_channel'], _ = best_of(
+                lambda: [inspect_binstar.distribution_exists_on_channel(cli, owner, meta, 'testing')
+                         for meta in metas], repeat)
+            results['add_distribution_to_channel'], _ = best_of(
+                lambda: [inspect_binstar.add_distribution_to_channel(cli, owner, meta, 'main')
+                         for meta in metas], repeat)
+            results['PromotionBatch.apply'], _ = best_of(
+                lambda: promote(cli, owner, metas, 'promoted'), repeat)
+            return results
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,69 @@
+"""
+Time each phase of planning a synthetic recipe tree against a synthetic index.
+
+"""
+from __future__ import print_function
+
+from collections import OrderedDict
+import shutil
+import tempfile
+
+from obvci.conda_tools.timing import clock
+
+from .synthetic import make_index, make_recipe_tree
+
+
+def best_of(function, repeat=3):
+    """
+    Call the given function repeat times, returning the shortest time taken
+    (in seconds) and the result of the last call.
+
+    """
+    best = None
+    for _ in range(repeat):
+        start = clock()
+        result = function()
+        duration = clock() - start
+        if best is None or duration < best:
+            best = duration
+    return best, result
+
+
+def run_benchmarks(n_recipes, n_packages, repeat=3, seed=0,
+                   extra_conditions=('python >=2',)):
+    """
+    Return an ordered dictionary of phase to the best time (in seconds) of
+    planning n_recipes synthetic recipes against an index of n_packages.
+
+    """
+    import conda.resolve
+
+    from obvci.conda_tools.build_directory import (BakedDistribution, fetch_metas,
+                                                   sort_dependency_order)
+    from obvci.conda_tools import from_conda_manifest_core_vn_matrix as vn_matrix
+
+    recipe_dir = tempfile.mkdtemp(prefix='obvci_benchmark_')
+    try:
+        make_recipe_tree(recipe_dir, n_recipes, seed=seed)
+        index = make_index(n_packages, seed=seed)
+
+        results = OrderedDict()
+        results['fetch_metas'], metas = best_of(
+            lambda: fetch_metas(recipe_dir), repeat)
+        results['sort_dependency_order'], metas = best_of(
+            lambda: sort_dependency_order(metas), repeat)
+        results['Resolve'], resolve = best_of(
+            lambda: conda.resolve.Resolve(index), repeat)
+        results['special_case_version_matrix'], all_cases = best_of(
+            lambda: [vn_matrix.special_case_version_matrix(meta, index, resolve)
+                     for meta in metas], repeat)
+        results['filter_cases'], all_cases = best_of(
+            lambda: [list(vn_matrix.filter_cases(cases, index, extra_conditions))
+                     for cases in all_cases], repeat)
+        distributions = [BakedDistribution(meta, case)
+                         for meta, cases in zip(metas, all_cases) for case in cases]
+        results['BakedDistribution.dist'], _ = best_of(
+            lambda: [dist.dist() for dist in distributions], repeat)
+        return results
+    finally:
+        shutil.rmtree(recipe_dir)
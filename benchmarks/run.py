@@ -0,0 +1,163 @@
+"""
+Benchmark obvci against synthetic recipe trees, indices and a fake anaconda.org,
+and time its startup.
+
+The results of each run are appended (with the git commit they were run
+against) to a JSON lines file, and compared against the most recent results
+of a different commit, so that regressions are caught.
+
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+from . import binstar, planner, startup
+
+
+#: The file in which the results are recorded by default.
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'results.jsonl')
+
+
+def git_commit():
+    """Return the commit of the working tree, and whether it is modified."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=root).decode('utf-8').strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain',
+                                          '--untracked-files=no'],
+                                         cwd=root).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, bool(status)
+
+
+def read_results(fname):
+    if not os.path.exists(fname):
+        return []
+    with open(fname, 'r') as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def previous_record(records, record):
+    """The most recent of the records which is comparable to the given record."""
+    for previous in reversed(records):
+        if (previous['commit'] != record['commit'] and
+                previous.get('suite', 'planner') == record['suite'] and
+                previous.get('params') == record['params'] and
+                previous['python'] == record['python']):
+            return previous
+    return None
+
+
+def compare(record, previous, threshold):
+    """Print the results of the record, returning the phases which regressed."""
+    regressions = []
+    print('{} ({}):'.format(record['suite'],
+                            ', '.join('{}={}'.format(key, value) for key, value
+                                      in sorted(record['params'].items()))))
+    for phase, seconds in record['results'].items():
+        line = '    {:<30} {:10.4f}s'.format(phase, seconds)
+        previous_seconds = (previous or {}).get('results', {}).get(phase)
+        if previous_seconds:
+            ratio = seconds / previous_seconds
+            line += '  {:10.4f}s at {}  x{:.2f}'.format(previous_seconds,
+                                                        previous['commit'][:8], ratio)
+            if ratio > threshold:
+                line += '  REGRESSION'
+                regressions.append(phase)
+        print(line)
+    return regressions
+
+
+def planner_runs(args):
+    """Yield the (params, results) of each of the planner benchmarks."""
+    for n_packages in args.index_size:
+        for n_recipes in args.recipes:
+            params = {'recipes': n_recipes, 'index_size': n_packages, 'seed': args.seed}
+            yield params, planner.run_benchmarks(n_recipes, n_packages, repeat=args.repeat,
+                                                 seed=args.seed)
+
+
+def binstar_runs(args):
+    """Yield the (params, results) of each of the binstar benchmarks."""
+    for latency in args.latency:
+        for n_files in args.files:
+            params = {'files': n_files, 'file_size': args.file_size, 'latency': latency,
+                      'bandwidth': args.bandwidth, 'resumable': args.resumable,
+                      'seed': args.seed}
+            yield params, binstar.run_benchmarks(n_files, args.file_size, latency=latency,
+                                                 bandwidth=args.bandwidth,
+                                                 repeat=args.repeat, seed=args.seed,
+                                                 resumable=args.resumable)
+
+
+def startup_runs(args):
+    """Yield the (params, results) of the startup benchmarks."""
+    yield {}, startup.run_benchmarks(repeat=args.repeat)
+
+
+#: The benchmark suites, by name.
+SUITES = {'planner': planner_runs, 'binstar': binstar_runs, 'startup': startup_runs}
+
+
+def main():
+    description = sys.modules[__name__].__doc__
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--suite', nargs='+', choices=sorted(SUITES), default=['planner'],
+                        help='The benchmark suites to run.')
+    parser.add_argument('--recipes', type=int, nargs='+', default=[100, 1000],
+                        help='The numbers of recipes in the synthetic recipe trees.')
+    parser.add_argument('--index-size', type=int, nargs='+', default=[10000],
+                        help='The numbers of packages in the synthetic indices.')
+    parser.add_argument('--files', type=int, nargs='+', default=[20],
+                        help='The numbers of distributions uploaded to the fake anaconda.org.')
+    parser.add_argument('--file-size', type=int, default=2 ** 20,
+                        help='The size (in bytes) of each uploaded distribution.')
+    parser.add_argument('--latency', type=float, nargs='+', default=[0.01],
+                        help='The latencies (in seconds) of the fake anaconda.org.')
+    parser.add_argument('--bandwidth', type=float,
+                        help='The bandwidth (in bytes per second) of the fake anaconda.org.')
+    parser.add_argument('--resumable', action='store_true',
+                        help='Whether the fake anaconda.org offers resumable (chunked) uploads.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of times to time each phase (the best is recorded).')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the synthetic recipe trees, indices and files.')
+    parser.add_argument('--results', default=DEFAULT_RESULTS,
+                        help='The JSON lines file in which to record the results.')
+    parser.add_argument('--no-record', action='store_true',
+                        help='Compare against, but do not add to, the recorded results.')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="""The ratio to the previously recorded time beyond which a phase
+                                is reported as a regression.""")
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    records = read_results(args.results)
+    regressions = []
+    for suite in args.suite:
+        for params, results in SUITES[suite](args):
+            record = {'commit': commit, 'dirty': dirty,
+                      'date': datetime.datetime.utcnow().isoformat(),
+                      'python': platform.python_version(),
+                      'suite': suite, 'params': params, 'results': results}
+            regressions.extend(compare(record, previous_record(records, record),
+                                       args.threshold))
+            if not args.no_record:
+                with open(args.results, 'a') as fh:
+                    fh.write(json.dumps(record) + '\n')
+                records.append(record)
+    if regressions:
+        sys.exit('Regressions in: {}'.format(', '.join(sorted(set(regressions)))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+Time the startup of the obvci_conda_build_dir entry point, which is run
+(with --help) in the test section of every obvci build.
+
+"""
+from __future__ import print_function
+
+from collections import OrderedDict
+import subprocess
+import sys
+
+from .planner import best_of
+
+
+def run_python(*args):
+    return subprocess.check_output([sys.executable] + list(args))
+
+
+def run_benchmarks(repeat=3):
+    """
+    Return an ordered dictionary of operation to the best time (in seconds)
+    of running it in a new Python process.
+
+    """
+    results = OrderedDict()
+    results['python'], _ = best_of(lambda: run_python('-c', 'pass'), repeat)
+    results['import'], _ = best_of(
+        lambda: run_python('-c', 'from obvci.cli import conda_build_dir'), repeat)
+    results['--help'], _ = best_of(
+        lambda: run_python('-m', 'obvci.cli.conda_build_dir', '--help'), repeat)
+    return results
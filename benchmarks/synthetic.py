@@ -0,0 +1,96 @@
+"""
+Generate synthetic recipe trees and indices of a configurable size.
+
+Everything is generated from a seeded random number generator, so the same
+arguments always give the same tree and index.
+
+"""
+from __future__ import print_function
+
+import os
+import random
+
+
+#: The python versions in the synthetic index.
+PYTHON_VERSIONS = ['2.6', '2.7', '3.3', '3.4', '3.5']
+#: The numpy versions in the synthetic index (each built for every python).
+NUMPY_VERSIONS = ['1.7', '1.8', '1.9', '1.10']
+
+
+def recipe_name(i):
+    return 'recipe{:05}'.format(i)
+
+
+def make_recipe_tree(directory, n_recipes, seed=0, max_deps=3,
+                     python_fraction=0.7, numpy_fraction=0.2):
+    """
+    Write n_recipes recipes to the given directory.
+
+    Each recipe depends on up to max_deps randomly chosen recipes before it
+    (so the dependencies form a DAG). The given fractions of the recipes
+    depend on ``python`` and ``numpy x.x``, which determine their build
+    matrices.
+
+    """
+    rand = random.Random(seed)
+    for i in range(n_recipes):
+        requirements = []
+        uses_numpy = rand.random() < numpy_fraction
+        if uses_numpy or rand.random() < python_fraction:
+            requirements.append('python')
+        if uses_numpy:
+            requirements.append('numpy x.x')
+        if i:
+            n_deps = rand.randint(0, min(max_deps, i))
+            requirements.extend(recipe_name(dep)
+                                for dep in sorted(rand.sample(range(i), n_deps)))
+
+        lines = ['package:',
+                 '    name: {}'.format(recipe_name(i)),
+                 '    version: 1.0.{}'.format(i)]
+        if requirements:
+            lines.append('requirements:')
+            for section in ['build', 'run']:
+                lines.append('    {}:'.format(section))
+                lines.extend('        - {}'.format(req) for req in requirements)
+
+        recipe_dir = os.path.join(directory, recipe_name(i))
+        os.makedirs(recipe_dir)
+        with open(os.path.join(recipe_dir, 'meta.yaml'), 'w') as fh:
+            fh.write('\n'.join(lines) + '\n')
+
+
+def make_index(n_packages, seed=0):
+    """
+    Return a :class:`~obvci.tests.unit.conda.dummy_index.DummyIndex` of
+    (at least) n_packages entries.
+
+    The index contains every python of PYTHON_VERSIONS, every numpy of
+    NUMPY_VERSIONS for each python, and is filled with unrelated packages
+    (some of which depend on python).
+
+    """
+    from obvci.tests.unit.conda.dummy_index import DummyIndex
+
+    rand = random.Random(seed)
+    index = DummyIndex()
+    for py_vn in PYTHON_VERSIONS:
+        index.add_pkg('python', py_vn + '.0')
+        for np_vn in NUMPY_VERSIONS:
+            index.add_pkg('numpy', np_vn + '.0',
+                          build_string='py{}'.format(py_vn.replace('.', '')),
+                          depends=['python {}*'.format(py_vn)])
+
+    i = 0
+    while len(index) < n_packages:
+        name = 'filler{:06}'.format(i)
+        for version in range(rand.randint(1, 10)):
+            if rand.random() < 0.5:
+                py_vn = rand.choice(PYTHON_VERSIONS)
+                index.add_pkg(name, '{}.0'.format(version),
+                              build_string='py{}'.format(py_vn.replace('.', '')),
+                              depends=['python {}*'.format(py_vn)])
+            else:
+                index.add_pkg(name, '{}.0'.format(version))
+        i += 1
+    return index
@@ -1,4 +1,42 @@
+import sys
+import types
 
-from ._version import get_versions
-__version__ = get_versions()['version']
-del get_versions
+
+_versions = None
+
+
+def _get_versions():
+    """
+    Return (and cache) the versioneer version information of obvci.
+
+    In a build or distribution the version is read from the static
+    _version.py written by versioneer. In a source checkout it is computed
+    by running git, which is why it is deferred until it is first asked for.
+
+    """
+    global _versions
+    if _versions is None:
+        from ._version import get_versions
+        _versions = get_versions()
+    return _versions
+
+
+def __getattr__(name):
+    # The lazy __version__ on Python 3.7+ (PEP 562).
+    if name == '__version__':
+        return _get_versions()['version']
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+if sys.version_info < (3, 7):
+    class _LazyVersionModule(types.ModuleType):
+        @property
+        def __version__(self):
+            return _get_versions()['version']
+
+    try:
+        sys.modules[__name__].__class__ = _LazyVersionModule
+    except TypeError:
+        # Python < 3.5 can't change the class of a module, so compute the
+        # version eagerly.
+        __version__ = _get_versions()['version']
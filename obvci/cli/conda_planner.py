@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Keep the build plan of a directory of conda recipes warm in a long-running
+daemon (``serve``), and ask the daemon for the plan or to build it.
+
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+from obvci.conda_tools.build_directory import Builder
+
+
+def serve(args):
+    from obvci.conda_tools.planner import Planner
+    from obvci.conda_tools.planner_daemon import PlannerDaemon
+
+    builder = Builder.handle_args(args)
+    planner = Planner(builder.conda_recipes_root, builder.extra_build_conditions,
+                      index_ttl=args.index_ttl)
+    PlannerDaemon(planner, builder, socket_path=args.socket,
+                  poll_interval=args.poll_interval).serve_forever()
+
+
+def send(args):
+    from obvci.conda_tools.planner_daemon import request
+
+    response = request(args.command, socket_path=args.socket,
+                       check=getattr(args, 'check', False))
+    print(json.dumps(response, indent=2, sort_keys=True))
+    if response['status'] != 'ok':
+        sys.exit('{} {}: {}'.format(args.command, response['status'],
+                                    response.get('message', '')))
+
+
+def main():
+    description = sys.modules[__name__].__doc__
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--socket',
+                        help="""The Unix socket on which the daemon listens. Defaults to
+                                planner.sock in a directory private to the current user.""")
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve_parser = subparsers.add_parser('serve', help='Run the daemon.')
+    Builder.define_args(serve_parser)
+    serve_parser.add_argument('--poll-interval', type=float, default=2,
+                              help="""The interval (in seconds) at which the recipes are checked
+                                      for changes.""")
+    serve_parser.add_argument('--index-ttl', type=float, default=300,
+                              help="""The interval (in seconds) at which the index is fetched
+                                      again.""")
+    serve_parser.set_defaults(function=serve)
+
+    plan_parser = subparsers.add_parser('plan', help='Print the current build plan.')
+    plan_parser.add_argument('--check', action='store_true',
+                             help="""Check whether each distribution will be built, and what will be
+                                     done with it on the channel (as with --dry-run).""")
+    plan_parser.set_defaults(function=send)
+    for command, help in [('build', 'Build the distributions which need building.'),
+                          ('status', 'Print the status of the daemon.'),
+                          ('stop', 'Stop the daemon.')]:
+        subparsers.add_parser(command, help=help).set_defaults(function=send)
+
+    args = parser.parse_args()
+    if getattr(args, 'function', None) is None:
+        parser.error('A command is required.')
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    main()
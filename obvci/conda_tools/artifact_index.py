@@ -0,0 +1,146 @@
+"""
+An index of the distributions which already exist on the local filesystem,
+either in the conda-build root or in a persistent (CI) cache directory.
+
+Consulting this index before asking binstar whether a distribution exists
+avoids both the remote query and the rebuild of distributions we already
+have.
+
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+
+from .local_channel import md5_file
+
+
+class LocalArtifactIndex(object):
+    """
+    Locate distributions, keyed by ``subdir/dist.tar.bz2``, in the given
+    directories.
+
+    Each directory is laid out like a channel (i.e. distributions live in
+    a ``<subdir>`` sub-directory), which is also how the conda-build root is
+    laid out. An artifact is only ever returned once its md5 has been
+    verified against the checksum recorded for it, either in our own
+    manifest or in the ``.index.json`` which conda-build maintains.
+
+    """
+    #: The name of the manifest of checksums for the artifacts in a directory.
+    MANIFEST = '.obvci_artifacts.json'
+
+    def __init__(self, directories, cache_directory=None, subdir=None):
+        self.directories = [os.path.abspath(os.path.expanduser(directory))
+                            for directory in directories]
+        #: The (persistent) directory to which built artifacts are added.
+        self.cache_directory = cache_directory
+        if cache_directory is not None:
+            self.cache_directory = os.path.abspath(os.path.expanduser(cache_directory))
+            if self.cache_directory not in self.directories:
+                self.directories.append(self.cache_directory)
+        if subdir is None:
+            import conda.config
+            subdir = conda.config.subdir
+        self.subdir = subdir
+        # A record of (fname, size, mtime) which have already been verified.
+        self._verified = set()
+
+    def key(self, meta):
+        """The ``subdir/dist.tar.bz2`` key of the given distribution."""
+        return '{}/{}.tar.bz2'.format(self.subdir, meta.dist())
+
+    def checksums(self, directory):
+        """Return a dictionary of basename to md5 for the given directory."""
+        checksums = {}
+        subdir_path = os.path.join(directory, self.subdir)
+        # conda-build's index comes first so that our manifest takes precedence.
+        for manifest in ['.index.json', self.MANIFEST]:
+            fname = os.path.join(subdir_path, manifest)
+            if not os.path.exists(fname):
+                continue
+            try:
+                with open(fname, 'r') as fh:
+                    records = json.load(fh)
+            except ValueError:
+                print('Ignoring the unreadable artifact manifest {}'.format(fname))
+                continue
+            for basename, record in records.items():
+                if isinstance(record, dict) and 'md5' in record:
+                    checksums[basename] = record['md5']
+        return checksums
+
+    def verify(self, fname, md5):
+        """Return whether the given file has the given md5."""
+        stat = os.stat(fname)
+        signature = (fname, stat.st_size, stat.st_mtime)
+        if signature in self._verified:
+            return True
+        if md5_file(fname) == md5:
+            self._verified.add(signature)
+            return True
+        return False
+
+    def find(self, meta):
+        """
+        Return the filename of a verified local artifact of the given
+        distribution, or None if there isn't one.
+
+        """
+        subdir, basename = self.key(meta).split('/', 1)
+        for directory in self.directories:
+            fname = os.path.join(directory, subdir, basename)
+            if not os.path.exists(fname):
+                continue
+            md5 = self.checksums(directory).get(basename)
+            if md5 is None:
+                print('Ignoring {} as it has no recorded checksum.'.format(fname))
+            elif self.verify(fname, md5):
+                return fname
+            else:
+                print('Ignoring {} as its checksum does not match.'.format(fname))
+        return None
+
+    def add(self, fname):
+        """
+        Add the given distribution to the cache directory (if there is one),
+        recording its checksum in the manifest.
+
+        """
+        if self.cache_directory is None:
+            return None
+        subdir_path = os.path.join(self.cache_directory, self.subdir)
+        if not os.path.isdir(subdir_path):
+            os.makedirs(subdir_path)
+        basename = os.path.basename(fname)
+        target = os.path.join(subdir_path, basename)
+        if os.path.abspath(fname) != target:
+            shutil.copy2(fname, target)
+
+        manifest_fname = os.path.join(subdir_path, self.MANIFEST)
+        manifest = {}
+        if os.path.exists(manifest_fname):
+            with open(manifest_fname, 'r') as fh:
+                manifest = json.load(fh)
+        manifest[basename] = {'md5': md5_file(target),
+                              'size': os.path.getsize(target)}
+        with open(manifest_fname, 'w') as fh:
+            json.dump(manifest, fh, indent=2, sort_keys=True)
+        return target
+
+    def remove(self, meta):
+        """Remove the given distribution from the cache directory (if there is one)."""
+        if self.cache_directory is None:
+            return
+        subdir, basename = self.key(meta).split('/', 1)
+        subdir_path = os.path.join(self.cache_directory, subdir)
+        if os.path.exists(os.path.join(subdir_path, basename)):
+            os.remove(os.path.join(subdir_path, basename))
+        manifest_fname = os.path.join(subdir_path, self.MANIFEST)
+        if os.path.exists(manifest_fname):
+            with open(manifest_fname, 'r') as fh:
+                manifest = json.load(fh)
+            if manifest.pop(basename, None) is not None:
+                with open(manifest_fname, 'w') as fh:
+                    json.dump(manifest, fh, indent=2, sort_keys=True)
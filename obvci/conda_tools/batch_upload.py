@@ -0,0 +1,98 @@
+"""
+Upload a batch of built distributions concurrently, within a bandwidth cap.
+
+Distributions are queued as they are built, and uploaded together (with
+:func:`~obvci.conda_tools.build.upload_file`) once the builds are done. The
+smallest are uploaded first, so that as many uploads as possible complete
+early, and all of the uploads share a single bandwidth cap.
+
+The filename (and dist name) of a distribution is worked out from its
+metadata when it is queued, as the metadata of a matrix case changes the
+global conda-build config when used, so can't be used from the upload threads.
+
+"""
+from __future__ import print_function
+
+from multiprocessing.pool import ThreadPool
+import os
+
+from . import build
+from .binstar_gateway import TokenBucket
+from .timing import clock
+
+
+class BatchUploader(object):
+    """
+    Upload the queued distributions to the owner's binstar account with up
+    to workers uploads at once, and (if given) a bandwidth cap (in bytes
+    per second) shared by all of them.
+
+    """
+    def __init__(self, cli, owner, workers=4, bandwidth=None):
+        self.cli = cli
+        self.owner = owner
+        self.workers = workers
+        #: A bytes token bucket shared by the uploads, or None.
+        self.throttle = None
+        if bandwidth:
+            self.throttle = TokenBucket(bandwidth, capacity=bandwidth)
+        #: The (dist name, filename, size, channels, build cache key) of the
+        #: queued distributions.
+        self.queue = []
+
+    def __len__(self):
+        return len(self.queue)
+
+    def add(self, meta, channels, build_key=None):
+        """
+        Queue the (built) distribution of the given meta for upload to the
+        channels, recording its build cache key (if given).
+
+        """
+        fname = self.artifact_path(meta)
+        self.queue.append((meta.dist(), fname, self.artifact_size(fname),
+                           list(channels), build_key))
+
+    @staticmethod
+    def artifact_path(meta):
+        from conda_build.build import bldpkg_path
+
+        return bldpkg_path(meta)
+
+    @staticmethod
+    def artifact_size(fname):
+        return os.path.getsize(fname)
+
+    def _upload(self, item):
+        dist, fname, _, channels, build_key = item
+        try:
+            build.upload_file(self.cli, fname, self.owner, channels=channels,
+                              throttle=self.throttle, build_key=build_key)
+        except Exception as err:
+            print('Failed to upload {}: {}'.format(dist, err))
+            return dist, err
+        return dist, None
+
+    def upload(self):
+        """
+        Upload (and empty) the queue, smallest distribution first, returning
+        the dist names of those which failed.
+
+        """
+        queue = sorted(self.queue, key=lambda item: item[2])
+        self.queue = []
+        if not queue:
+            return []
+
+        print('Uploading {} distributions ({} at a time)...'.format(len(queue), self.workers))
+        start = clock()
+        pool = ThreadPool(min(self.workers, len(queue)))
+        try:
+            results = list(pool.imap_unordered(self._upload, queue))
+        finally:
+            pool.close()
+            pool.join()
+        failed = [dist for dist, err in results if err is not None]
+        print('Uploaded {} distributions in {:.1f}s.'.format(len(queue) - len(failed),
+                                                             clock() - start))
+        return failed
@@ -0,0 +1,323 @@
+"""
+A gateway through which all of the calls to a binstar client are made.
+
+The gateway counts the calls, bytes and latencies of each endpoint (the
+client method called), keeps to a token-bucket request rate, and backs off
+(and retries) when anaconda.org responds with a 429 or a 5xx (or, for a call
+which changes something, only with a 429 or 503, as the change may otherwise
+have been made)::
+
+    cli = BinstarGateway(get_binstar(args), rate=5, burst=10)
+    cli.distribution(owner, name, version, fname)
+    cli.write_report()
+
+"""
+from __future__ import print_function
+
+from collections import OrderedDict
+import os
+import random
+import sys
+import threading
+import time
+import weakref
+
+from .timing import clock
+
+
+#: The statuses of the responses which are retried (after backing off).
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+#: The statuses of the responses to requests which were turned away before
+#: being handled, so can be retried even if they aren't idempotent.
+NOT_HANDLED_STATUSES = (429, 503)
+
+#: The endpoints whose calls aren't idempotent (e.g. retrying an add_release
+#: which was made, but whose response was a 502, fails with a conflict).
+NON_IDEMPOTENT_ENDPOINTS = frozenset(['add_package', 'add_release', 'remove_dist',
+                                      'upload', 'stage', 'commit'])
+
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket of rate tokens per second, holding up to
+    capacity tokens. A rate of None never waits.
+
+    Tokens can be requests, or (e.g. to cap bandwidth) bytes. A request for
+    more tokens than the capacity waits for a full bucket, and leaves it in
+    debt.
+
+    """
+    def __init__(self, rate=None, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate or 1)
+        self.tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _wait_time(self, tokens):
+        now = clock()
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        wait = self._paused_until - now
+        if wait > 0:
+            return wait
+        needed = min(tokens, self.capacity)
+        if not self.rate or self.tokens >= needed:
+            self.tokens -= tokens
+            return 0
+        return (needed - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """Wait for (and take) the given number of tokens, returning the time waited."""
+        waited = 0
+        while True:
+            with self._lock:
+                wait = self._wait_time(tokens)
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """Hand out no tokens for the given time (e.g. after a 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, clock() + seconds)
+
+
+def percentile(sorted_values, fraction):
+    """The nearest-rank percentile of the (sorted) values."""
+    if not sorted_values:
+        return None
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _file_size(value):
+    """The number of bytes remaining in a file-like value, or None if it isn't one."""
+    if not (hasattr(value, 'read') and hasattr(value, 'seek') and hasattr(value, 'tell')):
+        return None
+    position = value.tell()
+    value.seek(0, os.SEEK_END)
+    size = value.tell() - position
+    value.seek(position)
+    return size
+
+
+class BinstarGateway(object):
+    """
+    Wrap a binstar client so that each of its calls is counted and timed,
+    keeps to the given request rate (per second, with bursts of up to
+    burst requests) and is retried up to max_retries times, with
+    exponential backoff from backoff seconds, on a 429 or 5xx response.
+
+    All other attributes are those of the wrapped client.
+
+    """
+    def __init__(self, cli, rate=None, burst=None, max_retries=5, backoff=1,
+                 max_backoff=60):
+        self.cli = cli
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+        session = getattr(cli, 'session', None)
+        if session is not None and hasattr(session, 'hooks'):
+            session.hooks.setdefault('response', []).append(self._response_hook)
+
+    def configure(self, rate=None, burst=None, max_retries=None, backoff=None):
+        """Change the request rate and (when given) the retry policy."""
+        self.bucket = TokenBucket(rate, burst)
+        if max_retries is not None:
+            self.max_retries = max_retries
+        if backoff is not None:
+            self.backoff = backoff
+
+    def reset(self):
+        with self._lock:
+            #: A mapping of endpoint to its calls, retries, errors, bytes
+            #: sent and received, time waiting for the bucket and latencies.
+            self.stats = OrderedDict()
+
+    def _endpoint_stats(self, endpoint):
+        with self._lock:
+            if endpoint not in self.stats:
+                self.stats[endpoint] = {'calls': 0, 'requests': 0, 'retries': 0,
+                                        'errors': 0, 'bytes_sent': 0, 'bytes_received': 0,
+                                        'throttled': 0.0, 'latencies': []}
+            return self.stats[endpoint]
+
+    def record(self, endpoint, **amounts):
+        """Add the given amounts (e.g. bytes_sent=10) to the stats of the endpoint."""
+        stats = self._endpoint_stats(endpoint)
+        with self._lock:
+            for key, amount in amounts.items():
+                stats[key] += amount
+
+    def _response_hook(self, response, *args, **kwargs):
+        endpoint = getattr(self._local, 'endpoint', None)
+        if endpoint is not None:
+            self._local.response = response
+            request_length = response.request.headers.get('Content-Length') or 0
+            self.record(endpoint, requests=1, bytes_sent=int(request_length),
+                      bytes_received=int(response.headers.get('Content-Length') or 0))
+        return response
+
+    def __getattr__(self, name):
+        if name == 'cli':
+            raise AttributeError(name)
+        attr = getattr(self.cli, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self.call(name, attr, *args, **kwargs)
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        return call
+
+    def retry_delay(self, attempt, response=None):
+        """The time to wait before the given (1-based) retry."""
+        retry_after = None
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        # Jitter, so that parallel callers don't retry in lockstep.
+        return delay * (0.5 + random.random() / 2)
+
+    def retry_statuses(self, endpoint):
+        """The statuses of the responses on which a call to the endpoint is retried."""
+        if endpoint in NON_IDEMPOTENT_ENDPOINTS:
+            return NOT_HANDLED_STATUSES
+        return RETRY_STATUSES
+
+    def call(self, endpoint, function, *args, **kwargs):
+        """Call the given function of the client, as the given endpoint."""
+        import binstar_client
+
+        retry_statuses = self.retry_statuses(endpoint)
+        files = [(value, value.tell()) for value in list(args) + list(kwargs.values())
+                 if _file_size(value) is not None]
+        self.record(endpoint, calls=1)
+        attempt = 0
+        while True:
+            self.record(endpoint, throttled=self.bucket.acquire(),
+                      bytes_sent=sum(_file_size(value) for value, _ in files))
+            self._local.endpoint, self._local.response = endpoint, None
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            except binstar_client.errors.BinstarError as err:
+                status = err.args[1] if len(err.args) > 1 else None
+                if status not in retry_statuses or attempt >= self.max_retries:
+                    self.record(endpoint, errors=1)
+                    raise
+            finally:
+                self._endpoint_stats(endpoint)['latencies'].append(clock() - start)
+                self._local.endpoint = None
+            attempt += 1
+            delay = self.retry_delay(attempt, self._local.response)
+            print('{} failed with a {} response, retrying in {:.1f}s ({} of {}).'
+                  ''.format(endpoint, status, delay, attempt, self.max_retries))
+            if status == 429:
+                # Slow down every caller, not just this one.
+                self.bucket.pause(delay)
+            self.record(endpoint, retries=1)
+            time.sleep(delay)
+            for value, position in files:
+                value.seek(position)
+
+    # The client's private API (its session, domain and _check_response) is
+    # only used by the two methods below, for the requests which the client
+    # has no method for (e.g. streamed channel listings and chunked uploads).
+
+    def request(self, method, url, authenticated=True, **kwargs):
+        """
+        Make a request with the given method, returning its (unchecked)
+        response. A url starting with "/" is relative to the client's
+        domain.
+
+        An authenticated request is made through the client's session. Any
+        other (e.g. to a pre-signed storage URL) is made without the
+        client's credentials, but verifies certificates as the session does.
+
+        """
+        import requests
+
+        if url.startswith('/'):
+            url = self.cli.domain + url
+        if authenticated:
+            return self.cli.session.request(method, url, **kwargs)
+        kwargs.setdefault('verify', self.cli.session.verify)
+        return requests.request(method, url, **kwargs)
+
+    def check_response(self, response, allowed=(200,)):
+        """
+        Raise the client's error (e.g. binstar_client.NotFound) for the
+        response if its status isn't one of those allowed.
+
+        """
+        self.cli._check_response(response, list(allowed))
+
+    def report(self):
+        """Return an ordered dictionary of endpoint to its (summarised) stats."""
+        report = OrderedDict()
+        with self._lock:
+            for endpoint, stats in self.stats.items():
+                latencies = sorted(stats['latencies'])
+                summary = OrderedDict((key, value) for key, value in stats.items()
+                                      if key != 'latencies')
+                for name, fraction in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1)]:
+                    summary[name] = percentile(latencies, fraction)
+                report[endpoint] = summary
+        return report
+
+    def write_report(self, stream=None):
+        """
+        Write a table of the calls to (and latencies of) each endpoint, to
+        stderr by default (as stdout may be reserved, e.g. for a json plan).
+
+        """
+        stream = stream or sys.stderr
+        report = self.report()
+        if not report:
+            return
+        stream.write('anaconda.org API calls:\n')
+        stream.write('    {:<28} {:>6} {:>7} {:>6} {:>10} {:>10} {:>8} {:>8} {:>8} {:>8}\n'
+                     ''.format('endpoint', 'calls', 'retries', 'errors', 'sent', 'received',
+                               'p50', 'p90', 'p99', 'max'))
+        for endpoint, summary in report.items():
+            stream.write('    {:<28} {calls:>6} {retries:>7} {errors:>6} {bytes_sent:>10} '
+                         '{bytes_received:>10} {p50:>7.3f}s {p90:>7.3f}s {p99:>7.3f}s '
+                         '{max:>7.3f}s\n'.format(endpoint, **summary))
+
+
+_gateways = weakref.WeakKeyDictionary()
+
+
+def gateway(binstar_cli):
+    """
+    Return the gateway of the given binstar client (which may already be a
+    gateway), creating one with the default policy if it has none.
+
+    """
+    if isinstance(binstar_cli, BinstarGateway):
+        return binstar_cli
+    try:
+        return _gateways[binstar_cli]
+    except KeyError:
+        result = _gateways[binstar_cli] = BinstarGateway(binstar_cli)
+    except TypeError:
+        # The client can't be weakly referenced, so can't share a gateway.
+        result = BinstarGateway(binstar_cli)
+    return result
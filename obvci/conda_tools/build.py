@@ -1,36 +1,98 @@
 from __future__ import print_function
 
+from contextlib import contextmanager
 import os
 import shutil
 
-import conda_build.build as build_module
-from conda_build.metadata import MetaData
-import conda_build.config
-from conda.lock import Locked
-from conda_build.build import bldpkg_path
-import binstar_client
-from binstar_client.utils.detect import detect_package_type, get_attrs
+from .binstar_gateway import gateway
+from .build_cache import BUILD_KEY_ATTR
+from .streaming_upload import stream_upload
+from .timing import dist_argument, timed, timed_function
 
-from . import inspect_binstar
 
+@contextmanager
+def locked(path, dist=None):
+    """
+    Hold conda's lock on the given path, timing the wait for it separately
+    (as build.lock_wait) so that contention for it shows up in the trace.
 
-def build(meta, test=True):
-    """Build (and optionally test) a recipe directory."""
-    with Locked(conda_build.config.croot):
+    """
+    from conda.lock import Locked
+
+    lock = Locked(path)
+    with timed('build.lock_wait', dist):
+        lock.__enter__()
+    try:
+        yield
+    finally:
+        lock.__exit__(None, None, None)
+
+
+@timed_function('build.build', dist_argument(0, 'meta'))
+def build(meta, test=True, channel_urls=()):
+    """
+    Build (and optionally test) a recipe directory.
+
+    The given channel_urls are put ahead of the configured channels when
+    resolving the build and test environments.
+
+    """
+    import conda_build.build as build_module
+    import conda_build.config
+
+    # Only pass the channels through when they are given, so that older
+    # versions of conda-build continue to work.
+    channel_kwargs = {}
+    if channel_urls:
+        channel_kwargs['channel_urls'] = list(channel_urls)
+    dist = meta.dist()
+    with locked(conda_build.config.croot, dist):
         meta.check_fields()
         if os.path.exists(conda_build.config.config.info_dir):
             shutil.rmtree(conda_build.config.config.info_dir)
-        build_module.build(meta, verbose=False, post=None)
+        with timed('build.conda_build', dist):
+            build_module.build(meta, verbose=False, post=None, **channel_kwargs)
         if test:
-            build_module.test(meta, verbose=False)
+            with timed('test', dist):
+                build_module.test(meta, verbose=False, **channel_kwargs)
         return meta
 
 
-def upload(cli, meta, owner, channels=['main']):
-    """Upload a distribution, given the build metadata."""
-    fname = bldpkg_path(meta)
+def upload(cli, meta, owner, channels=['main'], throttle=None, build_key=None):
+    """
+    Upload a distribution, given the build metadata. The upload is sent no
+    faster than the (bytes) throttle allows, if given. The build cache key
+    of the distribution, if given, is recorded in its attrs.
+
+    """
+    from conda_build.build import bldpkg_path
+
+    return upload_file(cli, bldpkg_path(meta), owner, channels=channels,
+                       throttle=throttle, build_key=build_key)
+
+
+def _file_dist(cli, fname, *args, **kwargs):
+    """The dist name of the distribution file of an upload_file call."""
+    return os.path.basename(fname)[:-len('.tar.bz2')]
+
+
+@timed_function('build.upload', _file_dist)
+def upload_file(cli, fname, owner, channels=['main'], throttle=None, build_key=None):
+    """
+    Upload the given distribution file, as with :func:`upload`.
+
+    Unlike the build metadata (which, for a matrix case, changes the global
+    conda-build config when used), the filename can be used from any thread.
+
+    """
+    import binstar_client
+    from binstar_client.utils.detect import detect_package_type, get_attrs
+
+    cli = gateway(cli)
     package_type = detect_package_type(fname)
     package_attrs, release_attrs, file_attrs = get_attrs(package_type, fname)
+    if build_key is not None:
+        file_attrs['attrs'][BUILD_KEY_ATTR] = build_key
     package_name = package_attrs['name']
     version = release_attrs['version']
 
@@ -59,11 +121,10 @@ def upload(cli, meta, owner, channels=['main']):
         print('Distribution %s already exists ... removing' % (file_attrs['basename'],))
         cli.remove_dist(owner, package_name, version, file_attrs['basename'])
 
-    with open(fname, 'rb') as fd:
-        print('\nUploading file %s/%s/%s/%s to %s...' % (owner, package_name, version, file_attrs['basename'], channels))
-        upload_info = cli.upload(owner, package_name, version, file_attrs['basename'],
-                                 fd, package_type, description='',
-                                 dependencies=file_attrs.get('dependencies'),
-                                 attrs=file_attrs['attrs'],
-                                 channels=channels)
-        return upload_info
+    print('\nUploading file %s/%s/%s/%s to %s...' % (owner, package_name, version, file_attrs['basename'], channels))
+    upload_info = stream_upload(cli, owner, package_name, version, file_attrs['basename'],
+                                fname, package_type, description='',
+                                dependencies=file_attrs.get('dependencies'),
+                                attrs=file_attrs['attrs'],
+                                channels=channels, throttle=throttle)
+    return upload_info
@@ -0,0 +1,165 @@
+"""
+A content-addressed cache of built distributions.
+
+The cache key of a distribution is computed from the Merkle hash of its
+recipe directory, its special version case (e.g. CONDA_PY, CONDA_NPY) and the
+hashes of its resolved build dependencies. Consequently, changing a recipe's
+build.sh without bumping its build number results in a new key (and a
+rebuild), whereas an unchanged recipe reuses the cached distribution.
+
+The key is also recorded (as the ``obvci_build_key`` attr) on each
+distribution uploaded to binstar, so that a cold cache doesn't rebuild
+distributions which are already on binstar and haven't changed. Those on
+binstar without a key (uploaded before the build cache was used) are
+rebuilt, unless they are explicitly trusted.
+
+"""
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+from .from_conda_manifest_core_vn_matrix import compatible_cases, unsatisfiable_errors
+from .local_channel import md5_file
+
+
+#: The binstar distribution attr in which the build cache key is recorded.
+BUILD_KEY_ATTR = 'obvci_build_key'
+
+def tree_hash(path):
+    """
+    Return the Merkle hash of the given file or directory.
+
+    The hash of a directory is computed from the (sorted) names and hashes
+    of its contents, so any change to any file within it changes the hash.
+
+    """
+    hasher = hashlib.sha256()
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            child = os.path.join(path, name)
+            kind = 'tree' if os.path.isdir(child) else 'blob'
+            hasher.update('{} {} {}\n'.format(kind, name,
+                                              tree_hash(child)).encode('utf-8'))
+    else:
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(2 ** 20), b''):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _dist_name(dist):
+    return dist.rsplit('-', 2)[0]
+
+
+def resolved_build_dependencies(meta, index, upstream_keys, resolve=None,
+                                upstream_cases=None):
+    """
+    Return a sorted list of identifiers of the build dependencies of the
+    given distribution.
+
+    Dependencies which are built in this run (those in upstream_keys, which
+    maps dist name to cache key) are identified by their cache key. Of the
+    matrix cases of such a dependency (upstream_cases maps dist name to
+    special versions), only those built for the same special versions as
+    the given distribution are depended on. All other
+    dependencies are resolved against the given index and identified by their
+    md5. The given conda Resolve of the index is used, if given, rather
+    than creating one.
+
+    """
+    import conda.resolve
+    from conda.resolve import MatchSpec
+
+    specs = [ms.spec for ms in meta.ms_depends('build')]
+    case = getattr(meta, 'special_versions', ())
+    upstream_cases = upstream_cases or {}
+    upstream_names = set(_dist_name(dist) for dist in upstream_keys)
+    dependencies = []
+    external_specs = []
+    for spec in specs:
+        ms = MatchSpec(spec)
+        if ms.name in upstream_names:
+            dependencies.extend(key for dist, key in upstream_keys.items()
+                                if ms.match(dist + '.tar.bz2') and
+                                compatible_cases(case, upstream_cases.get(dist, ())))
+        else:
+            external_specs.append(spec)
+
+    if external_specs:
+        try:
+            if resolve is None:
+                resolve = conda.resolve.Resolve(index)
+            fns = resolve.solve(external_specs)
+        except unsatisfiable_errors() as err:
+            print('Unable to resolve the build dependencies of {} ({}). The '
+                  'unresolved specs will be used in the cache key.'
+                  ''.format(meta.dist(), err), file=sys.stderr)
+            dependencies.extend(external_specs)
+        else:
+            dependencies.extend(index[fn].get('md5', fn) for fn in fns)
+    return sorted(dependencies)
+
+
+class BuildCache(object):
+    """
+    A directory of built distributions, keyed by the hash of everything which
+    went into building them.
+
+    """
+    def __init__(self, directory):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+
+    def key(self, meta, index, upstream_keys=None, resolve=None, upstream_cases=None):
+        """
+        Compute the cache key of the given distribution.
+
+        upstream_keys is a dictionary of dist name to cache key (and
+        upstream_cases of dist name to special versions) of the distributions
+        built (before this one) in the same run, and resolve is a (reusable)
+        conda Resolve of the index.
+
+        """
+        special_versions = getattr(meta, 'special_versions', ())
+        content = {'recipe': tree_hash(meta.path),
+                   'special_versions': [list(case) for case in special_versions],
+                   'build_dependencies': resolved_build_dependencies(meta, index,
+                                                                     upstream_keys or {},
+                                                                     resolve, upstream_cases)}
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Return the filename of the cached distribution, or None."""
+        entry_path = self._entry_path(key)
+        entry_fname = os.path.join(entry_path, 'entry.json')
+        if not os.path.exists(entry_fname):
+            return None
+        with open(entry_fname, 'r') as fh:
+            entry = json.load(fh)
+        fname = os.path.join(entry_path, entry['basename'])
+        if not os.path.exists(fname) or md5_file(fname) != entry['md5']:
+            print('Ignoring the corrupt build cache entry {}'.format(entry_path))
+            return None
+        return fname
+
+    def put(self, key, fname):
+        """Store the given distribution under the given key."""
+        entry_path = self._entry_path(key)
+        if not os.path.isdir(entry_path):
+            os.makedirs(entry_path)
+        basename = os.path.basename(fname)
+        target = os.path.join(entry_path, basename)
+        shutil.copy2(fname, target)
+        with open(os.path.join(entry_path, 'entry.json'), 'w') as fh:
+            json.dump({'basename': basename, 'md5': md5_file(target)}, fh)
+        return target
+
+    def remove(self, key):
+        """Remove the distribution stored under the given key (if there is one)."""
+        shutil.rmtree(self._entry_path(key), ignore_errors=True)
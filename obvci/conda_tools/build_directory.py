@@ -8,31 +8,50 @@ defined), and the next package will be processed.
 """
 from __future__ import print_function
 
+import json
 import logging
+import multiprocessing
 import os
+import shutil
 import subprocess
+import sys
+import time
 from argparse import Namespace
-
-from binstar_client.utils import get_binstar
-import binstar_client
-from conda.api import get_index
-from conda_build.metadata import MetaData
-from conda_build.build import bldpkg_path
-import conda.config
+from contextlib import contextmanager
 
 from . import order_deps
 from . import build
 from . import inspect_binstar
+from . import prefetch
+from .artifact_index import LocalArtifactIndex
+from .batch_upload import BatchUploader
+from .binstar_gateway import BinstarGateway
+from .build_cache import BUILD_KEY_ATTR, BuildCache
+from .ccache import CompilerCache
+from .channel_promotion import ChannelListingCache, PromotionBatch
+from .env_pool import EnvironmentPool, pooled_environments
+from .local_channel import LocalChannel
+from .pipelined_tests import TestPipeline
+from .profiling import PhaseProfiler
+from .solve_cache import SolveCache, cached_environments
+from .timing import timed, timed_function, timings
 from . import from_conda_manifest_core_vn_matrix as vn_matrix
+from .from_conda_manifest_core_vn_matrix import compatible_cases
 
 
 def package_built_name(package, root_dir):
+    from conda_build.build import bldpkg_path
+    from conda_build.metadata import MetaData
+
     package_dir = os.path.join(root_dir, package)
     meta = MetaData(package_dir)
     return bldpkg_path(meta)
 
 
 def distribution_exists(binstar_cli, owner, metadata):
+    import binstar_client
+    import conda.config
+
     fname = '{}/{}.tar.bz2'.format(conda.config.subdir, metadata.dist())
     try:
         r = binstar_cli.distribution(owner, metadata.name(), metadata.version(),
@@ -43,12 +62,16 @@ def distribution_exists(binstar_cli, owner, metadata):
     return exists
 
 
-def recipes_to_build(binstar_cli, owner, channel, recipe_metas):
+def recipes_to_build(binstar_cli, owner, channel, recipe_metas,
+                     artifact_index=None):
     for meta in recipe_metas:
+        if artifact_index is not None and artifact_index.find(meta):
+            continue
         if not inspect_binstar.distribution_exists(binstar_cli, owner, meta):
             yield meta
 
 
+@timed_function('fetch_metas')
 def fetch_metas(directory):
     """
     Get the build metadata of all recipes in a directory.
@@ -56,31 +79,59 @@ def fetch_metas(directory):
     The recipes will be sorted by the order of their directory name.
 
     """
+    from conda_build.metadata import MetaData
+
     packages = []
     for package_name in sorted(os.listdir(directory)):
         package_dir = os.path.join(directory, package_name)
         meta_yaml = os.path.join(package_dir, 'meta.yaml')
 
         if os.path.isdir(package_dir) and os.path.exists(meta_yaml):
-            packages.append(MetaData(package_dir))
+            with timed('render', package_name):
+                packages.append(MetaData(package_dir))
 
     return packages
 
 
+def dependency_names(meta):
+    """The names of the (build and run) dependencies of the given meta."""
+    all_deps = ((meta.get_value('requirements/run', []) or []) +
+                (meta.get_value('requirements/build', []) or []))
+    # Remove version information from the name.
+    return [dep.split(' ', 1)[0] for dep in all_deps]
+
+
 def sort_dependency_order(metas):
     """Sort the metas into the order that they must be built."""
     meta_named_deps = {}
     buildable = [meta.name() for meta in metas]
     for meta in metas:
-        all_deps = ((meta.get_value('requirements/run', []) or []) +
-                    (meta.get_value('requirements/build', []) or []))
-        # Remove version information from the name.
-        all_deps = [dep.split(' ', 1)[0] for dep in all_deps]
-        meta_named_deps[meta.name()] = [dep for dep in all_deps if dep in buildable]
+        meta_named_deps[meta.name()] = [dep for dep in dependency_names(meta)
+                                        if dep in buildable]
     sorted_names = list(order_deps.resolve_dependencies(meta_named_deps))
     return sorted(metas, key=lambda meta: sorted_names.index(meta.name()))
 
 
+def dependency_edges(meta, upstream):
+    """
+    Return the dist names of those of the upstream distributions which the
+    given distribution depends on. upstream is a list of (name,
+    special_versions, dist name) of the distributions built before it.
+
+    """
+    names = set(dependency_names(meta))
+    case = getattr(meta, 'special_versions', ())
+    return [dist for name, upstream_case, dist in upstream
+            if name in names and compatible_cases(case, upstream_case)]
+
+
+def describe_distribution(meta):
+    """A JSON serialisable description of the given (baked) distribution."""
+    return {'recipe': os.path.basename(meta.path),
+            'special_versions': [list(case) for case in getattr(meta, 'special_versions', ())],
+            'dist': meta.dist()}
+
+
 class BakedDistribution(object):
     """
     Represents a conda pacakge, with the appropriate special case
@@ -122,12 +173,15 @@ class BakedDistribution(object):
         return result
 
     @classmethod
-    def compute_matrix(cls, meta, index=None, extra_conditions=None):
+    @timed_function('compute_matrix')
+    def compute_matrix(cls, meta, index=None, extra_conditions=None,
+                       resolve=None):
         if index is None:
+            from conda.api import get_index
             with vn_matrix.override_conda_logging('WARN'):
                 index = get_index()
 
-        cases = vn_matrix.special_case_version_matrix(meta, index)
+        cases = vn_matrix.special_case_version_matrix(meta, index, resolve)
 
         if extra_conditions:
             cases = list(vn_matrix.filter_cases(cases, index,
@@ -152,6 +206,8 @@ class Builder(object):
         self.upload_owner = upload_owner
         self.upload_channel = upload_channel
 
+        from binstar_client.utils import get_binstar
+
         self.binstar_token = os.environ.get('BINSTAR_TOKEN', None)
         self.can_upload = self.binstar_token is not None
 
@@ -160,7 +216,106 @@ class Builder(object):
             print('To automatically upload from this script, define the BINSTAR_TOKEN env variable.')
             print('This is done automatically on the travis-ci system once the PR has been merged.')
 
-        self.binstar_cli = get_binstar(Namespace(token=self.binstar_token, site=None))
+        #: A :class:`~obvci.conda_tools.binstar_gateway.BinstarGateway` of
+        #: the binstar client, through which every call to anaconda.org is made.
+        self.binstar_cli = BinstarGateway(get_binstar(Namespace(token=self.binstar_token,
+                                                                site=None)))
+
+        #: A :class:`~obvci.conda_tools.local_channel.LocalChannel` which
+        #: is given every distribution built, and is put first for all
+        #: subsequent builds. None to disable.
+        self.local_channel = None
+
+        #: A :class:`~obvci.conda_tools.artifact_index.LocalArtifactIndex`
+        #: which is consulted before binstar when deciding what to build.
+        #: None to disable.
+        self.artifact_index = None
+        #: A mapping of dist name to the verified local artifact, populated
+        #: when computing the distributions which need building.
+        self.local_artifacts = {}
+
+        #: A :class:`~obvci.conda_tools.build_cache.BuildCache`. When given,
+        #: a distribution is rebuilt whenever its cache key is neither in the
+        #: cache nor recorded on its distribution on binstar. None to disable.
+        self.build_cache = None
+        #: A mapping of dist name to build cache key.
+        self.build_cache_keys = {}
+        #: Whether, with a build cache, to take distributions on binstar
+        #: without a recorded key (uploaded before the build cache was used)
+        #: to be up to date, rather than rebuilding them.
+        self.trust_unkeyed_distributions = False
+
+        #: Whether to test built distributions in a worker process, whilst
+        #: the next distribution is being built.
+        self.pipeline_tests = False
+        #: Whether, when pipelining the tests, to hold back the build of a
+        #: distribution until the tests of its dependencies have passed.
+        self.strict_test_order = False
+        self.test_pipeline = None
+        #: The dist names of the distributions which failed their tests.
+        self.failed_tests = []
+
+        #: A :class:`~obvci.conda_tools.batch_upload.BatchUploader` to which
+        #: built distributions are queued, and which uploads them once all of
+        #: the builds are done. None to upload each as it is built.
+        self.uploader = None
+        #: The dist names of the distributions which failed to upload.
+        self.failed_uploads = []
+
+        #: A :class:`~obvci.conda_tools.channel_promotion.ChannelListingCache`
+        #: of the channels of the binstar account.
+        self.channel_listings = ChannelListingCache(self.binstar_cli)
+        #: A :class:`~obvci.conda_tools.channel_promotion.PromotionBatch` of the
+        #: existing distributions to add to the upload channel, once all of the
+        #: builds are done.
+        self.promotions = PromotionBatch(self.binstar_cli)
+        #: The dist names of the distributions which couldn't be added to the
+        #: upload channel.
+        self.failed_promotions = []
+
+        #: Whether to only re-run the tests of existing distributions.
+        self.test_only = False
+        #: The number of distributions to test in parallel with test_only.
+        self.test_workers = multiprocessing.cpu_count()
+
+        #: Whether to download the sources and environment packages of all
+        #: of the distributions to be built before building them.
+        self.prefetch = False
+        #: The number of concurrent downloads when prefetching.
+        self.prefetch_workers = 4
+
+        #: A :class:`~obvci.conda_tools.solve_cache.SolveCache` from which the
+        #: build and test environments are created. None to disable.
+        self.solve_cache = None
+
+        #: An :class:`~obvci.conda_tools.env_pool.EnvironmentPool` from which
+        #: the build environments are cloned. None to disable.
+        self.env_pool = None
+
+        #: A :class:`~obvci.conda_tools.ccache.CompilerCache` shared by all
+        #: of the builds. None to disable.
+        self.compiler_cache = None
+
+        #: Whether to keep watching the recipes, rebuilding those which change
+        #: (and their dependents).
+        self.watch = False
+        #: The interval (in seconds) at which the recipes are checked for changes.
+        self.watch_interval = 2
+
+        #: Whether to only write the build plan, without building anything.
+        self.dry_run = False
+        #: The format of the build plan with dry_run (text, json or jsonl).
+        self.plan_format = 'text'
+
+        #: The file to which to write the JSON timing report of the run. None
+        #: to disable.
+        self.timing_report = None
+        #: The file to which to write the Chrome trace of the run. None to
+        #: disable.
+        self.trace = None
+        #: A :class:`~obvci.conda_tools.profiling.PhaseProfiler` of the
+        #: planning phases. None to disable.
+        self.profiler = None
 
     @classmethod
     def define_args(cls, parser):
@@ -177,6 +332,107 @@ class Builder(object):
                             help="Extra conditions for computing the build matrix.",
                             default=['python >=2']  # Thanks for the python 1.0 build Continuum...
                             )
+        parser.add_argument("--local-channel",
+                            help="""A directory to keep as a local conda channel of every distribution
+                                    built. The channel is put first for subsequent builds, so recipes
+                                    which depend on each other don't need an upload in between.""")
+        parser.add_argument("--artifact-cache",
+                            help="""A persistent directory of previously built distributions. When given,
+                                    this directory and the conda-build root are checked for a
+                                    (checksum verified) distribution before binstar is queried, and
+                                    built distributions are added to it.""")
+        parser.add_argument("--build-cache",
+                            help="""A persistent directory of distributions keyed by the hash of their
+                                    recipe, special versions and resolved build dependencies. When
+                                    given, distributions are built if (and only if) they are neither
+                                    in the cache nor on binstar with the same key.""")
+        parser.add_argument("--trust-unkeyed-distributions", action='store_true',
+                            help="""With --build-cache, take distributions on binstar which were uploaded
+                                    without a build cache key (i.e. before --build-cache was used) to
+                                    be up to date, rather than rebuilding (and replacing) them.""")
+        parser.add_argument("--pipeline-tests", action='store_true',
+                            help="""Test each built distribution in a separate worker (with its own test
+                                    prefix) whilst the next distribution is being built. Distributions
+                                    are only uploaded once their tests have passed.""")
+        parser.add_argument("--strict-test-order", action='store_true',
+                            help="""With --pipeline-tests, don't build a distribution until the tests of
+                                    its dependencies have passed.""")
+        parser.add_argument("--test-only", action='store_true',
+                            help="""Don't build anything, but re-run the tests of the existing
+                                    distributions (found locally, or downloaded from the owner's
+                                    binstar account) in parallel.""")
+        parser.add_argument("--test-workers", type=int, default=multiprocessing.cpu_count(),
+                            help="""The number of distributions to test in parallel with --test-only.""")
+        parser.add_argument("--prefetch", action='store_true',
+                            help="""Download the sources and the build and test environment packages of
+                                    all of the distributions to be built before building them.""")
+        parser.add_argument("--prefetch-workers", type=int, default=4,
+                            help="""The number of concurrent downloads with --prefetch.""")
+        parser.add_argument("--solve-cache",
+                            help="""A directory in which to cache the solutions of the build and test
+                                    environments, so that they are reused across matrix cases (and runs)
+                                    rather than being solved again.""")
+        parser.add_argument("--env-pool",
+                            help="""A directory in which to keep (hardlinked) snapshots of recently used
+                                    build environments. Each build environment is cloned from the
+                                    closest snapshot, and only the packages which differ are changed.""")
+        parser.add_argument("--env-pool-size", type=float, default=10,
+                            help="""The disk usage (in GB) beyond which the least recently used build
+                                    environments are evicted from the --env-pool.""")
+        parser.add_argument("--ccache",
+                            help="""A persistent ccache directory through which every build compiles.
+                                    The cache hit rate of each build is reported at the end of the run.""")
+        parser.add_argument("--watch", action='store_true',
+                            help="""After building, keep watching the recipe directory. Whenever a recipe
+                                    changes, only it is read again and only its distributions (and
+                                    those of the recipes which depend on it) are rebuilt. Nothing is
+                                    uploaded whilst watching.""")
+        parser.add_argument("--watch-interval", type=float, default=2,
+                            help="""The interval (in seconds) at which the recipes are checked for
+                                    changes with --watch.""")
+        parser.add_argument("--dry-run", action='store_true',
+                            help="""Write the build plan, without building (or uploading) anything.""")
+        parser.add_argument("--plan-format", choices=['text', 'json', 'jsonl'], default='text',
+                            help="""The format of the --dry-run build plan. With json (a list) and jsonl
+                                    (a record per line) the plan is streamed to stdout as each
+                                    distribution is checked, and all other output goes to stderr.""")
+        parser.add_argument("--timing-report",
+                            help="""A file to which to write a JSON report of the time spent in (and the
+                                    number of calls to) each phase of the run, in total and per
+                                    distribution.""")
+        parser.add_argument("--trace",
+                            help="""A file to which to write a trace of every phase of every distribution
+                                    (render, matrix, binstar queries, the wait for the build lock,
+                                    build, test and upload) in the Chrome trace event format. Each
+                                    thread and worker process has its own track.""")
+        parser.add_argument("--profile-dir",
+                            help="""A directory to which to write a cProfile pstats file and a tracemalloc
+                                    summary for each of the planning phases (fetch_metas,
+                                    sort_dependency_order, compute_matrix and existence_checks).""")
+        parser.add_argument("--profile-top", type=int, default=25,
+                            help="""The number of lines to list in each tracemalloc summary of
+                                    --profile-dir.""")
+        parser.add_argument("--upload-workers", type=int, default=1,
+                            help="""The number of distributions to upload at once. With more than 1,
+                                    the built distributions are uploaded together (smallest first)
+                                    once all of the builds are done.""")
+        parser.add_argument("--upload-bandwidth", type=float,
+                            help="""The maximum bandwidth (in MB/s) shared by all of the uploads. Implies
+                                    uploading the built distributions together, once all of the
+                                    builds are done.""")
+        parser.add_argument("--promotion-workers", type=int, default=4,
+                            help="""The number of existing distributions to add to the channel at once,
+                                    once all of the builds are done.""")
+        parser.add_argument("--api-rate", type=float,
+                            help="""The maximum rate (in requests per second) of the calls to the
+                                    anaconda.org API. By default the rate isn't limited.""")
+        parser.add_argument("--api-burst", type=int,
+                            help="""The number of anaconda.org API calls which may be made in a burst,
+                                    above --api-rate. Defaults to --api-rate.""")
+        parser.add_argument("--api-retries", type=int, default=5,
+                            help="""The number of times to retry an anaconda.org API call which
+                                    responds with a 429 (rate limited) or 5xx, backing off
+                                    exponentially (or as the response's Retry-After asks).""")
 
     @classmethod
     def handle_args(cls, parsed_args):
@@ -184,6 +440,46 @@ class Builder(object):
                      getattr(parsed_args, 'upload-user'),
                      parsed_args.channel)
         result.extra_build_conditions = list(filter(None, parsed_args.extra_build_conditions))
+        if parsed_args.local_channel:
+            result.local_channel = LocalChannel(parsed_args.local_channel)
+        if parsed_args.artifact_cache:
+            import conda_build.config
+            result.artifact_index = LocalArtifactIndex([conda_build.config.croot],
+                                                       cache_directory=parsed_args.artifact_cache)
+        if parsed_args.build_cache:
+            result.build_cache = BuildCache(parsed_args.build_cache)
+        result.trust_unkeyed_distributions = parsed_args.trust_unkeyed_distributions
+        result.pipeline_tests = parsed_args.pipeline_tests
+        result.strict_test_order = parsed_args.strict_test_order
+        result.test_only = parsed_args.test_only
+        result.test_workers = parsed_args.test_workers
+        result.prefetch = parsed_args.prefetch
+        result.prefetch_workers = parsed_args.prefetch_workers
+        if parsed_args.solve_cache:
+            result.solve_cache = SolveCache(parsed_args.solve_cache)
+        if parsed_args.env_pool:
+            result.env_pool = EnvironmentPool(parsed_args.env_pool,
+                                              max_bytes=int(parsed_args.env_pool_size * 2 ** 30))
+        if parsed_args.ccache:
+            result.compiler_cache = CompilerCache(parsed_args.ccache)
+        result.watch = parsed_args.watch
+        result.watch_interval = parsed_args.watch_interval
+        result.dry_run = parsed_args.dry_run
+        result.plan_format = parsed_args.plan_format
+        result.timing_report = parsed_args.timing_report
+        result.trace = parsed_args.trace
+        if parsed_args.profile_dir:
+            result.profiler = PhaseProfiler(parsed_args.profile_dir, top=parsed_args.profile_top)
+        result.binstar_cli.configure(rate=parsed_args.api_rate, burst=parsed_args.api_burst,
+                                     max_retries=parsed_args.api_retries)
+        result.promotions.workers = parsed_args.promotion_workers
+        if parsed_args.upload_workers > 1 or parsed_args.upload_bandwidth:
+            bandwidth = None
+            if parsed_args.upload_bandwidth:
+                bandwidth = parsed_args.upload_bandwidth * 2 ** 20
+            result.uploader = BatchUploader(result.binstar_cli, result.upload_owner,
+                                            workers=parsed_args.upload_workers,
+                                            bandwidth=bandwidth)
         return result
 
     def fetch_all_metas(self):
@@ -192,14 +488,70 @@ class Builder(object):
 
         """
         conda_recipes_root = os.path.abspath(os.path.expanduser(self.conda_recipes_root))
-        recipe_metas = fetch_metas(conda_recipes_root)
-        recipe_metas = sort_dependency_order(recipe_metas)
+        with self._profile_context('fetch_metas'):
+            recipe_metas = fetch_metas(conda_recipes_root)
+        with self._profile_context('sort_dependency_order'):
+            recipe_metas = sort_dependency_order(recipe_metas)
         return recipe_metas
 
+    def find_local_artifacts(self, recipe_metas):
+        """Return a dictionary of dist name to verified local artifact."""
+        local_artifacts = {}
+        if self.artifact_index is not None:
+            for meta in recipe_metas:
+                fname = self.artifact_index.find(meta)
+                if fname is not None:
+                    local_artifacts[meta.dist()] = fname
+        if self.build_cache is not None:
+            for meta in recipe_metas:
+                fname = self.build_cache.get(self.build_cache_keys[meta.dist()])
+                if fname is not None:
+                    local_artifacts[meta.dist()] = fname
+        return local_artifacts
+
+    def compute_build_cache_keys(self, distributions, index):
+        """
+        Return a dictionary of dist name to build cache key for the given
+        distributions (which must be in build order).
+
+        """
+        import conda.resolve
+
+        # Solving against the index needs a Resolve, which is slow to create.
+        resolve = conda.resolve.Resolve(index)
+        keys, cases = {}, {}
+        for meta in distributions:
+            keys[meta.dist()] = self.build_cache.key(meta, index, keys, resolve=resolve,
+                                                     upstream_cases=cases)
+            cases[meta.dist()] = getattr(meta, 'special_versions', ())
+        return keys
+
+    def exists_remotely(self, meta):
+        """
+        Whether the given distribution exists on the owner's binstar account
+        (and, with a build cache, was built with the same cache key).
+
+        A distribution without a recorded key (i.e. uploaded before the build
+        cache was used) is rebuilt, unless trust_unkeyed_distributions is set.
+
+        """
+        if self.build_cache is None:
+            return inspect_binstar.distribution_exists(self.binstar_cli, self.upload_owner, meta)
+        info = inspect_binstar.distribution_info(self.binstar_cli, self.upload_owner, meta)
+        if info is None:
+            return False
+        key = (info.get('attrs') or {}).get(BUILD_KEY_ATTR)
+        if key is None:
+            return self.trust_unkeyed_distributions
+        return key == self.build_cache_keys[meta.dist()]
+
     def calculate_existing_distributions(self, recipe_metas):
-        # Figure out which distributions binstar.org already has.
+        # Figure out which distributions we already have locally, and then
+        # which of the remaining distributions binstar.org already has.
+        self.local_artifacts = self.find_local_artifacts(recipe_metas)
         existing_distributions = [meta for meta in recipe_metas
-                                  if inspect_binstar.distribution_exists(self.binstar_cli, self.upload_owner, meta)]
+                                  if meta.dist() in self.local_artifacts or
+                                  self.exists_remotely(meta)]
 
         print('Resolved dependencies, will be built in the following order: \n\t{}'.format(
                    '\n\t'.join(['{} (will be built: {})'.format(meta.dist(), meta not in existing_distributions)
@@ -210,49 +562,470 @@ class Builder(object):
         existing_distributions = self.calculate_existing_distributions(recipes)
         return [recipe not in existing_distributions for recipe in recipes]
 
+    def channel_urls(self):
+        """The channels to put ahead of the configured channels when building."""
+        urls = []
+        if self.local_channel is not None:
+            urls.append(self.local_channel.url)
+        return urls
+
     def build(self, meta):
         print('Building ', meta.dist())
-        if isinstance(meta, BakedDistribution):
-            with meta.vn_context():
-                build.build(meta.meta)
+        channel_urls = self.channel_urls()
+        # When the tests are pipelined they are run by the test pipeline.
+        test = self.test_pipeline is None
+        with self.build_environment(meta):
+            if isinstance(meta, BakedDistribution):
+                with meta.vn_context():
+                    build.build(meta.meta, test=test, channel_urls=channel_urls)
+            else:
+                build.build(meta, test=test, channel_urls=channel_urls)
+        # A distribution whose tests are pipelined is registered once they
+        # have passed (until then, builds resolve it from the build root).
+        if test:
+            self.register_artifact(meta)
+
+    def register_artifact(self, meta):
+        """Add the built (and tested) distribution to the local channel and caches."""
+        from conda_build.build import bldpkg_path
+
+        fname = bldpkg_path(meta)
+        if self.local_channel is not None:
+            self.local_channel.add(fname)
+        if self.artifact_index is not None:
+            self.artifact_index.add(fname)
+        if self.build_cache is not None:
+            self.build_cache.put(self.build_cache_keys[meta.dist()], fname)
+
+    def discard_artifact(self, meta):
+        """
+        Remove the built distribution, whose tests failed, from the build root,
+        the local channel and the caches, so that it isn't taken to exist.
+
+        """
+        from conda_build.build import bldpkg_path
+
+        fname = bldpkg_path(meta)
+        if os.path.exists(fname):
+            os.remove(fname)
+        if self.local_channel is not None:
+            self.local_channel.remove(os.path.basename(fname))
+        if self.artifact_index is not None:
+            self.artifact_index.remove(meta)
+        if self.build_cache is not None:
+            self.build_cache.remove(self.build_cache_keys[meta.dist()])
+
+    @contextmanager
+    def build_environment(self, meta):
+        """The context in which the given distribution is built."""
+        with self._solve_cache_context():
+            with self._env_pool_context():
+                with self._compiler_cache_context(meta):
+                    yield
+
+    @contextmanager
+    def _profile_context(self, phase):
+        if self.profiler is not None:
+            with self.profiler.phase(phase):
+                yield
         else:
-            build.build(meta)
+            yield
 
-    def main(self):
-        recipe_metas = self.fetch_all_metas()
-        index = get_index()
+    @contextmanager
+    def _compiler_cache_context(self, meta):
+        if self.compiler_cache is not None:
+            with self.compiler_cache.enabled(meta.dist()):
+                yield
+        else:
+            yield
+
+    @contextmanager
+    def _solve_cache_context(self):
+        if self.solve_cache is not None:
+            with cached_environments(self.solve_cache):
+                yield
+        else:
+            yield
+
+    @contextmanager
+    def _env_pool_context(self):
+        if self.env_pool is not None:
+            solve = self.solve_cache.solve if self.solve_cache is not None else None
+            with pooled_environments(self.env_pool, solve=solve):
+                yield
+        else:
+            yield
 
-        print('Resolving distributions from {} recipes... '.format(len(recipe_metas)))
+    def use_local_artifact(self, meta):
+        """Put the verified local artifact of the given distribution in the build root."""
+        from conda_build.build import bldpkg_path
 
+        fname = self.local_artifacts[meta.dist()]
+        target = bldpkg_path(meta)
+        print('Using the existing local artifact {}'.format(fname))
+        if os.path.abspath(fname) != os.path.abspath(target):
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            shutil.copy2(fname, target)
+        if self.local_channel is not None:
+            self.local_channel.add(target)
+
+    def compute_distributions(self, recipe_metas, index):
+        """Return the distributions of the build matrices of the given recipes."""
         all_distros = []
         for meta in recipe_metas:
             distros = BakedDistribution.compute_matrix(meta, index,
                                                        getattr(self, 'extra_build_conditions', []))
             all_distros.extend(distros)
+        return all_distros
+
+    def main(self):
+        timings.reset(tracing=self.trace is not None)
+        self.binstar_cli.reset()
+        try:
+            with timed('main'):
+                return self._main()
+        finally:
+            self.binstar_cli.write_report()
+            if self.timing_report:
+                timings.write_report(self.timing_report)
+                print('Wrote the timing report to {}'.format(self.timing_report), file=sys.stderr)
+            if self.trace:
+                timings.write_trace(self.trace)
+                print('Wrote the trace to {}'.format(self.trace), file=sys.stderr)
+
+    def _main(self):
+        from conda.api import get_index
+
+        if self.watch:
+            return self.watch_recipes()
+
+        plan_stream = sys.stdout
+        if self.dry_run and self.plan_format != 'text':
+            # Keep stdout for the plan alone.
+            sys.stdout = sys.stderr
+        try:
+            recipe_metas = self.fetch_all_metas()
+            with timed('get_index'):
+                index = get_index()
+
+            print('Resolving distributions from {} recipes... '.format(len(recipe_metas)))
+            with self._profile_context('compute_matrix'):
+                all_distros = self.compute_distributions(recipe_metas, index)
+            print('Computed that there are {} distributions from the {} '
+                  'recipes:'.format(len(all_distros), len(recipe_metas)))
+            if self.dry_run:
+                return self.write_plan(all_distros, index, plan_stream)
+        finally:
+            sys.stdout = plan_stream
+        self.build_distributions(all_distros, index)
+
+    def plan_records(self, distributions, index):
+        """
+        Generate a record of what would be done with each of the given
+        distributions (which must be in build order, against the given
+        index), as it is computed.
+
+        """
+        if self.build_cache is not None:
+            self.build_cache_keys = self.compute_build_cache_keys(distributions, index)
+        upstream = []
+        for meta in distributions:
+            record = describe_distribution(meta)
+            found_locally = meta.dist() in self.find_local_artifacts([meta])
+            exists = not found_locally and self.exists_remotely(meta)
+            record['will_build'] = not (found_locally or exists)
+
+            # The same decision as post_build.
+            if not self.can_upload:
+                action = 'none'
+            elif record['will_build']:
+                action = 'upload'
+            elif inspect_binstar.distribution_exists_on_channel(self.binstar_cli, self.upload_owner,
+                                                                meta, channel=self.upload_channel):
+                action = 'none'
+            elif exists or self.exists_remotely(meta):
+                action = 'add'
+            else:
+                action = 'upload'
+            record['channel_action'] = action
 
-        print('Computed that there are {} distributions from the {} '
-              'recipes:'.format(len(all_distros), len(recipe_metas)))
-        recipes_to_build = self.recipes_to_build(all_distros)
+            record['depends_on'] = dependency_edges(meta, upstream)
+            upstream.append((meta.name(), getattr(meta, 'special_versions', ()), meta.dist()))
+            yield record
+
+    def write_plan(self, distributions, index, stream=None):
+        """
+        Write the plan of the given distributions (which must be in build
+        order) to the given stream, in the plan_format. Nothing is built.
+
+        """
+        stream = stream or sys.stdout
+        with self._profile_context('existence_checks'):
+            if self.plan_format == 'text':
+                if self.build_cache is not None:
+                    self.build_cache_keys = self.compute_build_cache_keys(distributions, index)
+                self.calculate_existing_distributions(distributions)
+                return
+
+            if self.plan_format == 'json':
+                stream.write('[')
+            for i, record in enumerate(self.plan_records(distributions, index)):
+                line = json.dumps(record, sort_keys=True)
+                if self.plan_format == 'json':
+                    stream.write('\n' + line if i == 0 else ',\n' + line)
+                else:
+                    stream.write(line + '\n')
+                stream.flush()
+            if self.plan_format == 'json':
+                stream.write('\n]\n')
+
+    def watch_recipes(self):
+        """
+        Build the recipes, and then keep rebuilding those which change (along
+        with the recipes which depend on them) until interrupted.
+
+        The distributions are only built locally: uploading each rebuild
+        would replace the distribution on binstar whenever a recipe is saved.
+
+        """
+        from .planner import Planner
+
+        if self.can_upload:
+            print('Distributions built whilst watching are not uploaded.')
+        can_upload, self.can_upload = self.can_upload, False
+        planner = Planner(self.conda_recipes_root,
+                          getattr(self, 'extra_build_conditions', []))
+        planner.refresh(force_index=True)
+        to_build, rebuild = planner.plan(), False
+        try:
+            while True:
+                if to_build:
+                    try:
+                        self.build_distributions(to_build, planner.index, rebuild=rebuild)
+                    except SystemExit as err:
+                        print(err)
+                planned = set(dist.dist() for dist in planner.plan())
+                print('Watching {} for changes...'.format(planner.recipes_root))
+                changed, index_changed = set(), False
+                while not (changed or index_changed):
+                    time.sleep(self.watch_interval)
+                    changed, index_changed = planner.refresh()
+                affected = planner.dependents(changed)
+                if changed:
+                    print('Changed: {}. Rebuilding: {}.'.format(', '.join(sorted(changed)),
+                                                               ', '.join(sorted(affected))))
+                if index_changed:
+                    print('The index has changed.')
+                # Distributions which are new to the plan (e.g. because the
+                # index has changed since the last build) are built too.
+                to_build = [dist for dist in planner.plan()
+                            if os.path.basename(dist.meta.path) in affected or
+                            dist.dist() not in planned]
+                rebuild = True
+        except KeyboardInterrupt:
+            print('Stopped watching {}.'.format(planner.recipes_root))
+        finally:
+            self.can_upload = can_upload
+
+    def build_distributions(self, all_distros, index, rebuild=False):
+        """
+        Build (and upload) those of the given distributions, which must be in
+        build order, which don't already exist. If rebuild is True, all of the
+        given distributions are built regardless.
 
-        for meta, build_dist in zip(all_distros, recipes_to_build):
-            if build_dist:
-                self.build(meta)
-            self.post_build(meta, build_occured=build_dist)
+        """
+        self.failed_tests = []
+        self.failed_uploads = []
+        self.failed_promotions = []
+        # The channels may have changed since the last run (with watch).
+        self.channel_listings.invalidate()
+        if self.build_cache is not None:
+            self.build_cache_keys = self.compute_build_cache_keys(all_distros, index)
+
+        if self.test_only:
+            self.test_existing(all_distros)
+            if self.failed_tests:
+                sys.exit('TESTS FAILED: {}'.format(', '.join(self.failed_tests)))
+            return
+
+        if rebuild:
+            self.local_artifacts = {}
+            recipes_to_build = [True] * len(all_distros)
+        else:
+            with self._profile_context('existence_checks'):
+                recipes_to_build = self.recipes_to_build(all_distros)
+
+        if self.prefetch:
+            # The distributions being built can't be fetched, so are excluded.
+            prefetch.prefetch([meta for meta, build_dist in zip(all_distros, recipes_to_build)
+                               if build_dist],
+                              index, exclude_names=set(meta.name() for meta in all_distros),
+                              workers=self.prefetch_workers, solve_cache=self.solve_cache)
+
+        if self.pipeline_tests:
+            self.test_pipeline = TestPipeline(channel_urls=self.channel_urls())
+        try:
+            for meta, build_dist in zip(all_distros, recipes_to_build):
+                if build_dist:
+                    if not self.upstream_tests_passed(meta):
+                        print('Not building {} as the tests of one of its dependencies '
+                              'failed.'.format(meta.dist()))
+                        self.failed_tests.append(meta.dist())
+                        continue
+                    self.build(meta)
+                elif meta.dist() in self.local_artifacts:
+                    self.use_local_artifact(meta)
+
+                if build_dist and self.test_pipeline is not None:
+                    # Only once the tests have passed is the distribution uploaded.
+                    self.test_pipeline.submit(meta)
+                else:
+                    self.post_build(meta, build_occured=build_dist)
+                self.handle_tested()
+            self.handle_tested(block=True)
+        finally:
+            if self.test_pipeline is not None:
+                self.test_pipeline.close()
+                self.test_pipeline = None
+            if self.uploader is not None:
+                # Upload whatever was built, even if a later build failed.
+                self.failed_uploads = self.uploader.upload()
+            self.failed_promotions = self.promotions.apply(self.channel_listings)
+
+        self.print_summary()
+        if self.failed_tests:
+            sys.exit('TESTS FAILED: {}'.format(', '.join(self.failed_tests)))
+        if self.failed_uploads:
+            sys.exit('UPLOADS FAILED: {}'.format(', '.join(self.failed_uploads)))
+        if self.failed_promotions:
+            sys.exit('ADDING TO THE {} CHANNEL FAILED: {}'.format(self.upload_channel,
+                                                                 ', '.join(self.failed_promotions)))
+
+    def print_summary(self):
+        """Print a summary of the run."""
+        if self.compiler_cache is not None and self.compiler_cache.stats:
+            print('Compiler cache hit rates:\n\t{}'.format(
+                      '\n\t'.join(self.compiler_cache.summary())))
+
+    def locate_artifact(self, meta):
+        """
+        Put an existing artifact of the given distribution in the build root,
+        from a local artifact or by downloading (and verifying) it from the
+        owner's binstar account. Returns the filename, or None if no artifact
+        was found.
+
+        """
+        from conda_build.build import bldpkg_path
+
+        fname = bldpkg_path(meta)
+        if os.path.exists(fname):
+            return fname
+        local_artifact = self.find_local_artifacts([meta]).get(meta.dist())
+        if local_artifact is not None:
+            self.local_artifacts[meta.dist()] = local_artifact
+            self.use_local_artifact(meta)
+            return fname
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        print('Downloading {} from {}'.format(meta.dist(), self.upload_owner))
+        if inspect_binstar.download_distribution(self.binstar_cli, self.upload_owner,
+                                                 meta, fname):
+            return fname
+        return None
+
+    def test_existing(self, distributions):
+        """
+        Re-run the tests of the given (existing) distributions in parallel,
+        each in its own isolated test environment. Nothing is built.
+
+        """
+        import conda_build.config
+        from conda_build.index import update_index
+
+        to_test = []
+        for meta in distributions:
+            try:
+                fname = self.locate_artifact(meta)
+            except inspect_binstar.ChecksumError as err:
+                print('Not testing {}: {}'.format(meta.dist(), err))
+                self.failed_tests.append(meta.dist())
+                continue
+            if fname is None:
+                print('No existing distribution of {} was found to be '
+                      'tested.'.format(meta.dist()))
+                self.failed_tests.append(meta.dist())
+            else:
+                to_test.append(meta)
+        # Index the build root so that the test environments can resolve the
+        # distributions which have just been put there.
+        update_index(conda_build.config.config.bldpkgs_dir)
+
+        pipeline = TestPipeline(processes=self.test_workers,
+                                channel_urls=self.channel_urls())
+        try:
+            for meta in to_test:
+                pipeline.submit(meta)
+            for meta, passed in pipeline.completed(block=True):
+                if not passed:
+                    self.failed_tests.append(meta.dist())
+        finally:
+            pipeline.close()
+
+    def upstream_tests_passed(self, meta):
+        """
+        With a strictly ordered test pipeline, wait for the tests of the
+        dependencies of the given distribution, returning whether they passed.
+
+        """
+        if self.test_pipeline is None or not self.strict_test_order:
+            return True
+        names = dependency_names(meta)
+        failed_names = [dist.rsplit('-', 2)[0] for dist in self.failed_tests]
+        if any(name in failed_names for name in names):
+            return False
+        for upstream in self.test_pipeline.submitted():
+            if upstream.name() in names and not self.test_pipeline.wait(upstream):
+                return False
+        return True
+
+    def handle_tested(self, block=False):
+        """Post-process the distributions whose pipelined tests have completed."""
+        if self.test_pipeline is None:
+            return
+        for meta, passed in self.test_pipeline.completed(block=block):
+            if passed:
+                self.register_artifact(meta)
+                self.post_build(meta, build_occured=True)
+            else:
+                self.discard_artifact(meta)
+                self.failed_tests.append(meta.dist())
 
     def post_build(self, meta, build_occured=True):
         if self.can_upload:
-            already_on_channel = inspect_binstar.distribution_exists_on_channel(self.binstar_cli,
-                                                                                self.upload_owner,
-                                                                                meta,
-                                                                                channel=self.upload_channel)
-            if not build_occured and not already_on_channel:
-                # Link a distribution.
+            already_on_channel = self.channel_listings.contains(self.upload_owner,
+                                                                self.upload_channel, meta)
+            # A distribution found locally wasn't looked for on binstar.
+            found_locally = meta.dist() in self.local_artifacts
+            if (not build_occured and not already_on_channel and
+                    (not found_locally or self.exists_remotely(meta))):
+                # Link a distribution (along with the others of the batch).
                 print('Adding existing {} to the {} channel.'.format(meta.name(), self.upload_channel))
-                inspect_binstar.add_distribution_to_channel(self.binstar_cli, self.upload_owner, meta, channel=self.upload_channel)
-            elif already_on_channel:
+                self.promotions.add(self.upload_owner, meta, self.upload_channel)
+            elif already_on_channel and not (build_occured and self.build_cache is not None):
+                # With a build cache, a distribution on the channel is only
+                # rebuilt when its key has changed, so it is replaced.
                 print('Nothing to be done for {} - it is already on {}.'.format(meta.name(), self.upload_channel))
             else:
                 # Upload the distribution
-                print('Uploading {} to the {} channel.'.format(meta.name(), self.upload_channel))
-                build.upload(self.binstar_cli, meta, self.upload_owner, channels=[self.upload_channel])
+                if self.uploader is not None:
+                    print('Queueing {} for upload to the {} channel.'.format(meta.name(),
+                                                                             self.upload_channel))
+                    self.uploader.add(meta, [self.upload_channel],
+                                      build_key=self.build_cache_keys.get(meta.dist()))
+                else:
+                    print('Uploading {} to the {} channel.'.format(meta.name(), self.upload_channel))
+                    build.upload(self.binstar_cli, meta, self.upload_owner, channels=[self.upload_channel],
+                                 build_key=self.build_cache_keys.get(meta.dist()))
+                    self.channel_listings.add(self.upload_owner, self.upload_channel, meta)
 
@@ -0,0 +1,125 @@
+"""
+Share a persistent ccache directory between builds.
+
+The cases of a build matrix (and successive runs) compile the same C
+sources again and again. Within :meth:`CompilerCache.enabled`, the
+compilers found on the PATH are masqueraded by wrappers which compile
+through ccache, using the given (persistent) cache directory.
+
+conda-build doesn't pass arbitrary environment variables through to the
+build scripts, so the cache configuration is baked into the wrappers rather
+than being set in the environment.
+
+"""
+from __future__ import print_function
+
+from contextlib import contextmanager
+import os
+import stat
+import subprocess
+import sys
+
+try:
+    from shutil import which
+except ImportError:
+    # Python 2.
+    from distutils.spawn import find_executable as which
+
+
+#: The compilers which are masqueraded when found on the PATH.
+COMPILERS = ['cc', 'c++', 'gcc', 'g++', 'clang', 'clang++']
+
+#: The statistics of ``ccache --print-stats``, and their equivalent in the
+#: human readable output of older versions of ccache.
+STATISTICS = {'direct_cache_hit': 'cache hit (direct)',
+              'preprocessed_cache_hit': 'cache hit (preprocessed)',
+              'cache_miss': 'cache miss'}
+
+
+def parse_stats(output):
+    """Return a dictionary of the STATISTICS found in ccache's output."""
+    stats = dict.fromkeys(STATISTICS, 0)
+    for line in output.splitlines():
+        for key, description in STATISTICS.items():
+            for label in [key, description]:
+                if line.startswith(label):
+                    value = line[len(label):].strip().split()
+                    if value and value[0].isdigit():
+                        stats[key] = int(value[0])
+    return stats
+
+
+class CompilerCache(object):
+    """A persistent ccache directory, with the statistics of each build."""
+    def __init__(self, directory, ccache=None):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.ccache = ccache or which('ccache')
+        self.wrapper_dir = os.path.join(self.directory, 'obvci-bin')
+        #: A mapping of dist name to the ccache statistics of its build.
+        self.stats = {}
+
+    @property
+    def available(self):
+        return self.ccache is not None and sys.platform != 'win32'
+
+    def _env(self):
+        env = dict(os.environ)
+        env['CCACHE_DIR'] = self.directory
+        return env
+
+    def current_stats(self):
+        """The cumulative statistics of the cache directory."""
+        try:
+            output = subprocess.check_output([self.ccache, '--print-stats'],
+                                             env=self._env(), stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError:
+            # Older versions of ccache only have human readable statistics.
+            output = subprocess.check_output([self.ccache, '-s'], env=self._env())
+        return parse_stats(output.decode('utf-8', 'replace'))
+
+    def write_wrappers(self, path):
+        """Write the compiler wrappers for the compilers on the given PATH."""
+        if not os.path.isdir(self.wrapper_dir):
+            os.makedirs(self.wrapper_dir)
+        for compiler in COMPILERS:
+            real_compiler = which(compiler, path=path)
+            if real_compiler is None:
+                continue
+            fname = os.path.join(self.wrapper_dir, compiler)
+            with open(fname, 'w') as fh:
+                fh.write('#!/bin/sh\n'
+                         'CCACHE_DIR="{}" CCACHE_COMPILERCHECK=content '
+                         'exec "{}" "{}" "$@"\n'.format(self.directory, self.ccache,
+                                                        real_compiler))
+            os.chmod(fname, os.stat(fname).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    @contextmanager
+    def enabled(self, dist):
+        """Compile through the cache, recording the statistics against dist."""
+        if not self.available:
+            print('ccache is not available, so compilation will not be cached.')
+            yield
+            return
+        orig_path = os.environ.get('PATH', '')
+        self.write_wrappers(orig_path)
+        before = self.current_stats()
+        os.environ['PATH'] = os.pathsep.join([self.wrapper_dir, orig_path])
+        try:
+            yield
+        finally:
+            os.environ['PATH'] = orig_path
+            after = self.current_stats()
+            self.stats[dist] = {key: after[key] - before[key] for key in after}
+
+    def summary(self):
+        """Return the lines of a summary of the cache hit rates of each build."""
+        lines = []
+        for dist, stats in sorted(self.stats.items()):
+            hits = stats['direct_cache_hit'] + stats['preprocessed_cache_hit']
+            total = hits + stats['cache_miss']
+            if total:
+                rate = '{:.1f}%'.format(100. * hits / total)
+            else:
+                rate = 'n/a'
+            lines.append('{}: {} of {} compilations cached ({})'.format(dist, hits, total, rate))
+        return lines
@@ -0,0 +1,127 @@
+"""
+Add existing distributions on binstar to channels in a single batch.
+
+Promotions are collected (once per owner, channel and distribution file,
+however many times they are asked for) as the builds run, and applied
+concurrently once they are done. Only the file of each distribution is
+added, never the other builds of its name and version. The promotions are
+then verified against a cache of the channel listings, which is refreshed
+once per channel rather than once per distribution, and holds a compact
+hash of each basename rather than the listing itself.
+
+"""
+from __future__ import print_function
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import threading
+
+from .binstar_gateway import gateway
+from .inspect_binstar import channel_basenames, distribution_fname
+
+
+class ChannelListingCache(object):
+    """
+    A cache of the basenames of the distributions on each owner's channel,
+    listed a page of page_size at a time.
+
+    """
+    def __init__(self, binstar_cli, page_size=None):
+        self.binstar_cli = gateway(binstar_cli)
+        self.page_size = page_size
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def basenames(self, owner, channel, refresh=False):
+        """
+        The :class:`~obvci.conda_tools.inspect_binstar.BasenameSet` of
+        ``subdir/dist.tar.bz2`` basenames on the owner's channel.
+
+        """
+        key = (owner, channel)
+        with self._lock:
+            if refresh or key not in self._listings:
+                kwargs = {}
+                if self.page_size:
+                    kwargs['per_page'] = self.page_size
+                self._listings[key] = channel_basenames(self.binstar_cli, owner, channel,
+                                                        **kwargs)
+            return self._listings[key]
+
+    def contains(self, owner, channel, metadata):
+        """Whether the distribution of the metadata is on the owner's channel."""
+        return distribution_fname(metadata) in self.basenames(owner, channel)
+
+    def add(self, owner, channel, metadata):
+        """Record that the distribution of the metadata has been put on the channel."""
+        with self._lock:
+            if (owner, channel) in self._listings:
+                self._listings[(owner, channel)].add(distribution_fname(metadata))
+
+    def invalidate(self, owner=None, channel=None):
+        """Forget the listings of the given owner and channel (or all of them)."""
+        with self._lock:
+            for key in list(self._listings):
+                if owner in (None, key[0]) and channel in (None, key[1]):
+                    del self._listings[key]
+
+
+class PromotionBatch(object):
+    """
+    Collect the distributions to add to channels, and add them (with up to
+    workers calls at once) in a batch.
+
+    """
+    def __init__(self, binstar_cli, workers=4):
+        self.binstar_cli = gateway(binstar_cli)
+        self.workers = workers
+        #: A mapping of (owner, package, version, channel, basename) to the
+        #: metadata of the distribution to promote.
+        self.pending = OrderedDict()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, owner, metadata, channel):
+        """Queue the (already existing) distribution of the metadata for the channel."""
+        key = (owner, metadata.name(), metadata.version(), channel,
+               distribution_fname(metadata))
+        self.pending[key] = metadata
+
+    def _promote(self, key):
+        owner, package, version, channel, basename = key
+        try:
+            self.binstar_cli.add_channel(channel, owner, package, version, filename=basename)
+        except Exception as err:
+            print('Failed to add {} to the {} channel: {}'.format(basename, channel, err))
+            return key, err
+        return key, None
+
+    def apply(self, listings):
+        """
+        Apply (and empty) the queued promotions, verifying them against the
+        given :class:`ChannelListingCache`. Returns the dist names of the
+        distributions which aren't on their channel.
+
+        """
+        pending, self.pending = self.pending, OrderedDict()
+        if not pending:
+            return []
+        print('Adding {} distributions to their channels...'.format(len(pending)))
+        pool = ThreadPool(min(self.workers, len(pending)))
+        try:
+            results = list(pool.imap_unordered(self._promote, pending))
+        finally:
+            pool.close()
+            pool.join()
+
+        failed = []
+        refreshed = set()
+        for key, err in results:
+            owner, channel = key[0], key[3]
+            if (owner, channel) not in refreshed:
+                listings.basenames(owner, channel, refresh=True)
+                refreshed.add((owner, channel))
+            if err is not None or key[4] not in listings.basenames(owner, channel):
+                failed.append(pending[key].dist())
+        return failed
@@ -0,0 +1,226 @@
+"""
+A pool of recently used build environments.
+
+Creating the build environment is a large fixed cost of every build, even
+when consecutive builds (e.g. the cases of a build matrix) share most of
+their packages. The pool keeps snapshots of the environments which have
+been created, keyed by their linked packages, so that a new environment can
+be materialised by cloning the closest snapshot and then only
+unlinking/linking the packages which differ.
+
+Only the files which conda hardlinked from its package cache are hardlinked
+into and out of the snapshots. Every other file (e.g. those which had their
+prefix replaced, and conda-meta) is copied, so a build which modifies a file
+of its environment in place can't change a snapshot.
+
+"""
+from __future__ import print_function
+
+from contextlib import contextmanager
+import errno
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from .solve_cache import environment_index, exact_specs, shared_index
+
+
+def clone_tree(source, target, shared=()):
+    """
+    Clone the source directory to the target, hardlinking the files whose
+    (device, inode) is in shared where possible, and copying the rest.
+    Return the number of bytes copied.
+
+    """
+    copied = 0
+    for dirpath, dirnames, filenames in os.walk(source):
+        target_dir = os.path.join(target, os.path.relpath(dirpath, source))
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        for name in dirnames + filenames:
+            src = os.path.join(dirpath, name)
+            dst = os.path.join(target_dir, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif name in filenames:
+                stat = os.lstat(src)
+                if (stat.st_dev, stat.st_ino) in shared:
+                    try:
+                        os.link(src, dst)
+                        continue
+                    except OSError as err:
+                        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                            raise
+                shutil.copy2(src, dst)
+                copied += stat.st_size
+    return copied
+
+
+def package_cache_inodes(pkgs_dirs, dists):
+    """
+    Return the set of (device, inode) of the files of the given dists which
+    are extracted in the package cache directories.
+
+    """
+    inodes = set()
+    for pkgs_dir in pkgs_dirs:
+        for dist in dists:
+            for dirpath, dirnames, filenames in os.walk(os.path.join(pkgs_dir, dist)):
+                for name in filenames:
+                    stat = os.lstat(os.path.join(dirpath, name))
+                    inodes.add((stat.st_dev, stat.st_ino))
+    return inodes
+
+
+class EnvironmentPool(object):
+    """
+    A directory of environment snapshots, evicted in least recently used
+    order once their disk usage exceeds max_bytes.
+
+    """
+    def __init__(self, directory, max_bytes=10 * 2 ** 30):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    @staticmethod
+    def key(dists):
+        return hashlib.sha256('\n'.join(sorted(dists)).encode('utf-8')).hexdigest()
+
+    def entries(self):
+        """Return a list of the (metadata) dictionaries of the pooled environments."""
+        entries = []
+        for fname in os.listdir(self.directory):
+            if fname.endswith('.json'):
+                with open(os.path.join(self.directory, fname), 'r') as fh:
+                    entries.append(json.load(fh))
+        return entries
+
+    def _write_entry(self, entry):
+        with open(os.path.join(self.directory, entry['key'] + '.json'), 'w') as fh:
+            json.dump(entry, fh)
+
+    def closest(self, prefix, dists):
+        """
+        Return the entry for the given prefix which needs the fewest packages
+        to be linked and unlinked to become the given dists (or None if no
+        entry shares any packages).
+
+        """
+        dists = set(dists)
+        candidates = []
+        for entry in self.entries():
+            entry_dists = set(entry['dists'])
+            if entry['prefix'] == prefix and entry_dists & dists:
+                score = len(entry_dists & dists) - len(entry_dists ^ dists)
+                candidates.append((score, entry['last_used'], entry))
+        if not candidates:
+            return None
+        return max(candidates, key=lambda candidate: candidate[:2])[2]
+
+    def materialize(self, entry, prefix, pkgs_dirs=()):
+        """
+        Clone the given entry's environment to the prefix, hardlinking only
+        the files of the package cache directories pkgs_dirs.
+
+        """
+        if os.path.exists(prefix):
+            shutil.rmtree(prefix)
+        shared = package_cache_inodes(pkgs_dirs, entry['dists'])
+        clone_tree(os.path.join(self.directory, entry['key']), prefix, shared)
+        entry['last_used'] = time.time()
+        self._write_entry(entry)
+
+    def store(self, prefix, dists, pkgs_dirs=()):
+        """
+        Snapshot the environment at prefix, which has the given dists linked
+        from the package cache directories pkgs_dirs.
+
+        """
+        key = self.key(dists)
+        entry_dir = os.path.join(self.directory, key)
+        entry = None
+        if os.path.isdir(entry_dir):
+            entry = next((entry for entry in self.entries() if entry['key'] == key), None)
+        if entry is None:
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+            shared = package_cache_inodes(pkgs_dirs, dists)
+            entry = {'key': key, 'prefix': prefix, 'dists': sorted(dists),
+                     'size': clone_tree(prefix, entry_dir, shared)}
+        entry['last_used'] = time.time()
+        self._write_entry(entry)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until within max_bytes. The
+        most recently used entry is always kept.
+
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry['last_used'])
+        # Only the copied files of a snapshot are its own; those hardlinked
+        # from the package cache aren't freed by evicting it.
+        usage = sum(entry['size'] for entry in entries)
+        for entry in entries[:-1]:
+            if usage <= self.max_bytes:
+                break
+            print('Evicting the pooled environment {}'.format(entry['key']))
+            os.remove(os.path.join(self.directory, entry['key'] + '.json'))
+            shutil.rmtree(os.path.join(self.directory, entry['key']), ignore_errors=True)
+            usage -= entry['size']
+
+
+@contextmanager
+def pooled_environments(pool, solve=None):
+    """
+    Within this context, conda-build's build environment is materialised from
+    the closest environment in the given pool.
+
+    solve is a callable of (index, specs) returning the package filenames of
+    the environment (e.g. :meth:`obvci.conda_tools.solve_cache.SolveCache.solve`).
+
+    """
+    import conda.config
+    import conda.install
+    import conda.resolve
+    import conda_build.build as build_module
+    import conda_build.config
+
+    if solve is None:
+        solve = lambda index, specs: conda.resolve.Resolve(index).solve(list(specs))
+    orig_create_env = build_module.create_env
+
+    def create_env(prefix, specs, *args, **kwargs):
+        if not specs or prefix != conda_build.config.config.build_prefix:
+            return orig_create_env(prefix, specs, *args, **kwargs)
+        index = environment_index(kwargs)
+        fns = solve(index, specs)
+        dists = set(fn[:-len('.tar.bz2')] for fn in fns)
+
+        entry = pool.closest(prefix, dists)
+        if entry is not None:
+            print('Cloning the pooled build environment {}'.format(entry['key']))
+            pool.materialize(entry, prefix, conda.config.pkgs_dirs)
+            for dist in set(conda.install.linked(prefix)) - dists:
+                conda.install.unlink(prefix, dist)
+            linked = set(conda.install.linked(prefix))
+            missing = [fn for fn in fns if fn[:-len('.tar.bz2')] not in linked]
+            specs = exact_specs(missing, index)
+        result = None
+        if specs:
+            # The solve cache's create_env (if enabled) needn't fetch it again.
+            with shared_index(index):
+                result = orig_create_env(prefix, specs, *args, **kwargs)
+        # Keyed by the dists which were linked, rather than those solved.
+        pool.store(prefix, conda.install.linked(prefix), conda.config.pkgs_dirs)
+        return result
+
+    build_module.create_env = create_env
+    try:
+        yield
+    finally:
+        build_module.create_env = orig_create_env
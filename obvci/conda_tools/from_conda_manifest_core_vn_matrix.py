@@ -3,30 +3,43 @@ import os
 from contextlib import contextmanager
 from collections import defaultdict
 
-import conda.resolve
-from conda.resolve import MatchSpec
-import conda_build.config
 # import conda_manifest.config
 
 import logging
-from conda.resolve import stdoutlog, dotlog
 
-conda_stdoutlog = stdoutlog
 # TODO: Handle the amount of standard out that conda is producing.
 
 
-from conda.console import SysStdoutWriteHandler
+def unsatisfiable_errors():
+    """
+    The exceptions with which conda reports specs which can't be satisfied:
+    older versions exit, newer versions raise NoPackagesFound (or
+    Unsatisfiable).
+
+    """
+    import conda.resolve
+
+    return (SystemExit,) + tuple(getattr(conda.resolve, name)
+                                 for name in ['NoPackagesFound', 'Unsatisfiable']
+                                 if hasattr(conda.resolve, name))
+
+
+def recipe_errors():
+    """
+    The exceptions with which conda-build reports a recipe it can't read
+    (e.g. invalid YAML, or a missing file); for some, it exits.
 
+    """
+    import yaml
 
-class StdoutNewline(SysStdoutWriteHandler):
-    def emit(self, record):
-        record.msg += '\n'
-        SysStdoutWriteHandler.emit(self, record)
+    return (SystemExit, EnvironmentError, ValueError, yaml.YAMLError)
 
 
-stdout = logging.getLogger('obvci.stdoutlog')
-stdout.addHandler(StdoutNewline())
-stdout.setLevel(logging.WARNING)
+def compatible_cases(case_a, case_b):
+    """Whether the given special version cases agree on the versions they share."""
+    versions = dict(case_b)
+    return all(versions[name] == version for name, version in case_a
+               if name in versions)
 
 
 @contextmanager
@@ -60,6 +73,8 @@ def override_conda_logging(level):
 
 @contextmanager
 def setup_vn_mtx_case(case):
+    import conda_build.config
+
     orig_npy = conda_build.config.config.CONDA_NPY
     orig_py = conda_build.config.config.CONDA_PY
 
@@ -92,7 +107,7 @@ def conda_special_versions(meta, index, version_matrix=None):
             yield case
 
 
-def special_case_version_matrix(meta, index):
+def special_case_version_matrix(meta, index, resolve=None):
     """
     Return the non-orthogonal version matrix for special software within conda
     (numpy, python).
@@ -118,8 +133,14 @@ def special_case_version_matrix(meta, index):
 
         This algorithm does not deal with PERL and R versions at this time.
 
+    A :class:`conda.resolve.Resolve` of the index may be given, to save
+    constructing one for every recipe.
+
     """
-    r = conda.resolve.Resolve(index)
+    import conda.resolve
+    from conda.resolve import MatchSpec
+
+    r = resolve if resolve is not None else conda.resolve.Resolve(index)
     requirements = meta.get_value('requirements/build', [])
     requirement_specs = {MatchSpec(spec).name: MatchSpec(spec)
                          for spec in requirements}
@@ -228,6 +249,8 @@ def filter_cases(cases, index, extra_specs):
     Typically extra_specs comes from the environment specification.
 
     """
+    from conda.resolve import MatchSpec
+
     specs = [MatchSpec(spec) for spec in extra_specs]
 
     for case in cases:
@@ -1,15 +1,35 @@
-import conda.config
-import binstar_client
-from conda_build.build import bldpkg_path
+import hashlib
+import json
+import os
+import re
+import struct
 
+from .binstar_gateway import gateway
+from .timing import dist_argument, timed_function
 
+
+class ChecksumError(IOError):
+    """A downloaded distribution doesn't have the md5 recorded on binstar."""
+
+
+def distribution_fname(metadata):
+    """The ``subdir/dist.tar.bz2`` filename of the distribution on binstar."""
+    import conda.config
+
+    return '{}/{}.tar.bz2'.format(conda.config.subdir, metadata.dist())
+
+
+@timed_function('inspect_binstar.distribution_exists', dist_argument(2, 'metadata'))
 def distribution_exists(binstar_cli, owner, metadata):
     """
     Determine whether a distribution exists.
 
     This does not check specific channels - it is either on binstar or it is not.
     """
-    fname = '{}/{}.tar.bz2'.format(conda.config.subdir, metadata.dist())
+    import binstar_client
+
+    binstar_cli = gateway(binstar_cli)
+    fname = distribution_fname(metadata)
     try:
         r = binstar_cli.distribution(owner, metadata.name(), metadata.version(),
                                      fname)
@@ -19,26 +39,223 @@ def distribution_exists(binstar_cli, owner, metadata):
     return exists
 
 
+@timed_function('inspect_binstar.distribution_info', dist_argument(2, 'metadata'))
+def distribution_info(binstar_cli, owner, metadata):
+    """
+    Return binstar's information (md5, attrs etc.) of a distribution, or
+    None if it doesn't exist.
+
+    """
+    import binstar_client
+
+    binstar_cli = gateway(binstar_cli)
+    try:
+        return binstar_cli.distribution(owner, metadata.name(), metadata.version(),
+                                        distribution_fname(metadata))
+    except binstar_client.NotFound:
+        return None
+
+
+@timed_function('inspect_binstar.download_distribution', dist_argument(2, 'metadata'))
+def download_distribution(binstar_cli, owner, metadata, target):
+    """
+    Download a distribution from binstar to the target filename, checking
+    it against the md5 recorded on binstar (raising a
+    :class:`ChecksumError` if it doesn't match).
+
+    Returns whether the distribution existed.
+
+    """
+    import binstar_client
+
+    binstar_cli = gateway(binstar_cli)
+    info = distribution_info(binstar_cli, owner, metadata)
+    if info is None:
+        return False
+    fname = distribution_fname(metadata)
+    try:
+        response = binstar_cli.download(owner, metadata.name(), metadata.version(),
+                                        fname)
+    except binstar_client.NotFound:
+        return False
+    # Download to a temporary file so that an interrupted (or corrupt)
+    # download doesn't leave a partial distribution behind.
+    tmp_target = target + '.part'
+    md5 = hashlib.md5()
+    with open(tmp_target, 'wb') as fh:
+        for chunk in response.iter_content(chunk_size=2 ** 20):
+            md5.update(chunk)
+            fh.write(chunk)
+    if info.get('md5') is not None and md5.hexdigest() != info['md5']:
+        os.remove(tmp_target)
+        raise ChecksumError('The md5 of the downloaded {} ({}) does not match that on '
+                            'binstar ({})'.format(fname, md5.hexdigest(), info['md5']))
+    if os.path.exists(target):
+        os.remove(target)
+    os.rename(tmp_target, target)
+    return True
+
+
+#: The number of distributions to ask for in each page of a channel listing.
+CHANNEL_PAGE_SIZE = 1000
+
+#: The tokens of JSON which give its structure: strings, the start (only) of
+#: a string which continues beyond the text, and brackets and commas.
+_JSON_TOKEN = re.compile(br'"(?:[^"\\]|\\.)*"|"|[{}\[\],]')
+
+
+class BasenameSet(object):
+    """
+    A compact set of distribution basenames, which keeps a 64 bit hash of
+    each basename rather than the basename itself.
+
+    """
+    def __init__(self, basenames=()):
+        self._hashes = set()
+        for basename in basenames:
+            self.add(basename)
+
+    @staticmethod
+    def _hash(basename):
+        digest = hashlib.md5(basename.encode('utf-8')).digest()
+        return struct.unpack('<Q', digest[:8])[0]
+
+    def add(self, basename):
+        self._hashes.add(self._hash(basename))
+
+    def __contains__(self, basename):
+        return self._hash(basename) in self._hashes
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+def iter_json_basenames(chunks):
+    """
+    Yield the basename of each of the files of the JSON of a channel listing
+    (i.e. each files[i].basename), given as an iterable of byte chunks,
+    without holding more than a chunk of it.
+
+    """
+    # The [bracket, key] of each of the containers the scan is in, where the
+    # key of an object is the (JSON) key of the value being read.
+    path = []
+    expect_key = False
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        for match in _JSON_TOKEN.finditer(buffer):
+            token = match.group()
+            if token == b'"':
+                # A string split across chunks, which is read with the next.
+                buffer = buffer[match.start():]
+                break
+            if token in (b'{', b'['):
+                path.append([token, None])
+                expect_key = token == b'{'
+            elif token in (b'}', b']'):
+                path.pop()
+                expect_key = False
+            elif token == b',':
+                expect_key = path[-1][0] == b'{'
+            elif expect_key:
+                path[-1][1] = token
+                expect_key = False
+            elif (len(path) == 3 and path[0][1] == b'"files"' and path[1][0] == b'[' and
+                    path[2][1] == b'"basename"'):
+                yield json.loads(token.decode('utf-8'))
+        else:
+            # Anything left is whitespace, or part of a number, true, false
+            # or null, none of which are needed.
+            buffer = b''
+
+
+def _channel_page(binstar_cli, owner, channel, page, per_page):
+    response = binstar_cli.request('GET', '/channels/{}/{}'.format(owner, channel),
+                                   params={'page': page, 'per_page': per_page}, stream=True)
+    binstar_cli.check_response(response)
+    return response
+
+
+def iter_channel_basenames(binstar_cli, owner, channel, per_page=CHANNEL_PAGE_SIZE):
+    """
+    Yield the basenames of the distributions on the owner's channel, a page
+    of per_page at a time, streaming each page rather than loading it.
+
+    A server which ignores the page (and gives the whole listing at once)
+    is supported too: the listing ends with a page that isn't full, or
+    which has nothing new in it.
+
+    """
+    binstar_cli = gateway(binstar_cli)
+    page = 1
+    first_of_page = set()
+    while True:
+        response = binstar_cli.call('show_channel', _channel_page, binstar_cli,
+                                    owner, channel, page, per_page)
+        count = 0
+        try:
+            for basename in iter_json_basenames(response.iter_content(chunk_size=2 ** 16)):
+                if count == 0:
+                    if basename in first_of_page:
+                        return
+                    first_of_page.add(basename)
+                count += 1
+                yield basename
+        finally:
+            response.close()
+        if count != per_page:
+            return
+        page += 1
+
+
+def channel_basenames(binstar_cli, owner, channel, per_page=CHANNEL_PAGE_SIZE):
+    """The :class:`BasenameSet` of the distributions on the owner's channel."""
+    return BasenameSet(iter_channel_basenames(binstar_cli, owner, channel, per_page))
+
+
+def channel_contains(binstar_cli, owner, channel, basenames, per_page=CHANNEL_PAGE_SIZE):
+    """
+    Return the set of the given basenames which are on the owner's channel,
+    reading no more of the channel listing than is needed to find them all.
+
+    """
+    wanted = set(basenames)
+    found = set()
+    if not wanted:
+        return found
+    for basename in iter_channel_basenames(binstar_cli, owner, channel, per_page):
+        if basename in wanted:
+            found.add(basename)
+            if found == wanted:
+                break
+    return found
+
+
+@timed_function('inspect_binstar.distribution_exists_on_channel', dist_argument(2, 'metadata'))
 def distribution_exists_on_channel(binstar_cli, owner, metadata, channel='main'):
     """
     Determine whether a distribution exists on a specific channel.
 
     Note from @pelson: As far as I can see, there is no easy way to do this on binstar.
+    The channel listing is paged through until the distribution is found.
 
     """
-    fname = '{}/{}.tar.bz2'.format(conda.config.subdir, metadata.dist())
-    distributions_on_channel = [dist['basename'] for dist in
-                                binstar_cli.show_channel(owner=owner, channel=channel)['files']]
-    return fname in distributions_on_channel
+    fname = distribution_fname(metadata)
+    return fname in channel_contains(binstar_cli, owner, channel, [fname])
 
 
+@timed_function('inspect_binstar.add_distribution_to_channel', dist_argument(2, 'metadata'))
 def add_distribution_to_channel(binstar_cli, owner, metadata, channel='main'):
     """
     Add a(n already existing) distribution on binstar to another channel.
-    
-    Note - the addition is done based on name and version - no build strings etc.
-    so if you have a foo-0.1-np18 and foo-0.1-np19 *both* will be added to the channel.
-    
+
+    Only the file of the distribution (``subdir/dist.tar.bz2``) is added, so
+    the other builds of the same name and version (e.g. foo-0.1-np19 when
+    adding foo-0.1-np18) are left where they are.
+
     """
-    package_fname = '{}/{}.tar.bz2'.format(conda.config.subdir, metadata.dist())
-    binstar_cli.add_channel(channel, owner, metadata.name(), metadata.version())#filename=package_fname)
+    binstar_cli = gateway(binstar_cli)
+    package_fname = distribution_fname(metadata)
+    binstar_cli.add_channel(channel, owner, metadata.name(), metadata.version(),
+                            filename=package_fname)
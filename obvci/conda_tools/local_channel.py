@@ -0,0 +1,124 @@
+"""
+A local conda channel which holds the distributions built during a run.
+
+Putting this channel first for subsequent builds means that a recipe which
+depends on another recipe in the same directory resolves the freshly built
+distribution, rather than whatever happens to be on the remote channels.
+
+"""
+from __future__ import print_function
+
+import bz2
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+
+
+def read_index_json(fname):
+    """Return the info/index.json dictionary of the given distribution."""
+    with tarfile.open(fname) as tar:
+        fh = tar.extractfile('info/index.json')
+        return json.loads(fh.read().decode('utf-8'))
+
+
+def md5_file(fname, chunk_size=2 ** 20):
+    """Return the hex md5 of the given file, reading it in chunks."""
+    md5 = hashlib.md5()
+    with open(fname, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _write_atomic(fname, content):
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'wb') as fh:
+        fh.write(content)
+    if os.path.exists(fname):
+        os.remove(fname)
+    os.rename(tmp_fname, fname)
+
+
+class LocalChannel(object):
+    """
+    A conda channel on the local filesystem which is updated incrementally.
+
+    Unlike ``conda index``, adding a distribution only reads the newly added
+    file - the repodata of the distributions already in the channel is
+    carried over as is.
+
+    """
+    def __init__(self, root, subdir=None):
+        import conda.config
+
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.subdir = subdir or conda.config.subdir
+        self.subdir_path = os.path.join(self.root, self.subdir)
+        self.repodata = self._read_repodata()
+        if not os.path.exists(os.path.join(self.subdir_path, 'repodata.json')):
+            self._write_repodata()
+        # Conda also looks for a noarch directory on every channel.
+        noarch_path = os.path.join(self.root, 'noarch')
+        if not os.path.exists(os.path.join(noarch_path, 'repodata.json')):
+            self._write_repodata(noarch_path, {'info': {}, 'packages': {}})
+
+    def __repr__(self):
+        return 'LocalChannel({!r})'.format(self.root)
+
+    def __contains__(self, basename):
+        return basename in self.repodata['packages']
+
+    @property
+    def url(self):
+        """The URL which conda should be given to use this channel."""
+        from conda.utils import url_path
+
+        return url_path(self.root)
+
+    def _read_repodata(self):
+        fname = os.path.join(self.subdir_path, 'repodata.json')
+        if os.path.exists(fname):
+            with open(fname, 'r') as fh:
+                return json.load(fh)
+        return {'info': {'subdir': self.subdir}, 'packages': {}}
+
+    def _write_repodata(self, path=None, repodata=None):
+        path = path or self.subdir_path
+        if repodata is None:
+            repodata = self.repodata
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        content = json.dumps(repodata, indent=2, sort_keys=True).encode('utf-8')
+        _write_atomic(os.path.join(path, 'repodata.json'), content)
+        _write_atomic(os.path.join(path, 'repodata.json.bz2'),
+                      bz2.compress(content))
+
+    def add(self, fname):
+        """
+        Copy the given distribution into the channel and index it.
+
+        Returns the repodata entry of the newly added distribution.
+
+        """
+        basename = os.path.basename(fname)
+        target = os.path.join(self.subdir_path, basename)
+        if os.path.abspath(fname) != target:
+            shutil.copy2(fname, target)
+
+        info = read_index_json(target)
+        info['md5'] = md5_file(target)
+        info['size'] = os.path.getsize(target)
+        info['mtime'] = int(os.path.getmtime(target))
+        self.repodata['packages'][basename] = info
+        self._write_repodata()
+        return info
+
+    def remove(self, basename):
+        """Remove the given distribution from the channel (if it is there)."""
+        target = os.path.join(self.subdir_path, basename)
+        if os.path.exists(target):
+            os.remove(target)
+        if self.repodata['packages'].pop(basename, None) is not None:
+            self._write_repodata()
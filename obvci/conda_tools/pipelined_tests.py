@@ -0,0 +1,157 @@
+"""
+Test built distributions in worker processes, so that the test of one
+distribution can run while the next distribution is being built.
+
+Each test is run with its own conda-build root and test prefix, so it
+neither needs the lock on the build root nor collides with any other test.
+The distribution under test is resolved from the (main) build root, which
+is given to the test as a channel.
+
+"""
+from __future__ import print_function
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from . import from_conda_manifest_core_vn_matrix as vn_matrix
+from .timing import run_traced, timed, timings
+
+
+def _override_config(name, value):
+    """
+    Override a conda-build config value, be it an attribute of the config
+    instance or a property of its class. Returns a callable to restore it.
+
+    """
+    import conda_build.config
+
+    config = conda_build.config.config
+    if name in vars(config):
+        target = config
+    else:
+        target = type(config)
+    orig = vars(target).get(name)
+    setattr(target, name, value)
+
+    def restore():
+        if orig is None:
+            delattr(target, name)
+        else:
+            setattr(target, name, orig)
+    return restore
+
+
+@contextmanager
+def isolated_test_root(test_root):
+    """
+    Point conda-build's build root and test prefix at the given directory.
+
+    This modifies global conda-build state, so should only be used from
+    within a worker process.
+
+    """
+    import conda_build.config
+
+    restorers = [_override_config('croot', test_root),
+                 _override_config('test_prefix', os.path.join(test_root, '_t'))]
+    orig_croot = conda_build.config.croot
+    conda_build.config.croot = test_root
+    try:
+        yield
+    finally:
+        conda_build.config.croot = orig_croot
+        for restore in reversed(restorers):
+            restore()
+
+
+def run_test(recipe_dir, special_versions, test_root, channel_urls=()):
+    """
+    Run the tests of an already built distribution in an isolated test root.
+
+    Returns a (passed, message) tuple, rather than raising, as conda-build
+    exits the process when a test fails.
+
+    """
+    try:
+        import conda_build.build as build_module
+        from conda_build.metadata import MetaData
+
+        meta = MetaData(recipe_dir)
+        with vn_matrix.setup_vn_mtx_case(special_versions):
+            meta.parse_again()
+            with isolated_test_root(test_root), timed('test', meta.dist()):
+                build_module.test(meta, verbose=False,
+                                  channel_urls=list(channel_urls))
+    except (Exception, SystemExit) as err:
+        return False, str(err)
+    finally:
+        shutil.rmtree(test_root, ignore_errors=True)
+    return True, ''
+
+
+class TestPipeline(object):
+    """
+    Run the tests of built distributions in worker processes.
+
+    Distributions are tested in the order they are submitted, and their
+    results are made available as each test completes.
+
+    """
+    def __init__(self, processes=1, channel_urls=()):
+        import conda_build.config
+        from conda.utils import url_path
+
+        self.pool = multiprocessing.Pool(processes)
+        self.test_root = tempfile.mkdtemp(prefix='obvci_test_')
+        # The main build root holds the distributions being tested.
+        self.channel_urls = [url_path(conda_build.config.croot)] + list(channel_urls)
+        self._results = OrderedDict()
+        self._metas = {}
+        self._reported = set()
+
+    def submit(self, meta):
+        """Queue the tests of the given (built) distribution."""
+        dist = meta.dist()
+        test_root = os.path.join(self.test_root, str(len(self._results)))
+        args = (meta.path, getattr(meta, 'special_versions', ()), test_root,
+                self.channel_urls)
+        print('Queueing the tests of {}'.format(dist))
+        self._metas[dist] = meta
+        self._results[dist] = self.pool.apply_async(run_traced, (run_test,) + args)
+
+    def submitted(self):
+        """The distributions which have been submitted for testing."""
+        return [self._metas[dist] for dist in self._results]
+
+    def wait(self, meta):
+        """Wait for the tests of the given distribution, returning whether they passed."""
+        (passed, message), _ = self._results[meta.dist()].get()
+        return passed
+
+    def completed(self, block=False):
+        """
+        Generate (meta, passed) for each test which has completed since the
+        last call. If block is True, wait for all of the tests to complete.
+
+        """
+        for dist, result in list(self._results.items()):
+            if dist in self._reported or not (block or result.ready()):
+                continue
+            (passed, message), recorded = result.get()
+            # The time spent testing, in the worker, is part of the run.
+            timings.merge(recorded)
+            if passed:
+                print('Tests of {} passed.'.format(dist))
+            else:
+                print('Tests of {} FAILED: {}'.format(dist, message))
+            self._reported.add(dist)
+            yield self._metas[dist], passed
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        shutil.rmtree(self.test_root, ignore_errors=True)
@@ -0,0 +1,193 @@
+"""
+Keep the conda index, the recipe metadata and the build matrices in memory,
+updating them incrementally as the recipes and the index change.
+
+Only the recipes whose files have changed are parsed again, and only their
+build matrices are recomputed. The matrices of all of the recipes are only
+recomputed when the index itself changes.
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+
+from .build_directory import (BakedDistribution, dependency_names,
+                              sort_dependency_order)
+from .solve_cache import index_fingerprint
+from . import from_conda_manifest_core_vn_matrix as vn_matrix
+
+
+def recipe_dirs(root):
+    """
+    Return a dictionary of recipe name to directory of the recipes in the given
+    directory (i.e. the sub-directories which contain a meta.yaml).
+
+    """
+    dirs = {}
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and os.path.exists(os.path.join(path, 'meta.yaml')):
+            dirs[name] = path
+    return dirs
+
+
+def recipe_signature(recipe_dir):
+    """
+    Return a cheap signature of the given recipe directory, computed from the
+    names, modification times and sizes of its files.
+
+    """
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(recipe_dir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            fname = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(fname)
+            except OSError:
+                # The file was removed whilst walking.
+                continue
+            entries.append((os.path.relpath(fname, recipe_dir),
+                            stat.st_mtime, stat.st_size))
+    return tuple(entries)
+
+
+class Planner(object):
+    """
+    The build plan of a directory of conda recipes, kept up to date by
+    calling :meth:`refresh`.
+
+    The index is fetched again at most every index_ttl seconds.
+
+    """
+    def __init__(self, recipes_root, extra_build_conditions=(), index_ttl=300):
+        self.recipes_root = os.path.abspath(os.path.expanduser(recipes_root))
+        self.extra_build_conditions = list(extra_build_conditions)
+        self.index_ttl = index_ttl
+
+        self.index = None
+        self.index_fingerprint = None
+        #: The time at which the index was last fetched.
+        self.index_time = None
+        self._resolve = None
+
+        #: A mapping of recipe name to MetaData.
+        self.metas = {}
+        #: A mapping of recipe name to the distributions of its build matrix.
+        self.distributions = {}
+        #: A mapping of recipe name to the error raised when reading it.
+        self.errors = {}
+        self._signatures = {}
+
+        self.lock = threading.RLock()
+
+    def refresh_index(self, force=False):
+        """
+        Fetch the index again if it has expired (or force is True), returning
+        whether it has changed.
+
+        """
+        import conda.resolve
+        from conda.api import get_index
+
+        if (not force and self.index is not None and
+                time.time() - self.index_time < self.index_ttl):
+            return False
+        with vn_matrix.override_conda_logging('WARN'):
+            index = get_index()
+        self.index_time = time.time()
+        fingerprint = index_fingerprint(index)
+        if fingerprint == self.index_fingerprint:
+            return False
+        self.index, self.index_fingerprint = index, fingerprint
+        self._resolve = conda.resolve.Resolve(index)
+        return True
+
+    def _read_recipe(self, name, path):
+        from conda_build.metadata import MetaData
+
+        try:
+            self.metas[name] = MetaData(path)
+        except vn_matrix.recipe_errors() as err:
+            # Most likely a recipe which is part way through being edited.
+            print('Unable to read the {} recipe: {}'.format(name, err), file=sys.stderr)
+            self.errors[name] = str(err)
+            self.metas.pop(name, None)
+            self.distributions.pop(name, None)
+        else:
+            self.errors.pop(name, None)
+
+    def _compute_matrix(self, name):
+        try:
+            self.distributions[name] = BakedDistribution.compute_matrix(
+                self.metas[name], self.index, self.extra_build_conditions,
+                resolve=self._resolve)
+        except vn_matrix.unsatisfiable_errors() + (NotImplementedError,) as err:
+            # e.g. a matrix needing a package which isn't in the index, or
+            # one of the (unimplemented) PERL and R version matrices.
+            print('Unable to compute the build matrix of {}: {}'.format(name, err),
+                  file=sys.stderr)
+            self.errors[name] = str(err)
+            self.distributions.pop(name, None)
+
+    def refresh(self, force_index=False):
+        """
+        Bring the plan up to date with the recipes and the index, returning
+        the names of the recipes which have changed (including those which
+        have been removed), and whether the index has changed.
+
+        """
+        with self.lock:
+            index_changed = self.refresh_index(force_index)
+            dirs = recipe_dirs(self.recipes_root)
+            changed = set()
+            for name in set(self._signatures) - set(dirs):
+                del self._signatures[name]
+                self.metas.pop(name, None)
+                self.distributions.pop(name, None)
+                self.errors.pop(name, None)
+                changed.add(name)
+            for name, path in dirs.items():
+                signature = recipe_signature(path)
+                if signature != self._signatures.get(name):
+                    self._signatures[name] = signature
+                    self._read_recipe(name, path)
+                    changed.add(name)
+
+            to_compute = self.metas if index_changed else changed
+            for name in sorted(to_compute):
+                if name in self.metas:
+                    self._compute_matrix(name)
+            return changed, index_changed
+
+    def plan(self):
+        """Return the distributions of all of the recipes, in build order."""
+        with self.lock:
+            names = {id(meta): name for name, meta in self.metas.items()}
+            metas = [self.metas[name] for name in sorted(self.metas)
+                     if name in self.distributions]
+            metas = sort_dependency_order(metas)
+            return [dist for meta in metas
+                    for dist in self.distributions[names[id(meta)]]]
+
+    def dependents(self, names):
+        """
+        Return the given recipe names, along with the names of the recipes
+        which (directly or indirectly) depend on them.
+
+        """
+        with self.lock:
+            affected = set(names)
+            packages = set(self.metas[name].name() for name in affected
+                           if name in self.metas)
+            while True:
+                new = set(name for name, meta in self.metas.items()
+                          if name not in affected and
+                          any(dep in packages for dep in dependency_names(meta)))
+                if not new:
+                    return affected
+                affected.update(new)
+                packages.update(self.metas[name].name() for name in new)
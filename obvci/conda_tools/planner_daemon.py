@@ -0,0 +1,234 @@
+"""
+A long-running process which keeps a :class:`~obvci.conda_tools.planner.Planner`
+warm, and answers plan and build requests over a local Unix socket.
+
+The protocol is a single line of JSON from the client (e.g.
+``{"command": "plan"}``), answered by a single line of JSON from the daemon.
+Every response has a "status" of "ok", "failed" or "error".
+
+"""
+from __future__ import print_function
+
+import errno
+import json
+import os
+import socket
+import stat
+import tempfile
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from .build_directory import describe_distribution
+from .timing import timings
+
+
+def runtime_dir():
+    """
+    Return the private directory of the current user in which the daemon's
+    socket is made: obvci in $XDG_RUNTIME_DIR, or obvci-<uid> in the
+    temporary directory. It is created (with 0700 permissions) if needed.
+
+    """
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        directory = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'obvci')
+    else:
+        directory = os.path.join(tempfile.gettempdir(), 'obvci-{}'.format(os.getuid()))
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    # Anyone can make the directory in a shared temporary directory first.
+    dir_stat = os.lstat(directory)
+    if (not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.getuid() or
+            dir_stat.st_mode & 0o077):
+        raise RuntimeError('{} is not a directory private to the current user'
+                           ''.format(directory))
+    return directory
+
+
+def default_socket():
+    """The socket on which the daemon listens by default."""
+    return os.path.join(runtime_dir(), 'planner.sock')
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line.decode('utf-8'))
+        except ValueError as err:
+            response = {'status': 'error', 'message': 'Invalid request: {}'.format(err)}
+        else:
+            response = self.server.daemon.handle(request)
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class PlannerDaemon(object):
+    """
+    Serve the plan of the given planner, and build it with the given
+    :class:`~obvci.conda_tools.build_directory.Builder`.
+
+    The planner is refreshed every poll_interval seconds in the background,
+    and before every request, so the plan is never stale. Refreshes, plans
+    and builds all change the global conda-build config (e.g. CONDA_PY), so
+    are made one at a time: a request waits for a running build to finish.
+
+    """
+    def __init__(self, planner, builder, socket_path=None, poll_interval=2):
+        self.planner = planner
+        self.builder = builder
+        self.socket_path = socket_path or default_socket()
+        self.poll_interval = poll_interval
+        # Held whilst the planner (or a build) uses the conda-build config.
+        self.lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server = None
+
+    def handle(self, request):
+        """Return the response to the given request."""
+        command = request.get('command')
+        handler = getattr(self, 'handle_{}'.format(command), None)
+        if handler is None:
+            return {'status': 'error', 'message': 'Unknown command {!r}'.format(command)}
+        try:
+            if command == 'stop':
+                return handler(request)
+            with self.lock:
+                self.reset_stats()
+                self.planner.refresh()
+                return handler(request)
+        except Exception as err:
+            return {'status': 'error', 'message': str(err)}
+
+    def reset_stats(self):
+        """
+        Forget the timings and binstar call stats of earlier requests, which
+        are never reported by the daemon, so that they don't grow unbounded.
+
+        """
+        timings.reset()
+        binstar_cli = getattr(self.builder, 'binstar_cli', None)
+        if binstar_cli is not None and hasattr(binstar_cli, 'reset'):
+            binstar_cli.reset()
+
+    def handle_status(self, request):
+        index_age = None
+        if self.planner.index_time is not None:
+            index_age = time.time() - self.planner.index_time
+        return {'status': 'ok',
+                'recipes': len(self.planner.metas),
+                'distributions': len(self.planner.plan()),
+                'index_age': index_age,
+                'errors': self.planner.errors}
+
+    def handle_plan(self, request):
+        plan = self.planner.plan()
+        if request.get('check'):
+            # Whether each distribution will be built, and what will be done
+            # with it on the channel, in the same form as --dry-run.
+            records = list(self.builder.plan_records(plan, self.planner.index))
+        else:
+            records = [describe_distribution(dist) for dist in plan]
+        return {'status': 'ok', 'plan': records}
+
+    def handle_build(self, request):
+        try:
+            self.builder.build_distributions(self.planner.plan(), self.planner.index)
+        except SystemExit as err:
+            return {'status': 'failed', 'message': str(err),
+                    'failed_tests': self.builder.failed_tests}
+        return {'status': 'ok', 'failed_tests': []}
+
+    def handle_stop(self, request):
+        # shutdown() waits for serve_forever to return, so can't be called
+        # from the thread handling this request.
+        threading.Thread(target=self.stop).start()
+        return {'status': 'ok'}
+
+    def _poll(self):
+        while not self._stopped.wait(self.poll_interval):
+            # Don't wait for a running build; the next request refreshes anyway.
+            if not self.lock.acquire(False):
+                continue
+            try:
+                changed, index_changed = self.planner.refresh()
+            except Exception as err:
+                print('Unable to refresh the plan: {}'.format(err))
+            else:
+                if index_changed:
+                    print('Updated the plan for the new index.')
+                elif changed:
+                    print('Updated the plan of {}.'.format(', '.join(sorted(changed))))
+            finally:
+                self.lock.release()
+
+    def serve_forever(self):
+        """Serve requests until the daemon is stopped."""
+        if os.path.exists(self.socket_path):
+            if listening(self.socket_path):
+                raise RuntimeError('A daemon is already listening on {}'
+                                   ''.format(self.socket_path))
+            # Left behind by a daemon which didn't stop cleanly.
+            os.remove(self.socket_path)
+        self.planner.refresh(force_index=True)
+        self._server = _Server(self.socket_path, _RequestHandler)
+        self._server.daemon = self
+        poller = threading.Thread(target=self._poll)
+        poller.daemon = True
+        poller.start()
+        print('Serving the plan of {} recipes on {}'.format(len(self.planner.metas),
+                                                            self.socket_path))
+        try:
+            self._server.serve_forever()
+        finally:
+            self._stopped.set()
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def listening(socket_path):
+    """Whether a process is listening on the given Unix socket."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def request(command, socket_path=None, timeout=None, **kwargs):
+    """Send the given command to the daemon, returning its response."""
+    message = dict(kwargs, command=command)
+    if socket_path is None:
+        socket_path = default_socket()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        fh = sock.makefile('rb')
+        try:
+            line = fh.readline()
+        finally:
+            fh.close()
+    finally:
+        sock.close()
+    return json.loads(line.decode('utf-8'))
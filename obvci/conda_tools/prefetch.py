@@ -0,0 +1,162 @@
+"""
+Download the sources and the build/test environment packages of the
+distributions to be built, concurrently and ahead of the builds themselves.
+
+Without this, each build fetches its own source and packages as it starts,
+so the network latency of every download sits on the critical path of the
+(sequential) builds.
+
+"""
+from __future__ import print_function
+
+import hashlib
+from multiprocessing.pool import ThreadPool
+import os
+import sys
+
+from .from_conda_manifest_core_vn_matrix import unsatisfiable_errors
+from .timing import timed_function
+
+
+def environment_specs(meta):
+    """
+    Return the specs of the build and test environments of the given
+    distribution (excluding the distribution itself).
+
+    """
+    build_specs = [ms.spec for ms in meta.ms_depends('build')]
+    test_specs = ([ms.spec for ms in meta.ms_depends('run')] +
+                  list(meta.get_value('test/requires', []) or []))
+    return [build_specs, test_specs]
+
+
+def packages_to_fetch(distributions, index, exclude_names=(), solve_cache=None):
+    """
+    Resolve the build and test environments of the given distributions,
+    returning the set of package filenames needed.
+
+    Specs for the packages named in exclude_names (typically those which are
+    themselves being built) are left out of the resolution. If given, the
+    :class:`~obvci.conda_tools.solve_cache.SolveCache` is used (and warmed)
+    for the resolution.
+
+    """
+    import conda.resolve
+    from conda.resolve import MatchSpec
+
+    if solve_cache is not None:
+        solve = solve_cache.solve
+    else:
+        solve = lambda index, specs: conda.resolve.Resolve(index).solve(specs)
+    fns = set()
+    for meta in distributions:
+        for specs in environment_specs(meta):
+            specs = [spec for spec in specs
+                     if MatchSpec(spec).name not in exclude_names]
+            if not specs:
+                continue
+            try:
+                fns.update(solve(index, specs))
+            except unsatisfiable_errors() as err:
+                print('Unable to resolve {} for prefetching ({}).'.format(specs, err),
+                      file=sys.stderr)
+    return fns
+
+
+def sources_to_fetch(distributions):
+    """
+    Return a dictionary of source cache filename to (url, md5) for the url
+    sources of the given distributions.
+
+    """
+    import conda_build.source
+
+    sources = {}
+    for meta in distributions:
+        url = meta.get_value('source/url')
+        if not url:
+            continue
+        fn = meta.get_value('source/fn') or os.path.basename(url)
+        sources[os.path.join(conda_build.source.SRC_CACHE, fn)] = (url, meta.get_value('source/md5'))
+    return sources
+
+
+@timed_function('prefetch.download')
+def download(url, target, md5=None, session=None):
+    """
+    Download the given url to target (if it doesn't already exist),
+    verifying the md5 if given.
+
+    """
+    if os.path.exists(target):
+        return target
+    import requests
+
+    if not os.path.isdir(os.path.dirname(target)):
+        os.makedirs(os.path.dirname(target))
+    session = session or requests
+    # A temporary name distinct from conda's own, in case a build is
+    # downloading the same file.
+    tmp_target = target + '.obvci-part'
+    hasher = hashlib.md5()
+    response = session.get(url, stream=True)
+    response.raise_for_status()
+    with open(tmp_target, 'wb') as fh:
+        for chunk in response.iter_content(chunk_size=2 ** 16):
+            hasher.update(chunk)
+            fh.write(chunk)
+    if md5 and hasher.hexdigest() != md5:
+        os.remove(tmp_target)
+        raise ValueError('MD5 mismatch for {} (expected {}, got {})'
+                         ''.format(url, md5, hasher.hexdigest()))
+    if not os.path.exists(target):
+        os.rename(tmp_target, target)
+    else:
+        os.remove(tmp_target)
+    return target
+
+
+def _download_or_report(args):
+    url, target, md5 = args
+    try:
+        download(url, target, md5)
+    except (EnvironmentError, ValueError) as err:
+        # A network (or md5) error: the build will try again, and fail
+        # properly if it is fatal.
+        print('Failed to prefetch {}: {}'.format(url, err), file=sys.stderr)
+        return False
+    return True
+
+
+def prefetch(distributions, index, exclude_names=(), workers=4, solve_cache=None):
+    """
+    Download all of the sources and environment packages needed to build
+    and test the given distributions, using a bounded pool of workers.
+
+    Returns the number of files which were successfully fetched (or already
+    existed).
+
+    """
+    import conda.config
+
+    downloads = []
+    for target, (url, md5) in sorted(sources_to_fetch(distributions).items()):
+        downloads.append((url, target, md5))
+
+    pkgs_dir = conda.config.pkgs_dirs[0]
+    for fn in sorted(packages_to_fetch(distributions, index, exclude_names, solve_cache)):
+        target = os.path.join(pkgs_dir, fn)
+        # Packages which have been extracted don't need to be fetched again.
+        if os.path.isdir(target[:-len('.tar.bz2')]):
+            continue
+        info = index[fn]
+        downloads.append((info['channel'] + fn, target, info.get('md5')))
+
+    print('Prefetching {} files with {} workers'.format(len(downloads), workers))
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(_download_or_report, downloads)
+    finally:
+        pool.close()
+        pool.join()
+    return sum(results)
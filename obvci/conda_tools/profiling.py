@@ -0,0 +1,77 @@
+"""
+Profile the (pure Python) planning phases of a run, writing a cProfile pstats
+file and a tracemalloc summary of the memory allocated for each phase.
+
+The pstats files can be inspected with ``python -m pstats``, or a viewer such
+as snakeviz.
+
+"""
+from __future__ import print_function
+
+from contextlib import contextmanager
+import cProfile
+import os
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python < 3.4.
+    tracemalloc = None
+
+
+class PhaseProfiler(object):
+    """
+    Write the profile of each phase to the given directory, as
+    ``<n>-<phase>.pstats`` and ``<n>-<phase>.tracemalloc.txt`` (where n is
+    the order in which the phases were run). The tracemalloc summary lists
+    the top lines by the memory they allocated (and did not free) during
+    the phase.
+
+    """
+    def __init__(self, directory, top=25):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.top = top
+        self._count = 0
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _fname(self, phase, extension):
+        return os.path.join(self.directory,
+                            '{:02}-{}.{}'.format(self._count, phase, extension))
+
+    @contextmanager
+    def phase(self, phase):
+        """Profile the enclosed block as the given phase."""
+        self._count += 1
+        started_tracing = False
+        if tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            if hasattr(tracemalloc, 'reset_peak'):
+                # Python >= 3.9, otherwise the peak is that since tracing started.
+                tracemalloc.reset_peak()
+            start_snapshot = tracemalloc.take_snapshot()
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(self._fname(phase, 'pstats'))
+            if tracemalloc is not None:
+                self._write_memory(phase, start_snapshot)
+                if started_tracing:
+                    tracemalloc.stop()
+
+    def _write_memory(self, phase, start_snapshot):
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        differences = snapshot.compare_to(start_snapshot, 'lineno')
+        with open(self._fname(phase, 'tracemalloc.txt'), 'w') as fh:
+            fh.write('Traced memory after {}: {:.1f} MiB (peak {:.1f} MiB)\n'
+                     ''.format(phase, current / 2. ** 20, peak / 2. ** 20))
+            fh.write('Top {} lines by memory allocated during {}:\n'.format(self.top, phase))
+            for difference in differences[:self.top]:
+                fh.write('{}\n'.format(difference))
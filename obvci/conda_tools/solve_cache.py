@@ -0,0 +1,225 @@
+"""
+A cache of solved environments.
+
+Each case of a recipe's build matrix has its build and test environments
+solved from scratch, even though the solves across a matrix are nearly
+identical. The cache maps (specs, index fingerprint, platform) to the
+resolved, explicit list of packages so that a repeated solve is a lookup.
+
+The index fingerprint is computed from the part of the index which can
+affect the solution (the packages reachable from the specs), so that
+unrelated changes to the repodata don't invalidate the cache.
+
+"""
+from __future__ import print_function
+
+from collections import defaultdict
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import sys
+import threading
+
+from .from_conda_manifest_core_vn_matrix import unsatisfiable_errors
+
+
+def _spec_name(spec):
+    return spec.split(' ', 1)[0]
+
+
+def group_by_name(index):
+    """Return a dictionary of package name to the filenames in the index."""
+    by_name = defaultdict(list)
+    for fn, info in index.items():
+        by_name[info['name']].append(fn)
+    return by_name
+
+
+def prune_index(index, specs, by_name=None):
+    """
+    Return the subset of the index which is reachable from the given specs
+    (through the packages' dependencies).
+
+    """
+    from conda.resolve import MatchSpec
+
+    if by_name is None:
+        by_name = group_by_name(index)
+    names = set()
+    to_visit = [MatchSpec(spec).name for spec in specs]
+    while to_visit:
+        name = to_visit.pop()
+        if name in names:
+            continue
+        names.add(name)
+        for fn in by_name.get(name, ()):
+            to_visit.extend(_spec_name(dep) for dep in index[fn].get('depends', ()))
+    return {fn: index[fn] for name in names for fn in by_name.get(name, ())}
+
+
+def index_fingerprint(index):
+    """Return a hash which changes whenever any of the index's packages do."""
+    hasher = hashlib.sha256()
+    for fn in sorted(index):
+        info = index[fn]
+        hasher.update('{} {} {}\n'.format(fn, info.get('md5', ''),
+                                          info.get('channel', '')).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def exact_specs(fns, index):
+    """Turn the given package filenames into fully pinned specs."""
+    return ['{} {} {}'.format(index[fn]['name'], index[fn]['version'],
+                              index[fn]['build']) for fn in fns]
+
+
+class SolveCache(object):
+    """
+    A cache of resolved package lists, held in memory and (optionally)
+    persisted to the given directory.
+
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        if directory is not None:
+            self.directory = os.path.abspath(os.path.expanduser(directory))
+        self._solutions = {}
+        self._grouped = (None, None, None)
+        self.hits = 0
+        self.misses = 0
+
+    def _group_by_name(self, index):
+        # Grouping the index is linear in its size, so we remember the
+        # grouping of the index we were last given (and its length, in case
+        # it has been added to). The index itself is kept, rather than its
+        # id, so that a new index can't be mistaken for it.
+        grouped_index, length, grouping = self._grouped
+        if grouped_index is not index or length != len(index):
+            grouping = group_by_name(index)
+            self._grouped = (index, len(index), grouping)
+        return grouping
+
+    def key(self, specs, index, platform=None):
+        """The cache key of solving the given specs against the given index."""
+        if platform is None:
+            import conda.config
+            platform = conda.config.subdir
+        pruned = prune_index(index, specs, self._group_by_name(index))
+        content = {'specs': sorted(specs),
+                   'index': index_fingerprint(pruned),
+                   'platform': platform}
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _fname(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        if key in self._solutions:
+            return self._solutions[key]
+        if self.directory is not None and os.path.exists(self._fname(key)):
+            with open(self._fname(key), 'r') as fh:
+                self._solutions[key] = json.load(fh)
+            return self._solutions[key]
+        return None
+
+    def put(self, key, fns):
+        self._solutions[key] = list(fns)
+        if self.directory is not None:
+            fname = self._fname(key)
+            if not os.path.isdir(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+            with open(fname, 'w') as fh:
+                json.dump(list(fns), fh)
+
+    def solve(self, index, specs):
+        """
+        Return the list of package filenames which satisfy the given specs,
+        solving them only if they are not already in the cache.
+
+        """
+        key = self.key(specs, index)
+        fns = self.get(key)
+        # A cached solution is only valid if the packages are in the index.
+        if fns is not None and all(fn in index for fn in fns):
+            self.hits += 1
+            return fns
+        import conda.resolve
+
+        self.misses += 1
+        fns = conda.resolve.Resolve(index).solve(list(specs))
+        self.put(key, fns)
+        return fns
+
+
+_shared = threading.local()
+
+
+def environment_index(kwargs):
+    """
+    The index from which conda-build creates an environment, given the
+    keyword arguments of its create_env (the build root is a channel of it).
+
+    Within :func:`shared_index`, the index of the enclosing create_env is
+    returned rather than fetching it again.
+
+    """
+    from conda.api import get_index
+    from conda.utils import url_path
+    import conda_build.config
+
+    index = getattr(_shared, 'index', None)
+    if index is None:
+        channel_urls = list(kwargs.get('channel_urls', ()))
+        index = get_index(channel_urls=[url_path(conda_build.config.croot)] + channel_urls,
+                          prepend=not kwargs.get('override_channels', False))
+    return index
+
+
+@contextmanager
+def shared_index(index):
+    """
+    Share the given index with the create_env wrappers called within this
+    context (e.g. the solve cache's, when called by the environment pool's).
+
+    """
+    orig_index = getattr(_shared, 'index', None)
+    _shared.index = index
+    try:
+        yield
+    finally:
+        _shared.index = orig_index
+
+
+@contextmanager
+def cached_environments(cache):
+    """
+    Within this context, conda-build's build and test environments are
+    created from the solutions in the given cache.
+
+    The environments are created from fully pinned specs, which conda
+    satisfies without needing to search for a solution.
+
+    """
+    import conda_build.build as build_module
+
+    orig_create_env = build_module.create_env
+
+    def create_env(prefix, specs, *args, **kwargs):
+        if specs:
+            index = environment_index(kwargs)
+            try:
+                fns = cache.solve(index, specs)
+            except unsatisfiable_errors() as err:
+                # Leave conda to report the problem properly.
+                print('Unable to solve {} for the solve cache ({}).'.format(specs, err),
+                      file=sys.stderr)
+            else:
+                specs = exact_specs(fns, index)
+        return orig_create_env(prefix, specs, *args, **kwargs)
+
+    build_module.create_env = create_env
+    try:
+        yield
+    finally:
+        build_module.create_env = orig_create_env
@@ -0,0 +1,288 @@
+"""
+Upload distributions to anaconda.org as a stream of chunks, logging the
+progress and throughput.
+
+When the server offers a resumable upload (an ``upload_url`` when the
+upload is staged) the file is PUT in chunks, and hashed in the same pass.
+An interrupted upload resumes from the last offset which the server
+acknowledged. Otherwise the file is hashed (the storage form needs its
+Content-MD5 up front) and then streamed to the storage URL, restarting from
+the beginning, with backoff, after an interruption.
+
+"""
+from __future__ import print_function
+
+import base64
+import hashlib
+import os
+import re
+import time
+import uuid
+
+from .binstar_gateway import gateway
+from .timing import clock
+
+
+#: The size (in bytes) of the chunks in which files are read and uploaded.
+CHUNK_SIZE = 8 * 2 ** 20
+#: The interval (in seconds) at which the progress of an upload is logged.
+PROGRESS_INTERVAL = 10
+
+MB = float(2 ** 20)
+
+
+class Progress(object):
+    """Track (and log every interval seconds) the progress of an upload."""
+    def __init__(self, name, size, interval=PROGRESS_INTERVAL):
+        self.name = name
+        self.size = size
+        self.interval = interval
+        #: The number of bytes sent, including those sent again after a restart.
+        self.transferred = 0
+        #: The number of bytes of the file which have been sent.
+        self.offset = 0
+        self.start = self._logged = clock()
+
+    def rate(self):
+        """The throughput (in MB/s) so far."""
+        return self.transferred / MB / max(clock() - self.start, 1e-6)
+
+    def advance(self, n_bytes):
+        self.transferred += n_bytes
+        self.offset += n_bytes
+        now = clock()
+        if now - self._logged >= self.interval:
+            self._logged = now
+            print('    {}: {:.1f} of {:.1f} MB ({:.2f} MB/s)'
+                  ''.format(self.name, self.offset / MB, self.size / MB, self.rate()))
+
+    def finish(self):
+        print('Uploaded {} ({:.1f} MB) in {:.1f}s ({:.2f} MB/s)'
+              ''.format(self.name, self.size / MB, clock() - self.start, self.rate()))
+
+
+def read_chunks(fh, chunk_size=CHUNK_SIZE):
+    """Yield the chunks of the (rest of the) given file."""
+    while True:
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def hash_file(fname, chunk_size=CHUNK_SIZE):
+    """Return the md5 (hash object) and size of the given file."""
+    md5 = hashlib.md5()
+    size = 0
+    with open(fname, 'rb') as fh:
+        for chunk in read_chunks(fh, chunk_size):
+            md5.update(chunk)
+            size += len(chunk)
+    return md5, size
+
+
+class MultipartBody(object):
+    """
+    A multipart/form-data body of the given fields and file, which reads the
+    file as it is sent (at the rate of the throttle, a bytes
+    :class:`~obvci.conda_tools.binstar_gateway.TokenBucket`, if given).
+
+    """
+    def __init__(self, fields, fname, basename, progress=None, throttle=None):
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(boundary)
+        head = []
+        for name, value in fields.items():
+            head.append('--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n'
+                        '{}\r\n'.format(boundary, name, value))
+        head.append('--{}\r\nContent-Disposition: form-data; name="file"; filename="{}"\r\n'
+                    'Content-Type: application/octet-stream\r\n\r\n'
+                    ''.format(boundary, os.path.basename(basename)))
+        self._head = ''.join(head).encode('utf-8')
+        self._tail = '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+        self._length = len(self._head) + os.path.getsize(fname) + len(self._tail)
+        self._fname = fname
+        self.progress = progress
+        self.throttle = throttle
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        yield self._head
+        with open(self._fname, 'rb') as fh:
+            for chunk in read_chunks(fh, 2 ** 16):
+                if self.throttle is not None:
+                    self.throttle.acquire(len(chunk))
+                if self.progress is not None:
+                    self.progress.advance(len(chunk))
+                yield chunk
+        yield self._tail
+
+
+def _post_json(cli, url, payload):
+    from binstar_client.utils import jencode
+
+    data, headers = jencode(payload)
+    response = cli.request('POST', url, data=data, headers=headers)
+    cli.check_response(response, [200, 201])
+    return response.json()
+
+
+def _transfer_errors():
+    """The exceptions of an interrupted transfer."""
+    import requests
+
+    return (requests.ConnectionError, requests.Timeout)
+
+
+def _post_file(cli, url, fields, fname, basename, progress, throttle=None):
+    """POST the file to the storage URL, as a streamed multipart form."""
+    import binstar_client
+
+    progress.offset = 0
+    body = MultipartBody(fields, fname, basename, progress, throttle)
+    response = cli.request('POST', url, authenticated=False, data=body,
+                           headers={'Content-Type': body.content_type})
+    cli.record('upload_data', bytes_sent=len(body))
+    if response.status_code != 201:
+        raise binstar_client.errors.BinstarError('Error uploading package',
+                                                 response.status_code)
+
+
+def _put_chunk(cli, url, chunk, offset, size, throttle=None):
+    """PUT the chunk at the given offset, returning the offset acknowledged by the server."""
+    if throttle is not None and chunk:
+        throttle.acquire(len(chunk))
+    if chunk:
+        content_range = 'bytes {}-{}/{}'.format(offset, offset + len(chunk) - 1, size)
+    else:
+        content_range = 'bytes */{}'.format(size)
+    response = cli.request('PUT', url, authenticated=False, data=chunk,
+                           headers={'Content-Range': content_range})
+    cli.record('upload_data', bytes_sent=len(chunk))
+    cli.check_response(response, [200, 201, 308])
+    if response.status_code in (200, 201):
+        return size
+    match = re.match(r'bytes=0-(\d+)', response.headers.get('Range', ''))
+    return int(match.group(1)) + 1 if match else 0
+
+
+def _retry_transfer(cli, err, attempt, max_restarts):
+    """Back off after the given error of an interrupted transfer (or re-raise it)."""
+    import binstar_client
+
+    if isinstance(err, binstar_client.errors.BinstarError):
+        # The gateway has already retried the statuses which can be retried;
+        # a 416 means the server has a different offset to ours.
+        status = err.args[1] if len(err.args) > 1 else None
+        if status != 416:
+            raise err
+    if attempt > max_restarts:
+        raise err
+    delay = cli.retry_delay(attempt)
+    print('The upload was interrupted ({}), retrying in {:.1f}s ({} of {}).'
+          ''.format(err, delay, attempt, max_restarts))
+    time.sleep(delay)
+
+
+def _resumable_upload(cli, url, fname, progress, chunk_size, max_restarts, throttle=None):
+    """PUT the file in chunks (resuming after interruptions), returning its md5."""
+    import binstar_client
+
+    errors = _transfer_errors() + (binstar_client.errors.BinstarError,)
+    md5 = hashlib.md5()
+    # The offset up to which the file has been acknowledged (and hashed).
+    offset = 0
+    attempt = 0
+    interrupted = False
+    with open(fname, 'rb') as fh:
+        while True:
+            try:
+                if interrupted:
+                    # Ask the server how much it received, which may fail too.
+                    acknowledged = cli.call('upload_data', _put_chunk, cli, url, b'', offset,
+                                            progress.size)
+                    interrupted = False
+                    if acknowledged < offset:
+                        # The server has lost some of what it acknowledged, so start again.
+                        md5, offset = hashlib.md5(), 0
+                    fh.seek(offset)
+                    # Hash what the server received, but didn't get to acknowledge.
+                    while offset < acknowledged:
+                        chunk = fh.read(min(chunk_size, acknowledged - offset))
+                        if not chunk:
+                            break
+                        md5.update(chunk)
+                        offset += len(chunk)
+                    progress.offset = offset
+                if progress.size == 0:
+                    cli.call('upload_data', _put_chunk, cli, url, b'', 0, 0)
+                for chunk in read_chunks(fh, chunk_size):
+                    cli.call('upload_data', _put_chunk, cli, url, chunk, offset, progress.size,
+                             throttle)
+                    md5.update(chunk)
+                    offset += len(chunk)
+                    progress.advance(len(chunk))
+                return md5
+            except errors as err:
+                attempt += 1
+                _retry_transfer(cli, err, attempt, max_restarts)
+                interrupted = True
+
+
+def _restarted_upload(cli, url, fields, fname, basename, progress, md5, max_restarts,
+                      throttle=None):
+    """POST the file to the storage URL, from the start after interruptions."""
+    fields = dict(fields)
+    fields['Content-Length'] = progress.size
+    fields['Content-MD5'] = base64.b64encode(md5.digest()).decode('ascii')
+    attempt = 0
+    while True:
+        try:
+            return cli.call('upload_data', _post_file, cli, url, fields, fname, basename,
+                            progress, throttle)
+        except _transfer_errors() as err:
+            attempt += 1
+            _retry_transfer(cli, err, attempt, max_restarts)
+
+
+def stream_upload(cli, owner, package_name, version, basename, fname, distribution_type,
+                  description='', dependencies=None, attrs=None, channels=('main',),
+                  chunk_size=CHUNK_SIZE, max_restarts=5, throttle=None):
+    """
+    Upload the given file as a distribution of an (already existing) release,
+    returning the information of the distribution from the server.
+
+    Interrupted transfers are resumed (or restarted) up to max_restarts
+    times. The file is sent no faster than the throttle (a bytes
+    :class:`~obvci.conda_tools.binstar_gateway.TokenBucket`, which may be
+    shared by concurrent uploads) allows.
+
+    """
+    import binstar_client
+
+    cli = gateway(cli)
+    upload_path = '{}/{}/{}/{}'.format(owner, package_name, version, basename)
+    payload = dict(distribution_type=distribution_type, description=description,
+                   attrs=attrs or {}, dependencies=dependencies, channels=list(channels))
+    staged = cli.call('stage', _post_json, cli, '/stage/{}'.format(upload_path), payload)
+
+    progress = Progress(basename, os.path.getsize(fname))
+    if staged.get('upload_url'):
+        md5 = _resumable_upload(cli, staged['upload_url'], fname, progress, chunk_size,
+                                max_restarts, throttle)
+    else:
+        md5, _ = hash_file(fname, chunk_size)
+        _restarted_upload(cli, staged['post_url'], staged.get('form_data') or {}, fname,
+                          basename, progress, md5, max_restarts, throttle)
+
+    info = cli.call('commit', _post_json, cli, '/commit/{}'.format(upload_path),
+                    {'dist_id': staged['dist_id']})
+    if info.get('md5') not in (None, md5.hexdigest()):
+        raise binstar_client.errors.BinstarError('The md5 of the uploaded {} ({}) does not '
+                                                 'match that of {} ({})'
+                                                 ''.format(basename, info['md5'], fname,
+                                                           md5.hexdigest()))
+    progress.finish()
+    return info
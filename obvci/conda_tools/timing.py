@@ -0,0 +1,176 @@
+"""
+Monotonic timers and call counters for the phases of a run (index fetch,
+recipe parsing, matrix computation, binstar queries, builds and uploads),
+in total and per distribution, reported as JSON once the run has finished.
+
+Optionally, each timed call is also recorded as a span of the thread (and
+process) it ran in, which can be written in the Chrome trace event format
+(for chrome://tracing, or https://ui.perfetto.dev) to show concurrency,
+idle gaps and lock contention.
+
+"""
+from __future__ import print_function
+
+from collections import defaultdict
+from contextlib import contextmanager
+import functools
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+
+#: A monotonic clock (Python 2 has none, so falls back to the wall clock).
+clock = getattr(time, 'perf_counter', time.time)
+
+
+def _new_stats():
+    return {'calls': 0, 'seconds': 0.0}
+
+
+class Timings(object):
+    """The number of calls to, and the time spent in, each phase of a run."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, tracing=False):
+        self.started = clock()
+        #: A mapping of phase to its stats.
+        self.phases = defaultdict(_new_stats)
+        #: A mapping of dist name to a mapping of phase to its stats.
+        self.distributions = defaultdict(lambda: defaultdict(_new_stats))
+        #: The trace events recorded, or None if not tracing.
+        self.events = [] if tracing else None
+        self._tracks = set()
+
+    def record(self, phase, start, end, dist=None):
+        """Record a call to the given phase, from start to end (by :data:`clock`)."""
+        with self._lock:
+            all_stats = [self.phases[phase]]
+            if dist is not None:
+                all_stats.append(self.distributions[dist][phase])
+            for stats in all_stats:
+                stats['calls'] += 1
+                stats['seconds'] += end - start
+            if self.events is not None:
+                self._record_event(phase, start, end, dist)
+
+    def _record_event(self, phase, start, end, dist):
+        pid, tid = os.getpid(), threading.current_thread().ident
+        if (pid, tid) not in self._tracks:
+            # Name the process and thread tracks of the trace.
+            self._tracks.add((pid, tid))
+            self.events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                'args': {'name': multiprocessing.current_process().name}})
+            self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                'args': {'name': threading.current_thread().name}})
+        event = {'name': phase, 'cat': phase.split('.')[0], 'ph': 'X',
+                 'ts': start * 1e6, 'dur': (end - start) * 1e6,
+                 'pid': pid, 'tid': tid}
+        if dist is not None:
+            event['args'] = {'dist': dist}
+        self.events.append(event)
+
+    def recorded(self):
+        """The stats and trace events recorded, to be merged into other timings."""
+        with self._lock:
+            return {'phases': dict(self.phases),
+                    'distributions': {dist: dict(phases)
+                                      for dist, phases in self.distributions.items()},
+                    'events': list(self.events or [])}
+
+    def merge(self, recorded):
+        """Add the stats and trace events recorded elsewhere (e.g. in a worker process)."""
+        with self._lock:
+            all_stats = [(self.phases, recorded['phases'])]
+            all_stats.extend((self.distributions[dist], phases)
+                             for dist, phases in recorded['distributions'].items())
+            for target, source in all_stats:
+                for phase, stats in source.items():
+                    target[phase]['calls'] += stats['calls']
+                    target[phase]['seconds'] += stats['seconds']
+            if self.events is not None:
+                self.events.extend(recorded['events'])
+
+    def report(self):
+        """A JSON serialisable report of the timings."""
+        with self._lock:
+            return {'total_seconds': clock() - self.started,
+                    'phases': dict(self.phases),
+                    'distributions': {dist: dict(phases)
+                                      for dist, phases in self.distributions.items()}}
+
+    def write_report(self, fname):
+        with open(fname, 'w') as fh:
+            json.dump(self.report(), fh, indent=2, sort_keys=True)
+
+    def write_trace(self, fname):
+        """Write the trace events in the Chrome trace event format."""
+        with self._lock:
+            trace = {'traceEvents': list(self.events or []),
+                     'displayTimeUnit': 'ms'}
+        with open(fname, 'w') as fh:
+            json.dump(trace, fh)
+
+
+#: The timings of this process.
+timings = Timings()
+
+
+@contextmanager
+def timed(phase, dist=None):
+    """Time the enclosed block as the given phase (of the given dist name)."""
+    start = clock()
+    try:
+        yield
+    finally:
+        timings.record(phase, start, clock(), dist)
+
+
+def dist_argument(position, name):
+    """
+    Return a callable which, given the arguments of a call, returns the dist
+    name of the meta passed as the given positional or keyword argument.
+
+    """
+    def dist(*args, **kwargs):
+        meta = args[position] if len(args) > position else kwargs.get(name)
+        return meta.dist() if meta is not None else None
+    return dist
+
+
+def timed_function(phase, dist=None):
+    """
+    Decorate a function such that each call is timed as the given phase.
+
+    If given, dist is a callable of the function's arguments which returns
+    the dist name the call is for (see :func:`dist_argument`).
+
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                end = clock()
+                timings.record(phase, start, end,
+                               dist(*args, **kwargs) if dist is not None else None)
+        return wrapper
+    return decorator
+
+
+def run_traced(function, *args):
+    """
+    Call the given function (in a worker process), returning its result along
+    with the timings (and trace events) recorded during the call, so that
+    they can be merged into those of the main process with
+    :meth:`Timings.merge`.
+
+    """
+    # The worker inherits the timings of its parent, which are already known.
+    timings.reset(tracing=timings.events is not None)
+    return function(*args), timings.recorded()
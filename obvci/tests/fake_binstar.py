@@ -0,0 +1,607 @@
+"""
+A local stand-in for the subset of the anaconda.org (binstar) API which
+obvci uses, for running the tests and benchmarks offline.
+
+The server keeps its packages in memory, and can be configured to add
+latency to every request, to limit its bandwidth, and to fail requests
+(at random, or on demand)::
+
+    with FakeBinstar(login='Obvious-ci-tests', latency=0.05) as server:
+        cli = server.client()
+        cli.add_package('Obvious-ci-tests', 'foo', 'A summary')
+
+It can also be run standalone (``python -m obvci.tests.fake_binstar``), with
+a client created by ``binstar_client.Binstar(token, domain=<url>)``.
+
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+from collections import OrderedDict
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+
+
+_NAME = r'(?P<owner>[^/]+)/(?P<name>[^/]+)'
+_RELEASE = _NAME + r'/(?P<version>[^/]+)'
+_FILE = _RELEASE + r'/(?P<basename>.+)'
+
+#: The (method, path pattern, handler name) of each route of the API.
+ROUTES = [('GET', r'/user', 'get_user'),
+          ('GET', r'/packages/(?P<owner>[^/]+)', 'get_user_packages'),
+          ('GET', r'/package/' + _NAME, 'get_package'),
+          ('POST', r'/package/' + _NAME, 'add_package'),
+          ('DELETE', r'/package/' + _NAME, 'remove_package'),
+          ('GET', r'/release/' + _RELEASE, 'get_release'),
+          ('POST', r'/release/' + _RELEASE, 'add_release'),
+          ('GET', r'/dist/' + _FILE, 'get_distribution'),
+          ('DELETE', r'/dist/' + _FILE, 'remove_distribution'),
+          ('GET', r'/download/' + _FILE, 'download'),
+          ('POST', r'/stage/' + _FILE, 'stage'),
+          ('POST', r'/s3/(?P<dist_id>[^/]+)', 's3_upload'),
+          ('PUT', r'/resumable/(?P<dist_id>[^/]+)', 'resumable_upload'),
+          ('POST', r'/commit/' + _FILE, 'commit'),
+          ('GET', r'/channels/(?P<owner>[^/]+)', 'list_channels'),
+          ('GET', r'/channels/(?P<owner>[^/]+)/(?P<channel>[^/]+)', 'show_channel'),
+          ('POST', r'/channels/(?P<owner>[^/]+)/(?P<channel>[^/]+)', 'add_channel'),
+          ('DELETE', r'/channels/(?P<owner>[^/]+)/(?P<channel>[^/]+)', 'remove_channel'),
+          ]
+_COMPILED_ROUTES = [(method, re.compile('^' + pattern + '$'), name)
+                    for method, pattern, name in ROUTES]
+
+
+#: The status of an injected error which drops the connection part way
+#: through the request, without a response.
+DROP = 0
+#: The status of an injected error which handles the request, but drops the
+#: connection instead of responding.
+LOSE_RESPONSE = -1
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+
+
+def parse_multipart(body, content_type):
+    """Return a dictionary of field name to the (bytes) value of a multipart body."""
+    match = re.search(r'boundary=("?)([^";]+)\1', content_type)
+    if not match:
+        raise HTTPError(400, 'No multipart boundary given.')
+    boundary = b'--' + match.group(2).encode('ascii')
+    fields = {}
+    for part in body.split(boundary)[1:]:
+        if part.startswith(b'--'):
+            break
+        headers, _, value = part.partition(b'\r\n\r\n')
+        name = re.search(br'name="([^"]*)"', headers)
+        if name:
+            fields[name.group(1).decode('utf-8')] = value[:-2] if value.endswith(b'\r\n') else value
+    return fields
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Don't hold back the body of a response behind its headers.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Keep the test output quiet.
+        pass
+
+    def _read_body(self):
+        server = self.server.fake
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                chunk = server.throttled_read(self.rfile, size)
+                self.rfile.readline()
+                if not size:
+                    break
+                chunks.append(chunk)
+            return b''.join(chunks)
+        length = int(self.headers.get('Content-Length') or 0)
+        return server.throttled_read(self.rfile, length)
+
+    def _respond(self, status, content=b'', content_type='application/json',
+                 headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.server.fake.throttled_write(self.wfile, content)
+
+    def _drop(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.server.fake.throttled_read(self.rfile, length // 2)
+        self.close_connection = True
+
+    def _handle(self):
+        server = self.server.fake
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        query = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        error = server.injected_error(self.command, path)
+        if error is not None and error[0] == DROP:
+            server.record(self.command, path, DROP, 0, 0)
+            return self._drop()
+        lose_response = error is not None and error[0] == LOSE_RESPONSE
+        if lose_response:
+            error = None
+        body = self._read_body()
+        if server.latency:
+            time.sleep(server.latency)
+
+        status, headers = 200, {}
+        try:
+            if error is not None:
+                status, headers = error
+                raise HTTPError(status, 'Injected error')
+            for method, pattern, name in _COMPILED_ROUTES:
+                match = pattern.match(path)
+                if match and method == self.command:
+                    break
+            else:
+                raise HTTPError(404, 'No route for {} {}'.format(self.command, path))
+            request = {'args': match.groupdict(), 'query': query, 'body': body,
+                       'headers': self.headers}
+            result = getattr(server, name)(request)
+        except HTTPError as err:
+            status = err.status
+            content = json.dumps({'error': str(err)}).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            if isinstance(result, tuple):
+                status, result, headers = (result + ({},))[:3]
+            if isinstance(result, bytes):
+                content, content_type = result, 'application/octet-stream'
+            else:
+                content, content_type = json.dumps(result).encode('utf-8'), 'application/json'
+        server.record(self.command, path, status, len(body), len(content))
+        if lose_response:
+            self.close_connection = True
+        else:
+            self._respond(status, content, content_type, headers)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeBinstar(object):
+    """
+    An in-memory anaconda.org API server, run in a background thread.
+
+    latency is the time (in seconds) added to every request, bandwidth is
+    the rate (in bytes per second) at which request and response bodies are
+    transferred (None for no limit), and error_rate is the probability of
+    any request failing with error_status.
+
+    With paginate, channel listings are split into pages when a ``page``
+    (and ``per_page``) is given in the query.
+
+    With resumable, staging an upload also gives an ``upload_url`` to which
+    the file can be PUT in chunks (each with a ``Content-Range``), and from
+    which the acknowledged offset can be queried (with ``bytes */total``)
+    after an interruption.
+
+    """
+    def __init__(self, login='fake-user', latency=0, bandwidth=None,
+                 error_rate=0, error_status=503, retry_after=None, seed=0,
+                 paginate=True, resumable=False, host='127.0.0.1', port=0):
+        self.login = login
+        self.paginate = paginate
+        self.resumable = resumable
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        #: The Retry-After header of the injected 429 responses.
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._address = (host, port)
+        self._server = None
+        self._thread = None
+        self._dist_ids = itertools.count()
+        self._injected = []
+
+        #: A mapping of (owner, name) to package.
+        self.packages = OrderedDict()
+        #: A mapping of (owner, name, version) to release.
+        self.releases = OrderedDict()
+        #: A mapping of (owner, name, version, basename) to file.
+        self.files = OrderedDict()
+        #: The staged (not yet committed) uploads, by dist id.
+        self.staged = {}
+        #: A (method, path, status, bytes received, bytes sent) tuple per request.
+        self.requests = []
+
+    # Running the server.
+
+    def start(self):
+        self._server = _Server(self._address, _RequestHandler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def client(self, token='fake-token'):
+        """Return a binstar client of this server."""
+        from binstar_client import Binstar
+
+        return Binstar(token, domain=self.url)
+
+    # Network conditions.
+
+    def inject_errors(self, count=1, status=503, method=None, path='', after=0):
+        """
+        Fail count requests (whose method and path match), after the next
+        after of them, with the given status. A status of DROP closes the
+        connection part way through reading the request instead, and one of
+        LOSE_RESPONSE closes it (having handled the request) instead of
+        responding.
+
+        """
+        with self._lock:
+            self._injected.extend([[method, path, status, after] for _ in range(count)])
+
+    def injected_error(self, method, path):
+        """Return the (status, headers) of the error to fail the given request with, or None."""
+        with self._lock:
+            for i, (error_method, error_path, status, after) in enumerate(self._injected):
+                if error_method in (None, method) and path.startswith(error_path):
+                    if after:
+                        self._injected[i][3] -= 1
+                        continue
+                    del self._injected[i]
+                    break
+            else:
+                if not self.error_rate or self._random.random() >= self.error_rate:
+                    return None
+                status = self.error_status
+        headers = {}
+        if status == 429 and self.retry_after is not None:
+            headers['Retry-After'] = str(self.retry_after)
+        return status, headers
+
+    def _throttle(self, n_bytes):
+        if self.bandwidth and n_bytes:
+            time.sleep(float(n_bytes) / self.bandwidth)
+
+    def throttled_read(self, fh, length, chunk_size=2 ** 16):
+        chunks = []
+        while length > 0:
+            chunk = fh.read(min(chunk_size, length))
+            if not chunk:
+                break
+            self._throttle(len(chunk))
+            chunks.append(chunk)
+            length -= len(chunk)
+        return b''.join(chunks)
+
+    def throttled_write(self, fh, content, chunk_size=2 ** 16):
+        for start in range(0, len(content), chunk_size):
+            chunk = content[start:start + chunk_size]
+            self._throttle(len(chunk))
+            fh.write(chunk)
+
+    def record(self, method, path, status, received, sent):
+        with self._lock:
+            self.requests.append((method, path, status, received, sent))
+
+    def request_count(self, method=None, path=''):
+        """The number of requests made (with the given method and path prefix)."""
+        return len([request for request in self.requests
+                    if method in (None, request[0]) and request[1].startswith(path)])
+
+    # The API.
+
+    @staticmethod
+    def _json(request):
+        if not request['body']:
+            return {}
+        return json.loads(request['body'].decode('utf-8'))
+
+    def _lookup(self, mapping, key, kind):
+        if key not in mapping:
+            raise HTTPError(404, '{} {} does not exist'.format(kind, '/'.join(key)))
+        return mapping[key]
+
+    def _public_file(self, key):
+        owner, name, version, basename = key
+        info = self.files[key]
+        return {'basename': basename, 'version': version,
+                'full_name': '/'.join(key), 'owner': owner, 'package': name,
+                'md5': info['md5'], 'size': info['size'],
+                'distribution_type': info['distribution_type'],
+                'description': info['description'], 'attrs': info['attrs'],
+                'dependencies': info['dependencies'],
+                'channels': sorted(info['channels']),
+                'upload_time': info['upload_time']}
+
+    def _package_files(self, owner, name, version=None):
+        return [key for key in self.files
+                if key[:2] == (owner, name) and version in (None, key[2])]
+
+    def _public_package(self, key):
+        package = dict(self.packages[key])
+        package['versions'] = [release[2] for release in self.releases
+                               if release[:2] == key]
+        package['files'] = [self._public_file(file_key)
+                            for file_key in self._package_files(*key)]
+        return package
+
+    def get_user(self, request):
+        return {'login': self.login, 'user_type': 'user'}
+
+    def get_user_packages(self, request):
+        with self._lock:
+            owner = request['args']['owner']
+            return [self._public_package(key) for key in self.packages if key[0] == owner]
+
+    def get_package(self, request):
+        with self._lock:
+            key = (request['args']['owner'], request['args']['name'])
+            self._lookup(self.packages, key, 'Package')
+            return self._public_package(key)
+
+    def add_package(self, request):
+        with self._lock:
+            key = (request['args']['owner'], request['args']['name'])
+            if key in self.packages:
+                raise HTTPError(409, 'Package {} already exists'.format('/'.join(key)))
+            payload = self._json(request)
+            self.packages[key] = {'owner': key[0], 'name': key[1],
+                                  'summary': payload.get('summary'),
+                                  'license': payload.get('license'),
+                                  'public': payload.get('public', True)}
+            return self._public_package(key)
+
+    def remove_package(self, request):
+        with self._lock:
+            key = (request['args']['owner'], request['args']['name'])
+            self._lookup(self.packages, key, 'Package')
+            del self.packages[key]
+            for release in [release for release in self.releases if release[:2] == key]:
+                del self.releases[release]
+            for file_key in self._package_files(*key):
+                del self.files[file_key]
+            return 201, {}
+
+    def _public_release(self, key):
+        release = dict(self.releases[key])
+        release['distributions'] = [self._public_file(file_key)
+                                    for file_key in self._package_files(*key)]
+        return release
+
+    def get_release(self, request):
+        with self._lock:
+            args = request['args']
+            key = (args['owner'], args['name'], args['version'])
+            self._lookup(self.releases, key, 'Release')
+            return self._public_release(key)
+
+    def add_release(self, request):
+        with self._lock:
+            args = request['args']
+            key = (args['owner'], args['name'], args['version'])
+            self._lookup(self.packages, key[:2], 'Package')
+            if key in self.releases:
+                raise HTTPError(409, 'Release {} already exists'.format('/'.join(key)))
+            payload = self._json(request)
+            self.releases[key] = {'version': key[2],
+                                  'description': payload.get('description', '')}
+            return self._public_release(key)
+
+    def _file_key(self, request):
+        args = request['args']
+        return (args['owner'], args['name'], args['version'], args['basename'])
+
+    def get_distribution(self, request):
+        with self._lock:
+            key = self._file_key(request)
+            self._lookup(self.files, key, 'Distribution')
+            return self._public_file(key)
+
+    def remove_distribution(self, request):
+        with self._lock:
+            key = self._file_key(request)
+            self._lookup(self.files, key, 'Distribution')
+            info = self._public_file(key)
+            del self.files[key]
+            return info
+
+    def download(self, request):
+        with self._lock:
+            key = self._file_key(request)
+            return self._lookup(self.files, key, 'Distribution')['data']
+
+    def stage(self, request):
+        with self._lock:
+            key = self._file_key(request)
+            self._lookup(self.releases, key[:3], 'Release')
+            if key in self.files:
+                raise HTTPError(409, 'Distribution {} already exists'.format('/'.join(key)))
+            payload = self._json(request)
+            dist_id = str(next(self._dist_ids))
+            self.staged[dist_id] = {'key': key, 'payload': payload, 'data': None,
+                                    'received': bytearray()}
+            result = {'dist_id': dist_id, 'form_data': {},
+                      'post_url': '{}/s3/{}'.format(self.url, dist_id)}
+            if self.resumable:
+                result['upload_url'] = '{}/resumable/{}'.format(self.url, dist_id)
+            return result
+
+    def s3_upload(self, request):
+        fields = parse_multipart(request['body'], request['headers'].get('Content-Type', ''))
+        data = fields.get('file')
+        if data is None:
+            raise HTTPError(400, 'No file was uploaded.')
+        md5 = hashlib.md5(data)
+        expected_md5 = fields.get('Content-MD5')
+        if expected_md5 is not None and base64.b64decode(expected_md5) != md5.digest():
+            raise HTTPError(400, 'The Content-MD5 of the upload does not match.')
+        with self._lock:
+            staged = self._lookup(self.staged, request['args']['dist_id'], 'Upload')
+            staged['data'] = data
+        return 201, {}
+
+    def resumable_upload(self, request):
+        content_range = request['headers'].get('Content-Range', '')
+        match = re.match(r'bytes (?:(\d+)-(\d+)|\*)/(\d+)$', content_range)
+        if not match:
+            raise HTTPError(400, 'Invalid Content-Range {!r}'.format(content_range))
+        with self._lock:
+            staged = self._lookup(self.staged, request['args']['dist_id'], 'Upload')
+            received = staged['received']
+            total = int(match.group(3))
+            if match.group(1) is not None:
+                start, end = int(match.group(1)), int(match.group(2))
+                if start != len(received) or end - start + 1 != len(request['body']):
+                    raise HTTPError(416, 'Expected bytes from {}'.format(len(received)))
+                received.extend(request['body'])
+            if len(received) >= total:
+                staged['data'] = bytes(received)
+                return 201, {'size': len(received)}
+            headers = {'Range': 'bytes=0-{}'.format(len(received) - 1)} if received else {}
+            return 308, {'size': len(received)}, headers
+
+    def commit(self, request):
+        with self._lock:
+            dist_id = self._json(request).get('dist_id')
+            staged = self.staged.get(dist_id)
+            if staged is None or staged['key'] != self._file_key(request):
+                raise HTTPError(404, 'No staged upload {}'.format(dist_id))
+            if staged['data'] is None:
+                raise HTTPError(400, 'The file of upload {} was not uploaded'.format(dist_id))
+            payload = staged['payload']
+            del self.staged[dist_id]
+            key = staged['key']
+            self.files[key] = {'data': staged['data'],
+                               'md5': hashlib.md5(staged['data']).hexdigest(),
+                               'size': len(staged['data']),
+                               'distribution_type': payload.get('distribution_type'),
+                               'description': payload.get('description', ''),
+                               'attrs': payload.get('attrs') or {},
+                               'dependencies': payload.get('dependencies') or {},
+                               'channels': set(payload.get('channels') or ['main']),
+                               'upload_time': time.time()}
+            return self._public_file(key)
+
+    def list_channels(self, request):
+        with self._lock:
+            owner = request['args']['owner']
+            channels = {}
+            for key, info in self.files.items():
+                if key[0] == owner:
+                    for channel in info['channels']:
+                        channels.setdefault(channel, {'num_files': 0})['num_files'] += 1
+            return channels
+
+    def _channel_files(self, owner, channel):
+        return [key for key, info in self.files.items()
+                if key[0] == owner and channel in info['channels']]
+
+    def show_channel(self, request):
+        with self._lock:
+            args = request['args']
+            files = self._channel_files(args['owner'], args['channel'])
+            result = {'total': len(files)}
+            if self.paginate and 'page' in request['query']:
+                page = int(request['query']['page'])
+                per_page = int(request['query'].get('per_page', 100))
+                files = files[(page - 1) * per_page:page * per_page]
+                result.update(page=page, per_page=per_page)
+            result['files'] = [self._public_file(key) for key in files]
+            return result
+
+    def _matching_files(self, request):
+        payload = self._json(request)
+        return [key for key in self.files
+                if key[0] == request['args']['owner'] and
+                payload.get('package') in (None, key[1]) and
+                payload.get('version') in (None, key[2]) and
+                payload.get('basename') in (None, key[3])]
+
+    def add_channel(self, request):
+        with self._lock:
+            for key in self._matching_files(request):
+                self.files[key]['channels'].add(request['args']['channel'])
+            return 201, {}
+
+    def remove_channel(self, request):
+        with self._lock:
+            for key in self._matching_files(request):
+                self.files[key]['channels'].discard(request['args']['channel'])
+            return 201, {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake anaconda.org API server.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--login', default='fake-user')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='The latency (in seconds) added to every request.')
+    parser.add_argument('--bandwidth', type=float,
+                        help='The bandwidth (in bytes per second) of request and response bodies.')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='The probability of a request failing with --error-status.')
+    parser.add_argument('--error-status', type=int, default=503)
+    args = parser.parse_args()
+    server = FakeBinstar(login=args.login, latency=args.latency, bandwidth=args.bandwidth,
+                         error_rate=args.error_rate, error_status=args.error_status,
+                         port=args.port).start()
+    print('Serving a fake anaconda.org API on {}'.format(server.url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Fakes of the conda and conda-build objects shared by the unit tests.
+
+"""
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+
+
+def make_distribution(directory, name, version='1.0', build='0'):
+    """Create a minimal conda distribution, returning its filename."""
+    fname = os.path.join(directory,
+                         '{}-{}-{}.tar.bz2'.format(name, version, build))
+    index = json.dumps({'name': name, 'version': version, 'build': build,
+                        'build_number': 0, 'depends': []}).encode('utf-8')
+    with tarfile.open(fname, 'w:bz2') as tar:
+        info = tarfile.TarInfo('info/index.json')
+        info.size = len(index)
+        tar.addfile(info, io.BytesIO(index))
+    return fname
+
+
+class DummyMeta(object):
+    """
+    A stand-in for a (baked) conda-build MetaData, with the given build
+    requirements and special versions.
+    Its recipe path is ``recipes/<name>``.
+
+    """
+    def __init__(self, name, version='1', build_string='0', requirements=(),
+                 special_versions=()):
+        self.path = os.path.join('recipes', name)
+        self._name = name
+        self._version = version
+        self.build_string = build_string
+        self.requirements = list(requirements)
+        self.special_versions = special_versions
+
+    def name(self):
+        return self._name
+
+    def version(self):
+        return self._version
+
+    def dist(self):
+        return '{}-{}-{}'.format(self._name, self._version, self.build_string)
+
+    def get_value(self, key, default=None):
+        if key == 'requirements/build':
+            return self.requirements
+        return default
+
+
+def put_distribution(server, owner, meta, channels=(), attrs=None, data=None):
+    """
+    Put the distribution of the meta (with the given attrs and content)
+    straight onto the :class:`~obvci.tests.fake_binstar.FakeBinstar` server.
+
+    """
+    from obvci.conda_tools.inspect_binstar import distribution_fname
+
+    key = (owner, meta.name(), meta.version(), distribution_fname(meta))
+    server.packages.setdefault(key[:2], {'owner': owner, 'name': meta.name()})
+    server.releases.setdefault(key[:3], {'version': meta.version(), 'description': ''})
+    if data is None:
+        data = json.dumps(key).encode('utf-8')
+    server.files[key] = {'data': data, 'md5': hashlib.md5(data).hexdigest(),
+                         'size': len(data), 'distribution_type': 'conda',
+                         'description': '', 'attrs': dict(attrs or {}), 'dependencies': {},
+                         'channels': set(channels), 'upload_time': 0}
+    return key
+
+
+def fake_run_test(recipe_dir, special_versions, test_root, channel_urls=()):
+    """
+    A stand-in for :func:`obvci.conda_tools.pipelined_tests.run_test`, whose
+    outcome is given by the name of the recipe (``slow*`` recipes take
+    0.2s and ``fail*`` recipes fail). The test is timed as that of the
+    recipe's DummyMeta.
+
+    """
+    from obvci.conda_tools.timing import timed
+
+    name = os.path.basename(recipe_dir)
+    os.makedirs(test_root)
+    with timed('test', DummyMeta(name).dist()):
+        if name.startswith('slow'):
+            time.sleep(0.2)
+    if name.startswith('fail'):
+        return False, 'Failed'
+    return True, ''
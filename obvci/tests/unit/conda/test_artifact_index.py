@@ -0,0 +1,61 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from obvci.conda_tools.artifact_index import LocalArtifactIndex
+from obvci.tests.unit.conda.dummy_index import DummyPackage
+from obvci.tests.fakes import make_distribution
+
+
+class Test_LocalArtifactIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_artifacts_')
+        self.build_root = os.path.join(self.tmpdir, 'croot')
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        os.makedirs(os.path.join(self.build_root, 'linux-64'))
+        self.index = LocalArtifactIndex([self.build_root],
+                                        cache_directory=self.cache_dir,
+                                        subdir='linux-64')
+        self.meta = DummyPackage('foo')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key(self):
+        self.assertEqual(self.index.key(self.meta), 'linux-64/foo-0.0-0.tar.bz2')
+
+    def test_not_found(self):
+        self.assertIsNone(self.index.find(self.meta))
+
+    def test_add_and_find(self):
+        fname = make_distribution(self.tmpdir, 'foo', version='0.0')
+        target = self.index.add(fname)
+        self.assertEqual(target, os.path.join(self.cache_dir, 'linux-64',
+                                              'foo-0.0-0.tar.bz2'))
+        self.assertEqual(self.index.find(self.meta), target)
+
+    def test_unrecorded_artifact_ignored(self):
+        make_distribution(os.path.join(self.build_root, 'linux-64'), 'foo',
+                          version='0.0')
+        self.assertIsNone(self.index.find(self.meta))
+
+    def test_conda_build_index_checksum(self):
+        index = LocalArtifactIndex([self.build_root], subdir='linux-64')
+        subdir_path = os.path.join(self.build_root, 'linux-64')
+        make_distribution(subdir_path, 'foo', version='0.0')
+        with open(os.path.join(subdir_path, '.index.json'), 'w') as fh:
+            json.dump({'foo-0.0-0.tar.bz2': {'md5': 'not-the-md5'}}, fh)
+        self.assertIsNone(index.find(self.meta))
+
+    def test_corrupt_artifact(self):
+        target = self.index.add(make_distribution(self.tmpdir, 'foo',
+                                                  version='0.0'))
+        with open(target, 'ab') as fh:
+            fh.write(b'corruption')
+        self.assertIsNone(self.index.find(self.meta))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from obvci.conda_tools import batch_upload, build
+from obvci.conda_tools.binstar_gateway import BinstarGateway, TokenBucket
+from obvci.conda_tools.streaming_upload import stream_upload
+from obvci.conda_tools.timing import clock
+from obvci.tests.fake_binstar import FakeBinstar
+from obvci.tests.fakes import DummyMeta
+
+
+class DummyUploader(batch_upload.BatchUploader):
+    """Uploads the distribution of a DummyMeta from (the file at) its path."""
+    @staticmethod
+    def artifact_path(meta):
+        return meta.path
+
+
+class MatrixMeta(object):
+    """
+    A MetaData shared by the cases of a version matrix, whose dist depends on
+    the (global) Python version set up for the case, as with conda-build.
+
+    """
+    conda_py = None
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def dist(self):
+        return 'foo-1-py{}_0'.format(MatrixMeta.conda_py)
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.dist() + '.tar.bz2')
+
+
+class MatrixCase(object):
+    """
+    A case of the version matrix of the shared meta, which (like a
+    BakedDistribution) sets its Python version up whenever it is used.
+
+    """
+    def __init__(self, meta, conda_py, used_by):
+        self.meta = meta
+        self.conda_py = conda_py
+        self.used_by = used_by
+
+    def __getattr__(self, name):
+        self.used_by.add(threading.current_thread().name)
+        MatrixMeta.conda_py = self.conda_py
+        return getattr(self.meta, name)
+
+
+class Test_BatchUploader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_batch_upload_')
+        self.uploaded = []
+        self.active = []
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.original_upload_file = build.upload_file
+        build.upload_file = self.upload_file
+
+    def tearDown(self):
+        build.upload_file = self.original_upload_file
+        shutil.rmtree(self.tmpdir)
+
+    def upload_file(self, cli, fname, owner, channels, throttle=None, build_key=None):
+        with self.lock:
+            self.active.append(fname)
+            self.max_active = max(self.max_active, len(self.active))
+        time.sleep(0.02)
+        with self.lock:
+            self.active.remove(fname)
+            self.uploaded.append((os.path.basename(fname), owner, channels))
+        if os.path.basename(fname).startswith('fail'):
+            raise ValueError('Failed')
+
+    def meta(self, name, size=0):
+        """A DummyMeta whose path is a distribution file of the given size."""
+        meta = DummyMeta(name)
+        meta.path = os.path.join(self.tmpdir, meta.dist() + '.tar.bz2')
+        with open(meta.path, 'wb') as fh:
+            fh.write(b'0' * size)
+        return meta
+
+    def test_smallest_first(self):
+        uploader = DummyUploader(None, 'owner', workers=1)
+        for name, size in [('a', 300), ('b', 100), ('c', 200)]:
+            uploader.add(self.meta(name, size=size), ['main'])
+        self.assertEqual(uploader.upload(), [])
+        self.assertEqual(self.uploaded, [('b-1-0.tar.bz2', 'owner', ['main']),
+                                         ('c-1-0.tar.bz2', 'owner', ['main']),
+                                         ('a-1-0.tar.bz2', 'owner', ['main'])])
+        self.assertEqual(len(uploader), 0)
+
+    def test_workers(self):
+        uploader = DummyUploader(None, 'owner', workers=3)
+        for i in range(10):
+            uploader.add(self.meta(str(i), size=i), ['main'])
+        uploader.upload()
+        self.assertEqual(len(self.uploaded), 10)
+        self.assertEqual(self.max_active, 3)
+
+    def test_failures(self):
+        uploader = DummyUploader(None, 'owner', workers=2)
+        uploader.add(self.meta('a'), ['main'])
+        uploader.add(self.meta('fail_b'), ['main'])
+        self.assertEqual(uploader.upload(), ['fail_b-1-0'])
+        self.assertEqual(len(self.uploaded), 2)
+
+    def test_empty(self):
+        self.assertEqual(DummyUploader(None, 'owner').upload(), [])
+
+    def test_matrix_cases(self):
+        # Two cases of a version matrix, which share a MetaData.
+        meta = MatrixMeta(self.tmpdir)
+        used_by = set()
+        uploader = DummyUploader(None, 'owner', workers=2)
+        for conda_py in [27, 35]:
+            case = MatrixCase(meta, conda_py, used_by)
+            with open(case.path, 'wb') as fh:
+                fh.write(b'0')
+            uploader.add(case, ['main'])
+        self.assertEqual(uploader.upload(), [])
+        self.assertEqual(sorted(fname for fname, _, _ in self.uploaded),
+                         ['foo-1-py27_0.tar.bz2', 'foo-1-py35_0.tar.bz2'])
+        # The cases were only used when queued, not by the upload threads.
+        self.assertEqual(used_by, {threading.current_thread().name})
+
+    def test_bandwidth(self):
+        uploader = DummyUploader(None, 'owner', bandwidth=1000)
+        self.assertEqual(uploader.throttle.rate, 1000)
+        self.assertIsNone(DummyUploader(None, 'owner').throttle)
+
+
+class Test_shared_throttle(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test_batch_upload_')
+        self.server = FakeBinstar(login='owner').start()
+        self.cli = BinstarGateway(self.server.client())
+        self.cli.add_package('owner', 'foo', 'A summary', 'BSD', public=True)
+        self.cli.add_release('owner', 'foo', '0.1', requirements=[], announce=None,
+                             description='')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        throttle = TokenBucket(400000, capacity=2 ** 16)
+        threads = []
+        start = clock()
+        for i in range(2):
+            fname = os.path.join(self.tmpdir, 'foo-0.1-{}.tar.bz2'.format(i))
+            with open(fname, 'wb') as fh:
+                fh.write(os.urandom(100000))
+            args = (self.cli, 'owner', 'foo', '0.1', 'linux-64/' + os.path.basename(fname),
+                    fname, 'conda')
+            threads.append(threading.Thread(target=stream_upload, args=args,
+                                            kwargs={'throttle': throttle}))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 200000 bytes at 400000 bytes per second (after a burst of 65536).
+        self.assertGreaterEqual(clock() - start, 0.3)
+        self.assertEqual(len(self.server.files), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
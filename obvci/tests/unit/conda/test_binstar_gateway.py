@@ -0,0 +1,159 @@
+import io
+import sys
+import unittest
+
+from obvci.conda_tools.binstar_gateway import (BinstarGateway, TokenBucket, gateway,
+                                               percentile)
+from obvci.conda_tools.timing import clock
+from obvci.tests.fake_binstar import FakeBinstar
+
+
+OWNER = 'owner'
+
+
+class Test_TokenBucket(unittest.TestCase):
+    def test_unlimited(self):
+        bucket = TokenBucket()
+        for _ in range(100):
+            self.assertEqual(bucket.acquire(), 0)
+
+    def test_rate(self):
+        bucket = TokenBucket(rate=50, capacity=2)
+        start = clock()
+        for _ in range(7):
+            bucket.acquire()
+        # Two in a burst, then five at 50 per second.
+        self.assertGreaterEqual(clock() - start, 0.09)
+
+    def test_tokens(self):
+        bucket = TokenBucket(rate=1000, capacity=100)
+        self.assertEqual(bucket.acquire(500), 0)
+        # The bucket is now 400 tokens in debt.
+        self.assertGreater(bucket.acquire(100), 0.4)
+
+    def test_pause(self):
+        bucket = TokenBucket()
+        bucket.pause(0.05)
+        self.assertGreater(bucket.acquire(), 0.04)
+
+
+class Test_percentile(unittest.TestCase):
+    def test(self):
+        values = list(range(101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile(values, 1), 100)
+        self.assertIsNone(percentile([], 0.5))
+
+
+class Test_BinstarGateway(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeBinstar(login=OWNER).start()
+        self.cli = BinstarGateway(self.server.client(), backoff=0.01)
+        self.cli.add_package(OWNER, 'foo', 'A summary', 'BSD', public=True)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_counts(self):
+        self.cli.reset()
+        self.cli.package(OWNER, 'foo')
+        self.cli.package(OWNER, 'foo')
+        report = self.cli.report()
+        self.assertEqual(list(report), ['package'])
+        self.assertEqual(report['package']['calls'], 2)
+        self.assertEqual(report['package']['requests'], 2)
+        self.assertGreater(report['package']['bytes_received'], 0)
+        self.assertIsNotNone(report['package']['p99'])
+
+    def test_attributes(self):
+        self.assertEqual(self.cli.domain, self.server.url)
+
+    def test_retry(self):
+        self.server.inject_errors(2, status=503, path='/package/')
+        self.assertEqual(self.cli.package(OWNER, 'foo')['name'], 'foo')
+        stats = self.cli.report()['package']
+        self.assertEqual((stats['calls'], stats['retries'], stats['errors']), (1, 2, 0))
+
+    def test_retry_after(self):
+        self.server.retry_after = 0.1
+        self.server.inject_errors(1, status=429, path='/package/')
+        start = clock()
+        self.cli.package(OWNER, 'foo')
+        self.assertGreaterEqual(clock() - start, 0.1)
+
+    def test_gives_up(self):
+        import binstar_client
+
+        self.cli.max_retries = 1
+        self.server.inject_errors(2, status=500, path='/package/')
+        with self.assertRaises(binstar_client.errors.ServerError):
+            self.cli.package(OWNER, 'foo')
+        self.assertEqual(self.cli.report()['package']['errors'], 1)
+
+    def test_not_retried(self):
+        import binstar_client
+
+        with self.assertRaises(binstar_client.NotFound):
+            self.cli.package(OWNER, 'bar')
+        stats = self.cli.report()['package']
+        self.assertEqual((stats['retries'], stats['errors']), (0, 1))
+
+    def test_non_idempotent_retried(self):
+        # The request was turned away, so wasn't applied.
+        self.server.inject_errors(1, status=503, path='/package/')
+        self.cli.add_package(OWNER, 'bar', 'A summary', 'BSD', public=True)
+        self.assertEqual(self.cli.report()['add_package']['retries'], 1)
+
+    def test_non_idempotent_not_retried(self):
+        import binstar_client
+
+        # The package may have been added, so adding it again could conflict.
+        self.server.inject_errors(1, status=502, path='/package/')
+        with self.assertRaises(binstar_client.errors.BinstarError):
+            self.cli.add_package(OWNER, 'bar', 'A summary', 'BSD', public=True)
+        stats = self.cli.report()['add_package']
+        self.assertEqual((stats['retries'], stats['errors']), (0, 1))
+
+    def test_file_rewound(self):
+        calls = []
+
+        def read(fh):
+            calls.append(fh.read())
+            if len(calls) == 1:
+                import binstar_client
+                raise binstar_client.errors.ServerError('Failed', 502)
+            return calls[-1]
+
+        fh = io.BytesIO(b'content')
+        self.assertEqual(self.cli.call('read', read, fh), b'content')
+        self.assertEqual(calls, [b'content', b'content'])
+        self.assertEqual(self.cli.report()['read']['bytes_sent'], 14)
+
+    def test_write_report(self):
+        self.cli.package(OWNER, 'foo')
+        stream = io.StringIO()
+        self.cli.write_report(stream)
+        self.assertIn('package', stream.getvalue())
+
+    def test_write_report_stderr(self):
+        self.cli.package(OWNER, 'foo')
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+        try:
+            self.cli.write_report()
+            written = sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        self.assertEqual(written[0], '')
+        self.assertIn('package', written[1])
+
+    def test_gateway(self):
+        self.assertIs(gateway(self.cli), self.cli)
+        cli = self.server.client()
+        self.assertIs(gateway(cli), gateway(cli))
+        self.assertIs(gateway(cli).cli, cli)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from obvci.conda_tools.binstar_gateway import BinstarGateway
+from obvci.conda_tools.build_cache import (BUILD_KEY_ATTR, BuildCache,
+                                           resolved_build_dependencies, tree_hash)
+from obvci.conda_tools.build_directory import Builder
+from obvci.conda_tools.channel_promotion import ChannelListingCache
+from obvci.tests.fake_binstar import FakeBinstar
+from obvci.tests.fakes import DummyMeta, make_distribution, put_distribution
+
+
+class Test_tree_hash(unittest.TestCase):
+    def setUp(self):
+        self.recipe_dir = tempfile.mkdtemp(prefix='tmp_obvci_recipe_')
+        self.write('meta.yaml', 'package:\n    name: foo\n')
+        self.write('build.sh', 'python setup.py install\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.recipe_dir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.recipe_dir, name), 'w') as fh:
+            fh.write(content)
+
+    def test_stable(self):
+        self.assertEqual(tree_hash(self.recipe_dir), tree_hash(self.recipe_dir))
+
+    def test_build_script_change(self):
+        orig = tree_hash(self.recipe_dir)
+        self.write('build.sh', 'python setup.py install --old-and-unmanageable\n')
+        self.assertNotEqual(tree_hash(self.recipe_dir), orig)
+
+    def test_new_file(self):
+        orig = tree_hash(self.recipe_dir)
+        os.mkdir(os.path.join(self.recipe_dir, 'patches'))
+        self.assertNotEqual(tree_hash(self.recipe_dir), orig)
+
+
+class Spec(object):
+    def __init__(self, spec):
+        self.spec = spec
+
+
+class RecipeMeta(DummyMeta):
+    def ms_depends(self, typ):
+        return [Spec(spec) for spec in self.requirements]
+
+
+class Test_resolved_build_dependencies(unittest.TestCase):
+    def test_matrix_case(self):
+        # The numpy 1.8 and 1.9 cases of an upstream recipe built in this run.
+        upstream_keys = {'foo-1-np18_0': 'np18_key', 'foo-1-np19_0': 'np19_key'}
+        upstream_cases = {'foo-1-np18_0': (('numpy', '1.8'),),
+                          'foo-1-np19_0': (('numpy', '1.9'),)}
+        meta = RecipeMeta('bar', requirements=['foo'],
+                          special_versions=(('numpy', '1.8'),))
+        self.assertEqual(resolved_build_dependencies(meta, {}, upstream_keys,
+                                                     upstream_cases=upstream_cases),
+                         ['np18_key'])
+
+    def test_no_case(self):
+        upstream_keys = {'foo-1-np18_0': 'np18_key', 'foo-1-np19_0': 'np19_key'}
+        meta = RecipeMeta('bar', requirements=['foo'])
+        self.assertEqual(resolved_build_dependencies(meta, {}, upstream_keys),
+                         ['np18_key', 'np19_key'])
+
+
+class Test_BuildCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_build_cache_')
+        self.cache = BuildCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get('abcdef'))
+
+    def test_hit(self):
+        fname = make_distribution(self.tmpdir, 'foo')
+        target = self.cache.put('abcdef', fname)
+        self.assertEqual(self.cache.get('abcdef'), target)
+        self.assertEqual(os.path.basename(target), 'foo-1.0-0.tar.bz2')
+
+    def test_corrupt(self):
+        target = self.cache.put('abcdef', make_distribution(self.tmpdir, 'foo'))
+        with open(target, 'ab') as fh:
+            fh.write(b'corruption')
+        self.assertIsNone(self.cache.get('abcdef'))
+
+
+class DummyUploader(object):
+    def __init__(self):
+        self.queued = []
+
+    def add(self, meta, channels, build_key=None):
+        self.queued.append((meta.dist(), channels, build_key))
+
+
+class Test_Builder_exists_remotely(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_build_cache_')
+        self.server = FakeBinstar(login='owner').start()
+        # Avoid connecting to binstar by not calling __init__.
+        self.builder = Builder.__new__(Builder)
+        self.builder.binstar_cli = BinstarGateway(self.server.client())
+        self.builder.upload_owner = 'owner'
+        self.builder.artifact_index = None
+        # A cold cache.
+        self.builder.build_cache = BuildCache(os.path.join(self.tmpdir, 'cache'))
+        self.meta = DummyMeta('foo')
+        self.builder.build_cache_keys = {self.meta.dist(): 'abcdef'}
+        self.builder.trust_unkeyed_distributions = False
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def existing(self):
+        return self.builder.calculate_existing_distributions([self.meta])
+
+    def test_not_on_binstar(self):
+        self.assertEqual(self.existing(), [])
+
+    def test_same_key(self):
+        put_distribution(self.server, 'owner', self.meta, attrs={BUILD_KEY_ATTR: 'abcdef'})
+        self.assertEqual(self.existing(), [self.meta])
+
+    def test_no_key(self):
+        # Uploaded before the build cache was used, so may be out of date.
+        put_distribution(self.server, 'owner', self.meta)
+        self.assertEqual(self.existing(), [])
+
+    def test_no_key_trusted(self):
+        self.builder.trust_unkeyed_distributions = True
+        put_distribution(self.server, 'owner', self.meta)
+        self.assertEqual(self.existing(), [self.meta])
+
+    def test_changed(self):
+        put_distribution(self.server, 'owner', self.meta, attrs={BUILD_KEY_ATTR: '123456'})
+        self.assertEqual(self.existing(), [])
+
+    def test_cache_hit(self):
+        key = self.builder.build_cache_keys[self.meta.dist()]
+        self.builder.build_cache.put(key, make_distribution(self.tmpdir, 'foo'))
+        self.assertEqual(self.existing(), [self.meta])
+        self.assertEqual(self.server.requests, [])
+
+    def test_replaced_on_channel(self):
+        # Rebuilt because its key changed, so it replaces the one on the channel.
+        put_distribution(self.server, 'owner', self.meta, channels=['main'],
+                         attrs={BUILD_KEY_ATTR: '123456'})
+        self.builder.can_upload = True
+        self.builder.upload_channel = 'main'
+        self.builder.channel_listings = ChannelListingCache(self.builder.binstar_cli)
+        self.builder.local_artifacts = {}
+        self.builder.uploader = DummyUploader()
+        self.builder.post_build(self.meta, build_occured=True)
+        self.assertEqual(self.builder.uploader.queued, [('foo-1-0', ['main'], 'abcdef')])
+
+    def test_plan_records(self):
+        # The keys (e.g. of a fresh planner daemon) are computed for the plan.
+        self.builder.build_cache_keys = {}
+        self.builder.compute_build_cache_keys = lambda distributions, index: {
+            meta.dist(): 'abcdef' for meta in distributions}
+        self.builder.local_artifacts = {}
+        self.builder.can_upload = False
+        put_distribution(self.server, 'owner', self.meta, attrs={BUILD_KEY_ATTR: 'abcdef'})
+        records = list(self.builder.plan_records([self.meta], {}))
+        self.assertEqual([record['will_build'] for record in records], [False])
+
+
+if __name__ == '__main__':
+    unittest.main()
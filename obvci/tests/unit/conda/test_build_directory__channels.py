@@ -13,6 +13,8 @@ from obvci.conda_tools.inspect_binstar import distribution_exists_on_channel, ad
 from binstar_client.utils import get_binstar
 from argparse import Namespace
 
+from obvci.tests.fake_binstar import FakeBinstar
+
 
 def clear_binstar(cli, owner):
     """
@@ -22,19 +24,30 @@ def clear_binstar(cli, owner):
 
     """
     for channel in cli.list_channels(owner):
-        cli.remove_channel(owner, channel)
+        cli.remove_channel(channel, owner)
 
     for package in cli.user_packages(owner):
         cli.remove_package(owner, package['name'])
 
 
 OWNER = 'Obvious-ci-tests'
-CLIENT = get_binstar(Namespace(token=os.environ['BINSTAR_TOKEN'], site=None))
+if 'BINSTAR_TOKEN' in os.environ:
+    SERVER = None
+    CLIENT = get_binstar(Namespace(token=os.environ['BINSTAR_TOKEN'], site=None))
+else:
+    # Without a token, run against a local fake of anaconda.org.
+    SERVER = FakeBinstar(login=OWNER).start()
+    CLIENT = SERVER.client()
 RECIPES_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'recipes')
 RECIPES_DIR = os.path.join(RECIPES_ROOT, 'recipes_directory')
 RECIPE_DEV = os.path.join(RECIPES_ROOT, 'recipe1_dev')
 
 
+def teardown_module():
+    if SERVER is not None:
+        SERVER.stop()
+
+
 def test_distribution_exists():
     clear_binstar(CLIENT, OWNER)
 
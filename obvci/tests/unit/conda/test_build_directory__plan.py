@@ -0,0 +1,64 @@
+import json
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from obvci.conda_tools.build_directory import (Builder, compatible_cases,
+                                               dependency_edges)
+from obvci.tests.fakes import DummyMeta
+
+
+class Test_dependency_edges(unittest.TestCase):
+    def setUp(self):
+        self.upstream = [('a', (('python', '2.7'),), 'a-1-py27_0'),
+                         ('a', (('python', '3.4'),), 'a-1-py34_0'),
+                         ('b', (), 'b-1-0')]
+
+    def test_compatible_cases(self):
+        self.assertTrue(compatible_cases((('python', '2.7'),), ()))
+        self.assertTrue(compatible_cases((('python', '2.7'),),
+                                         (('python', '2.7'), ('numpy', '1.9'))))
+        self.assertFalse(compatible_cases((('python', '2.7'),), (('python', '3.4'),)))
+
+    def test_matching_case(self):
+        meta = DummyMeta('c', requirements=['a', 'b'],
+                         special_versions=(('python', '3.4'),))
+        self.assertEqual(dependency_edges(meta, self.upstream),
+                         ['a-1-py34_0', 'b-1-0'])
+
+    def test_no_dependencies(self):
+        self.assertEqual(dependency_edges(DummyMeta('c', requirements=['python']), self.upstream), [])
+
+
+class Test_Builder_write_plan(unittest.TestCase):
+    def setUp(self):
+        # Avoid connecting to binstar by not calling __init__.
+        self.builder = Builder.__new__(Builder)
+        self.builder.build_cache = None
+        self.builder.profiler = None
+        self.records = [{'dist': 'a-1-0'}, {'dist': 'b-1-0'}]
+        self.builder.plan_records = lambda distributions, index: iter(self.records)
+
+    def write_plan(self, plan_format):
+        self.builder.plan_format = plan_format
+        stream = StringIO()
+        self.builder.write_plan([], {}, stream)
+        return stream.getvalue()
+
+    def test_json(self):
+        self.assertEqual(json.loads(self.write_plan('json')), self.records)
+
+    def test_jsonl(self):
+        lines = self.write_plan('jsonl').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.records)
+
+    def test_json_empty(self):
+        self.records = []
+        self.assertEqual(json.loads(self.write_plan('json')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
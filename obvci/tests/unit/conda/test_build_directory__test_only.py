@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import conda_build.config
+
+from obvci.conda_tools import pipelined_tests
+from obvci.conda_tools.binstar_gateway import BinstarGateway
+from obvci.conda_tools.build_directory import Builder
+from obvci.conda_tools.inspect_binstar import ChecksumError, download_distribution
+from obvci.conda_tools.pipelined_tests import isolated_test_root
+from obvci.tests.fake_binstar import FakeBinstar
+from obvci.tests.fakes import DummyMeta, fake_run_test, make_distribution, put_distribution
+
+
+OWNER = 'owner'
+
+
+class TestOnlyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_test_only_')
+        self.isolated = isolated_test_root(os.path.join(self.tmpdir, 'croot'))
+        self.isolated.__enter__()
+        self.bldpkgs_dir = conda_build.config.config.bldpkgs_dir
+        self.server = FakeBinstar(login=OWNER).start()
+        self.cli = BinstarGateway(self.server.client())
+
+        # Avoid connecting to binstar by not calling __init__.
+        self.builder = Builder.__new__(Builder)
+        self.builder.binstar_cli = self.cli
+        self.builder.upload_owner = OWNER
+        self.builder.local_channel = None
+        self.builder.artifact_index = None
+        self.builder.build_cache = None
+        self.builder.local_artifacts = {}
+        self.builder.failed_tests = []
+        self.builder.test_workers = 2
+
+    def tearDown(self):
+        self.server.stop()
+        self.isolated.__exit__(None, None, None)
+        shutil.rmtree(self.tmpdir)
+
+    def put_distribution(self, meta):
+        """Put a (real) distribution of the meta on the fake binstar server."""
+        fname = make_distribution(self.tmpdir, meta.name(), meta.version())
+        with open(fname, 'rb') as fh:
+            data = fh.read()
+        return put_distribution(self.server, OWNER, meta, data=data), data
+
+
+class Test_download_distribution(TestOnlyTest):
+    def test_verified(self):
+        meta = DummyMeta('foo')
+        _, data = self.put_distribution(meta)
+        target = os.path.join(self.tmpdir, 'download.tar.bz2')
+        self.assertTrue(download_distribution(self.cli, OWNER, meta, target))
+        with open(target, 'rb') as fh:
+            self.assertEqual(fh.read(), data)
+
+    def test_missing(self):
+        target = os.path.join(self.tmpdir, 'download.tar.bz2')
+        self.assertFalse(download_distribution(self.cli, OWNER, DummyMeta('foo'), target))
+        self.assertFalse(os.path.exists(target))
+
+    def test_corrupt(self):
+        meta = DummyMeta('foo')
+        key, data = self.put_distribution(meta)
+        self.server.files[key]['data'] = data[:-1]
+        target = os.path.join(self.tmpdir, 'download.tar.bz2')
+        with self.assertRaises(ChecksumError):
+            download_distribution(self.cli, OWNER, meta, target)
+        # Neither the (corrupt) target nor the partial download is left behind.
+        self.assertEqual([fname for fname in os.listdir(self.tmpdir)
+                          if fname.startswith('download')], [])
+
+
+class Test_Builder_locate_artifact(TestOnlyTest):
+    def test_in_build_root(self):
+        os.makedirs(self.bldpkgs_dir)
+        fname = make_distribution(self.bldpkgs_dir, 'foo', version='1')
+        self.assertEqual(self.builder.locate_artifact(DummyMeta('foo')), fname)
+        self.assertEqual(self.server.requests, [])
+
+    def test_downloaded(self):
+        meta = DummyMeta('foo')
+        self.put_distribution(meta)
+        fname = self.builder.locate_artifact(meta)
+        self.assertEqual(fname, os.path.join(self.bldpkgs_dir, 'foo-1-0.tar.bz2'))
+        self.assertTrue(os.path.exists(fname))
+
+    def test_not_found(self):
+        self.assertIsNone(self.builder.locate_artifact(DummyMeta('foo')))
+
+
+class Test_Builder_test_existing(TestOnlyTest):
+    def setUp(self):
+        super(Test_Builder_test_existing, self).setUp()
+        self.orig_run_test = pipelined_tests.run_test
+        pipelined_tests.run_test = fake_run_test
+
+    def tearDown(self):
+        pipelined_tests.run_test = self.orig_run_test
+        super(Test_Builder_test_existing, self).tearDown()
+
+    def test(self):
+        passing, failing, corrupt = DummyMeta('a'), DummyMeta('fail_b'), DummyMeta('c')
+        for meta in [passing, failing, corrupt]:
+            key, data = self.put_distribution(meta)
+        self.server.files[key]['md5'] = 'not-the-md5'
+        self.builder.test_existing([passing, failing, corrupt, DummyMeta('missing')])
+        self.assertEqual(sorted(self.builder.failed_tests),
+                         ['c-1-0', 'fail_b-1-0', 'missing-1-0'])
+        # Nothing was uploaded (or otherwise changed) on binstar.
+        self.assertEqual([method for method, _, _, _, _ in self.server.requests
+                          if method != 'GET'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
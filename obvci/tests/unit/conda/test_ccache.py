@@ -0,0 +1,40 @@
+import unittest
+
+from obvci.conda_tools.ccache import CompilerCache, parse_stats
+
+
+class Test_parse_stats(unittest.TestCase):
+    def test_print_stats(self):
+        output = ('stats_updated_timestamp\t1445000000\n'
+                  'direct_cache_hit\t12\n'
+                  'preprocessed_cache_hit\t3\n'
+                  'cache_miss\t40\n')
+        self.assertEqual(parse_stats(output),
+                         {'direct_cache_hit': 12, 'preprocessed_cache_hit': 3,
+                          'cache_miss': 40})
+
+    def test_human_readable(self):
+        output = ('cache directory                     /home/travis/.ccache\n'
+                  'cache hit (direct)                    12\n'
+                  'cache hit (preprocessed)               3\n'
+                  'cache miss                            40\n'
+                  'files in cache                       120\n')
+        self.assertEqual(parse_stats(output),
+                         {'direct_cache_hit': 12, 'preprocessed_cache_hit': 3,
+                          'cache_miss': 40})
+
+
+class Test_CompilerCache_summary(unittest.TestCase):
+    def test_summary(self):
+        cache = CompilerCache('/tmp/ccache', ccache='/usr/bin/ccache')
+        cache.stats['foo-1.0-np19py27_0'] = {'direct_cache_hit': 2,
+                                             'preprocessed_cache_hit': 1,
+                                             'cache_miss': 1}
+        cache.stats['bar-1.0-0'] = dict.fromkeys(cache.stats['foo-1.0-np19py27_0'], 0)
+        self.assertEqual(cache.summary(),
+                         ['bar-1.0-0: 0 of 0 compilations cached (n/a)',
+                          'foo-1.0-np19py27_0: 3 of 4 compilations cached (75.0%)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
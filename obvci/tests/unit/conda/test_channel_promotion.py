@@ -0,0 +1,193 @@
+import json
+import unittest
+
+from obvci.conda_tools.binstar_gateway import BinstarGateway
+from obvci.conda_tools.channel_promotion import ChannelListingCache, PromotionBatch
+from obvci.conda_tools.inspect_binstar import (BasenameSet, add_distribution_to_channel,
+                                               channel_contains, distribution_exists_on_channel,
+                                               distribution_fname, iter_channel_basenames,
+                                               iter_json_basenames)
+from obvci.tests.fake_binstar import FakeBinstar
+from obvci.tests.fakes import DummyMeta, put_distribution
+
+
+OWNER = 'owner'
+
+
+class PromotionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeBinstar(login=OWNER).start()
+        self.cli = BinstarGateway(self.server.client())
+        self.listings = ChannelListingCache(self.cli)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def assertNotLeaky(self, promote):
+        """
+        Check that promoting one build of foo 0.1 (with promote, a callable
+        of the meta) leaves the others (e.g. a dev build) alone.
+
+        """
+        released, sibling = DummyMeta('foo', '0.1', 'np18_0'), DummyMeta('foo', '0.1', 'np19_0')
+        for meta in [released, sibling]:
+            put_distribution(self.server, OWNER, meta, ['dev'])
+        promote(released)
+        self.assertTrue(self.listings.contains(OWNER, 'main', released))
+        self.assertFalse(self.listings.contains(OWNER, 'main', sibling))
+
+
+class Test_ChannelListingCache(PromotionTest):
+    def test_cached(self):
+        meta = DummyMeta('foo', '0.1')
+        put_distribution(self.server, OWNER, meta, ['main'])
+        self.assertTrue(self.listings.contains(OWNER, 'main', meta))
+        self.assertFalse(self.listings.contains(OWNER, 'dev', meta))
+        self.assertTrue(self.listings.contains(OWNER, 'main', meta))
+        self.assertEqual(self.server.request_count('GET', '/channels/'), 2)
+
+    def test_add(self):
+        meta = DummyMeta('foo', '0.1')
+        self.assertFalse(self.listings.contains(OWNER, 'main', meta))
+        self.listings.add(OWNER, 'main', meta)
+        self.assertTrue(self.listings.contains(OWNER, 'main', meta))
+
+    def test_invalidate(self):
+        meta = DummyMeta('foo', '0.1')
+        self.assertFalse(self.listings.contains(OWNER, 'main', meta))
+        put_distribution(self.server, OWNER, meta, ['main'])
+        self.assertFalse(self.listings.contains(OWNER, 'main', meta))
+        self.listings.invalidate(OWNER)
+        self.assertTrue(self.listings.contains(OWNER, 'main', meta))
+
+
+class Test_BasenameSet(unittest.TestCase):
+    def test(self):
+        basenames = BasenameSet(['linux-64/foo-0.1-0.tar.bz2', 'linux-64/foo-0.1-0.tar.bz2'])
+        basenames.add('linux-64/bar-1.0-0.tar.bz2')
+        self.assertEqual(len(basenames), 2)
+        self.assertIn('linux-64/foo-0.1-0.tar.bz2', basenames)
+        self.assertNotIn('linux-64/foo-0.1-1.tar.bz2', basenames)
+
+
+class Test_iter_json_basenames(unittest.TestCase):
+    def test_split_chunks(self):
+        content = json.dumps({'files': [{'basename': 'linux-64/f\u00f6o-{}.tar.bz2'.format(i),
+                                         'attrs': {'depends': ['"basename": "x"']}}
+                                        for i in range(20)]}).encode('utf-8')
+        chunks = [content[i:i + 7] for i in range(0, len(content), 7)]
+        self.assertEqual(list(iter_json_basenames(chunks)),
+                         ['linux-64/f\u00f6o-{}.tar.bz2'.format(i) for i in range(20)])
+
+    def test_other_basenames(self):
+        # Only the basenames of the files themselves, not those nested in
+        # them (or elsewhere in the listing).
+        content = json.dumps({'basename': 'channel',
+                              'files': [{'attrs': {'basename': 'nested'},
+                                         'size': 10, 'public': True,
+                                         'basename': 'linux-64/foo-0.1-0.tar.bz2',
+                                         'labels': [{'basename': 'label'}]}],
+                              'other': {'files': [{'basename': 'other'}]}}).encode('utf-8')
+        chunks = [content[i:i + 1] for i in range(len(content))]
+        self.assertEqual(list(iter_json_basenames(chunks)), ['linux-64/foo-0.1-0.tar.bz2'])
+
+
+class Test_channel_listing(PromotionTest):
+    def setUp(self):
+        super(Test_channel_listing, self).setUp()
+        self.metas = [DummyMeta('foo', '0.1', str(i)) for i in range(10)]
+        for meta in self.metas:
+            put_distribution(self.server, OWNER, meta, ['main'])
+        self.fnames = sorted(distribution_fname(meta) for meta in self.metas)
+
+    def test_pages(self):
+        self.assertEqual(sorted(iter_channel_basenames(self.cli, OWNER, 'main', per_page=3)),
+                         self.fnames)
+        # Three full pages, and a final one with a single distribution.
+        self.assertEqual(self.server.request_count('GET', '/channels/'), 4)
+
+    def test_full_last_page(self):
+        self.assertEqual(len(list(iter_channel_basenames(self.cli, OWNER, 'main', per_page=5))),
+                         10)
+        self.assertEqual(self.server.request_count('GET', '/channels/'), 3)
+
+    def test_unpaginated_server(self):
+        self.server.paginate = False
+        for per_page in [3, 10]:
+            self.assertEqual(sorted(iter_channel_basenames(self.cli, OWNER, 'main',
+                                                           per_page=per_page)),
+                             self.fnames)
+        self.assertEqual(self.server.request_count('GET', '/channels/'), 3)
+
+    def test_stops_early(self):
+        found = channel_contains(self.cli, OWNER, 'main', self.fnames[:2], per_page=2)
+        self.assertEqual(found, set(self.fnames[:2]))
+        self.assertEqual(self.server.request_count('GET', '/channels/'), 1)
+
+    def test_missing(self):
+        found = channel_contains(self.cli, OWNER, 'main', [self.fnames[0], 'linux-64/bar.tar.bz2'],
+                                 per_page=4)
+        self.assertEqual(found, set(self.fnames[:1]))
+        self.assertEqual(self.server.request_count('GET', '/channels/'), 3)
+
+    def test_distribution_exists_on_channel(self):
+        self.assertTrue(distribution_exists_on_channel(self.cli, OWNER, self.metas[0]))
+        self.assertFalse(distribution_exists_on_channel(self.cli, OWNER, self.metas[0],
+                                                        channel='dev'))
+
+    def test_cache(self):
+        listings = ChannelListingCache(self.cli, page_size=4)
+        self.assertEqual(len(listings.basenames(OWNER, 'main')), 10)
+        self.assertTrue(listings.contains(OWNER, 'main', self.metas[-1]))
+        self.assertEqual(self.server.request_count('GET', '/channels/'), 3)
+
+
+class Test_add_distribution_to_channel(PromotionTest):
+    def test_not_leaky(self):
+        self.assertNotLeaky(lambda meta: add_distribution_to_channel(self.cli, OWNER, meta,
+                                                                     channel='main'))
+
+
+class Test_PromotionBatch(PromotionTest):
+    def test_deduplicated(self):
+        metas = [DummyMeta('foo', '0.1', build_string)
+                 for build_string in ['np18py27_0', 'np19py27_0', 'np19py34_0']]
+        metas.append(DummyMeta('bar', '1.0'))
+        for meta in metas:
+            put_distribution(self.server, OWNER, meta, ['dev'])
+        batch = PromotionBatch(self.cli, workers=2)
+        for meta in metas + metas[:2]:
+            batch.add(OWNER, meta, 'main')
+        self.assertEqual(len(batch), 4)
+        self.assertEqual(batch.apply(self.listings), [])
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(self.server.request_count('POST', '/channels/'), 4)
+        # One listing to verify the whole batch.
+        self.assertEqual(self.server.request_count('GET', '/channels/'), 1)
+        for meta in metas:
+            self.assertTrue(self.listings.contains(OWNER, 'main', meta))
+
+    def test_not_leaky(self):
+        def promote(meta):
+            batch = PromotionBatch(self.cli)
+            batch.add(OWNER, meta, 'main')
+            self.assertEqual(batch.apply(self.listings), [])
+        self.assertNotLeaky(promote)
+
+    def test_failed(self):
+        batch = PromotionBatch(self.cli, workers=1)
+        # The promotion of foo fails, and there is no distribution of missing.
+        self.server.inject_errors(status=403, method='POST', path='/channels/')
+        meta = DummyMeta('foo', '0.1')
+        put_distribution(self.server, OWNER, meta, ['dev'])
+        batch.add(OWNER, meta, 'main')
+        batch.add(OWNER, DummyMeta('missing', '0.1'), 'main')
+        self.assertEqual(sorted(batch.apply(self.listings)), ['foo-0.1-0', 'missing-0.1-0'])
+
+    def test_empty(self):
+        self.assertEqual(PromotionBatch(self.cli).apply(self.listings), [])
+        self.assertEqual(self.server.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from obvci.conda_tools.env_pool import EnvironmentPool, clone_tree
+
+
+class Test_EnvironmentPool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_env_pool_')
+        self.prefix = os.path.join(self.tmpdir, '_build')
+        os.makedirs(os.path.join(self.prefix, 'conda-meta'))
+        with open(os.path.join(self.prefix, 'conda-meta', 'python.json'), 'w') as fh:
+            fh.write('{}')
+        self.pool = EnvironmentPool(os.path.join(self.tmpdir, 'pool'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def link_from_cache(self, dist, name, content=b'cached'):
+        # Extract a file of the dist into the package cache, and hardlink
+        # it into the prefix as conda does.
+        pkgs_dir = os.path.join(self.tmpdir, 'pkgs')
+        os.makedirs(os.path.join(pkgs_dir, dist))
+        with open(os.path.join(pkgs_dir, dist, name), 'wb') as fh:
+            fh.write(content)
+        os.link(os.path.join(pkgs_dir, dist, name), os.path.join(self.prefix, name))
+        return pkgs_dir
+
+    def test_clone_tree_hardlinks(self):
+        target = os.path.join(self.tmpdir, 'clone')
+        fname = os.path.join(self.prefix, 'conda-meta', 'python.json')
+        stat = os.stat(fname)
+        self.assertEqual(clone_tree(self.prefix, target, {(stat.st_dev, stat.st_ino)}), 0)
+        self.assertTrue(os.path.samefile(fname, os.path.join(target, 'conda-meta',
+                                                             'python.json')))
+
+    def test_clone_tree_copies(self):
+        target = os.path.join(self.tmpdir, 'clone')
+        self.assertEqual(clone_tree(self.prefix, target), 2)
+        self.assertFalse(os.path.samefile(os.path.join(self.prefix, 'conda-meta', 'python.json'),
+                                          os.path.join(target, 'conda-meta', 'python.json')))
+
+    def test_modified_in_place(self):
+        # A build which writes to a file of its environment leaves the snapshot alone.
+        self.pool.store(self.prefix, ['python-2.7.10-0'])
+        entry = self.pool.closest(self.prefix, ['python-2.7.10-0'])
+        self.pool.materialize(entry, self.prefix)
+        with open(os.path.join(self.prefix, 'conda-meta', 'python.json'), 'w') as fh:
+            fh.write('modified')
+        self.pool.materialize(entry, self.prefix)
+        with open(os.path.join(self.prefix, 'conda-meta', 'python.json'), 'r') as fh:
+            self.assertEqual(fh.read(), '{}')
+
+    def test_package_cache_hardlinked(self):
+        pkgs_dir = self.link_from_cache('python-2.7.10-0', 'python')
+        self.pool.store(self.prefix, ['python-2.7.10-0'], [pkgs_dir])
+        entry = self.pool.closest(self.prefix, ['python-2.7.10-0'])
+        self.assertEqual(entry['size'], 2)
+        shutil.rmtree(self.prefix)
+        self.pool.materialize(entry, self.prefix, [pkgs_dir])
+        self.assertTrue(os.path.samefile(os.path.join(pkgs_dir, 'python-2.7.10-0', 'python'),
+                                         os.path.join(self.prefix, 'python')))
+        self.assertFalse(os.path.samefile(os.path.join(self.pool.directory, entry['key'],
+                                                       'conda-meta', 'python.json'),
+                                          os.path.join(self.prefix, 'conda-meta', 'python.json')))
+
+    def test_closest(self):
+        self.pool.store(self.prefix, ['python-2.7.10-0', 'numpy-1.9.0-py27_0'])
+        self.pool.store(self.prefix, ['python-3.5.0-0', 'numpy-1.9.0-py35_0'])
+        entry = self.pool.closest(self.prefix, ['python-3.5.0-0', 'numpy-1.10.0-py35_0'])
+        self.assertEqual(entry['dists'], ['numpy-1.9.0-py35_0', 'python-3.5.0-0'])
+
+    def test_closest_other_prefix(self):
+        self.pool.store(self.prefix, ['python-2.7.10-0'])
+        self.assertIsNone(self.pool.closest('/elsewhere', ['python-2.7.10-0']))
+
+    def test_no_overlap(self):
+        self.pool.store(self.prefix, ['python-2.7.10-0'])
+        self.assertIsNone(self.pool.closest(self.prefix, ['perl-5.0-0']))
+
+    def test_materialize(self):
+        self.pool.store(self.prefix, ['python-2.7.10-0'])
+        entry = self.pool.closest(self.prefix, ['python-2.7.10-0'])
+        shutil.rmtree(self.prefix)
+        self.pool.materialize(entry, self.prefix)
+        self.assertTrue(os.path.exists(os.path.join(self.prefix, 'conda-meta',
+                                                    'python.json')))
+
+    def store_sized(self, dists, size=1000):
+        with open(os.path.join(self.prefix, 'big'), 'wb') as fh:
+            fh.write(b'0' * size)
+        self.pool.store(self.prefix, dists)
+
+    def test_eviction(self):
+        self.pool.max_bytes = 200
+        self.store_sized(['python-2.7.10-0'], size=100)
+        self.store_sized(['python-3.5.0-0'], size=100)
+        self.assertEqual([entry['dists'] for entry in self.pool.entries()],
+                         [['python-3.5.0-0']])
+
+    def test_eviction_lru(self):
+        for version in ['1', '2', '3']:
+            self.store_sized(['python-{}-0'.format(version)])
+        # Room for two snapshots, but not three.
+        self.pool.max_bytes = 2500
+        self.store_sized(['python-4-0'])
+        self.assertEqual(sorted(entry['dists'][0] for entry in self.pool.entries()),
+                         ['python-3-0', 'python-4-0'])
+
+    def test_eviction_package_cache(self):
+        # Files hardlinked from the package cache aren't freed by eviction,
+        # so don't count towards the pool's size.
+        pkgs_dir = self.link_from_cache('python-1-0', 'python', b'0' * 1000)
+        self.pool.max_bytes = 10
+        self.pool.store(self.prefix, ['python-1-0'], [pkgs_dir])
+        self.pool.store(self.prefix, ['python-1-0', 'numpy-1-0'], [pkgs_dir])
+        self.assertEqual(len(self.pool.entries()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
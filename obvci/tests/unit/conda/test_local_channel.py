@@ -0,0 +1,51 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from obvci.conda_tools.local_channel import LocalChannel
+from obvci.tests.fakes import make_distribution
+
+
+class Test_LocalChannel(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_channel_')
+        self.channel_dir = os.path.join(self.tmpdir, 'channel')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_repodata(self, subdir='linux-64'):
+        fname = os.path.join(self.channel_dir, subdir, 'repodata.json')
+        with open(fname) as fh:
+            return json.load(fh)
+
+    def test_empty_channel(self):
+        LocalChannel(self.channel_dir, subdir='linux-64')
+        self.assertEqual(self.read_repodata()['packages'], {})
+        self.assertEqual(self.read_repodata('noarch')['packages'], {})
+
+    def test_add(self):
+        channel = LocalChannel(self.channel_dir, subdir='linux-64')
+        info = channel.add(make_distribution(self.tmpdir, 'foo'))
+        self.assertEqual(info['name'], 'foo')
+        self.assertIn('foo-1.0-0.tar.bz2', channel)
+        self.assertTrue(os.path.exists(os.path.join(self.channel_dir, 'linux-64',
+                                                    'foo-1.0-0.tar.bz2')))
+        packages = self.read_repodata()['packages']
+        self.assertEqual(sorted(packages), ['foo-1.0-0.tar.bz2'])
+        self.assertEqual(packages['foo-1.0-0.tar.bz2']['md5'], info['md5'])
+
+    def test_incremental(self):
+        channel = LocalChannel(self.channel_dir, subdir='linux-64')
+        channel.add(make_distribution(self.tmpdir, 'foo'))
+        # A new instance picks up the existing repodata.
+        channel = LocalChannel(self.channel_dir, subdir='linux-64')
+        channel.add(make_distribution(self.tmpdir, 'bar'))
+        self.assertEqual(sorted(self.read_repodata()['packages']),
+                         ['bar-1.0-0.tar.bz2', 'foo-1.0-0.tar.bz2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
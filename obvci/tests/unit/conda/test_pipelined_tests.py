@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import conda_build.config
+
+from obvci.conda_tools import pipelined_tests
+from obvci.conda_tools.artifact_index import LocalArtifactIndex
+from obvci.conda_tools.build_cache import BuildCache
+from obvci.conda_tools.build_directory import Builder
+from obvci.conda_tools.local_channel import LocalChannel
+from obvci.conda_tools.pipelined_tests import isolated_test_root, run_test
+from obvci.conda_tools.timing import timings
+from obvci.tests.fakes import DummyMeta, fake_run_test, make_distribution
+
+
+class Test_isolated_test_root(unittest.TestCase):
+    def test(self):
+        croot = conda_build.config.croot
+        config_croot = conda_build.config.config.croot
+        with isolated_test_root('/tmp/test_root'):
+            self.assertEqual(conda_build.config.croot, '/tmp/test_root')
+            self.assertEqual(conda_build.config.config.croot, '/tmp/test_root')
+            self.assertEqual(conda_build.config.config.test_prefix, '/tmp/test_root/_t')
+        self.assertEqual(conda_build.config.croot, croot)
+        self.assertEqual(conda_build.config.config.croot, config_croot)
+
+
+class Test_run_test(unittest.TestCase):
+    def test_failure(self):
+        test_root = tempfile.mkdtemp(prefix='tmp_obvci_test_root_')
+        passed, message = run_test(os.path.join(test_root, 'no_such_recipe'), (), test_root)
+        self.assertFalse(passed)
+        self.assertTrue(message)
+        # The test root is always removed.
+        self.assertFalse(os.path.exists(test_root))
+
+
+class Test_TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.orig_run_test = pipelined_tests.run_test
+        pipelined_tests.run_test = fake_run_test
+        self.pipeline = pipelined_tests.TestPipeline(processes=2)
+
+    def tearDown(self):
+        self.pipeline.close()
+        pipelined_tests.run_test = self.orig_run_test
+
+    def test_order(self):
+        metas = [DummyMeta(name) for name in ['slow_a', 'b', 'c']]
+        for meta in metas:
+            self.pipeline.submit(meta)
+        self.assertEqual(self.pipeline.submitted(), metas)
+        results = list(self.pipeline.completed(block=True))
+        self.assertEqual(results, [(meta, True) for meta in metas])
+        # Each result is only reported once.
+        self.assertEqual(list(self.pipeline.completed(block=True)), [])
+
+    def test_not_blocking(self):
+        slow, fast = DummyMeta('slow_a'), DummyMeta('b')
+        self.pipeline.submit(slow)
+        self.pipeline.submit(fast)
+        self.assertTrue(self.pipeline.wait(fast))
+        # The fast test is reported without waiting for the slow one.
+        self.assertEqual(list(self.pipeline.completed()), [(fast, True)])
+        self.assertEqual(list(self.pipeline.completed(block=True)), [(slow, True)])
+
+    def test_failure(self):
+        failing, passing = DummyMeta('fail_a'), DummyMeta('b')
+        self.pipeline.submit(failing)
+        self.pipeline.submit(passing)
+        self.assertFalse(self.pipeline.wait(failing))
+        self.assertEqual(list(self.pipeline.completed(block=True)),
+                         [(failing, False), (passing, True)])
+
+    def test_isolated_roots(self):
+        for name in ['a', 'b']:
+            self.pipeline.submit(DummyMeta(name))
+        list(self.pipeline.completed(block=True))
+        self.assertEqual(sorted(os.listdir(self.pipeline.test_root)), ['0', '1'])
+        self.pipeline.close()
+        self.assertFalse(os.path.exists(self.pipeline.test_root))
+
+    def test_timings(self):
+        # The tests are timed in the workers, and merged into the main timings.
+        timings.reset()
+        self.pipeline.submit(DummyMeta('a'))
+        list(self.pipeline.completed(block=True))
+        self.assertEqual(timings.phases['test']['calls'], 1)
+        self.assertEqual(timings.distributions['a-1-0']['test']['calls'], 1)
+        timings.reset()
+
+    def test_build_root_channel(self):
+        from conda.utils import url_path
+
+        self.assertEqual(self.pipeline.channel_urls[0], url_path(conda_build.config.croot))
+
+
+class DummyPipeline(object):
+    def __init__(self, results):
+        self.results = results
+
+    def completed(self, block=False):
+        results, self.results = self.results, []
+        return iter(results)
+
+
+class Test_Builder_handle_tested(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_pipeline_')
+        self.isolated = isolated_test_root(os.path.join(self.tmpdir, 'croot'))
+        self.isolated.__enter__()
+        self.meta = DummyMeta('foo')
+        bldpkgs_dir = conda_build.config.config.bldpkgs_dir
+        os.makedirs(bldpkgs_dir)
+        self.fname = make_distribution(bldpkgs_dir, 'foo', version='1')
+
+        # Avoid connecting to binstar by not calling __init__.
+        self.builder = Builder.__new__(Builder)
+        self.builder.local_channel = LocalChannel(os.path.join(self.tmpdir, 'channel'),
+                                                  subdir='linux-64')
+        self.builder.artifact_index = LocalArtifactIndex(
+            [], cache_directory=os.path.join(self.tmpdir, 'artifacts'), subdir='linux-64')
+        self.builder.build_cache = BuildCache(os.path.join(self.tmpdir, 'cache'))
+        self.builder.build_cache_keys = {self.meta.dist(): 'abcdef'}
+        self.builder.failed_tests = []
+        self.posted = []
+        self.builder.post_build = lambda meta, build_occured: self.posted.append(meta)
+
+    def tearDown(self):
+        self.isolated.__exit__(None, None, None)
+        shutil.rmtree(self.tmpdir)
+
+    def cached(self):
+        return ['foo-1-0.tar.bz2' in self.builder.local_channel,
+                self.builder.artifact_index.find(self.meta) is not None,
+                self.builder.build_cache.get('abcdef') is not None]
+
+    def test_passed(self):
+        self.builder.test_pipeline = DummyPipeline([(self.meta, True)])
+        self.builder.handle_tested()
+        self.assertEqual(self.cached(), [True, True, True])
+        self.assertEqual(self.posted, [self.meta])
+        self.assertEqual(self.builder.failed_tests, [])
+
+    def test_failed(self):
+        # Left over from an earlier run of the same distribution.
+        self.builder.register_artifact(self.meta)
+        self.builder.test_pipeline = DummyPipeline([(self.meta, False)])
+        self.builder.handle_tested()
+        self.assertEqual(self.cached(), [False, False, False])
+        self.assertFalse(os.path.exists(self.fname))
+        self.assertEqual(self.posted, [])
+        self.assertEqual(self.builder.failed_tests, ['foo-1-0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
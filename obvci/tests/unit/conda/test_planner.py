@@ -0,0 +1,310 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from obvci.conda_tools import planner
+from obvci.conda_tools.build_directory import Builder
+from obvci.conda_tools.planner import Planner, recipe_dirs, recipe_signature
+from obvci.conda_tools.planner_daemon import PlannerDaemon, request, runtime_dir
+from obvci.conda_tools.timing import timings
+from obvci.tests.fakes import DummyMeta
+
+
+class Test_recipe_signature(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_planner_')
+        self.recipe = os.path.join(self.tmpdir, 'a')
+        os.mkdir(self.recipe)
+        self.write('meta.yaml', 'package: {name: a}')
+        os.mkdir(os.path.join(self.tmpdir, 'not_a_recipe'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.recipe, name), 'w') as fh:
+            fh.write(content)
+
+    def test_recipe_dirs(self):
+        self.assertEqual(recipe_dirs(self.tmpdir), {'a': self.recipe})
+
+    def test_unchanged(self):
+        self.assertEqual(recipe_signature(self.recipe), recipe_signature(self.recipe))
+
+    def test_modified(self):
+        signature = recipe_signature(self.recipe)
+        self.write('meta.yaml', 'package: {name: a, version: 1}')
+        self.assertNotEqual(recipe_signature(self.recipe), signature)
+
+    def test_added(self):
+        signature = recipe_signature(self.recipe)
+        self.write('build.sh', 'make')
+        self.assertNotEqual(recipe_signature(self.recipe), signature)
+
+
+class Test_Planner_dependents(unittest.TestCase):
+    def setUp(self):
+        self.planner = Planner('.')
+        self.planner.metas = {'a_recipe': DummyMeta('a'),
+                              'b_recipe': DummyMeta('b', requirements=['a >=1']),
+                              'c_recipe': DummyMeta('c', requirements=['b']),
+                              'd_recipe': DummyMeta('d', requirements=['python'])}
+
+    def test_transitive(self):
+        self.assertEqual(self.planner.dependents(['a_recipe']),
+                         {'a_recipe', 'b_recipe', 'c_recipe'})
+
+    def test_leaf(self):
+        self.assertEqual(self.planner.dependents(['c_recipe']), {'c_recipe'})
+
+    def test_removed(self):
+        self.assertEqual(self.planner.dependents(['gone']), {'gone'})
+
+
+class DummyDist(object):
+    def __init__(self, name):
+        self.name = name
+
+    def dist(self):
+        return self.name
+
+
+class DummyPlanner(object):
+    index = {}
+    index_time = None
+    errors = {}
+
+    def __init__(self, plan, builder=None):
+        self.metas = {dist.name: None for dist in plan}
+        self._plan = plan
+        self.builder = builder
+        self.refreshes = 0
+        self.refreshed_whilst_building = False
+
+    def refresh(self, force_index=False):
+        self.refreshes += 1
+        if self.builder is not None and self.builder.building.is_set():
+            self.refreshed_whilst_building = True
+        return set(), False
+
+    def plan(self):
+        return self._plan
+
+
+class DummyBuilder(object):
+    failed_tests = []
+
+    def __init__(self):
+        self.built = []
+        self.building = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def build_distributions(self, distributions, index):
+        self.building.set()
+        try:
+            self.release.wait(10)
+            self.built.extend(dist.dist() for dist in distributions)
+        finally:
+            self.building.clear()
+
+
+class Test_PlannerDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_planner_')
+        self.socket_path = os.path.join(self.tmpdir, 'planner.sock')
+        self.builder = DummyBuilder()
+        self.planner = DummyPlanner([DummyDist('a-1-0'), DummyDist('b-1-0')], self.builder)
+        self.daemon = PlannerDaemon(self.planner, self.builder,
+                                    socket_path=self.socket_path, poll_interval=60)
+        self.thread = threading.Thread(target=self.daemon.serve_forever)
+        self.thread.start()
+        for _ in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.builder.release.set()
+        self.daemon.stop()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def request(self, command):
+        return request(command, socket_path=self.socket_path, timeout=10)
+
+    def test_status(self):
+        response = self.request('status')
+        self.assertEqual(response['status'], 'ok')
+        self.assertEqual(response['recipes'], 2)
+
+    def test_build(self):
+        self.assertEqual(self.request('build')['status'], 'ok')
+        self.assertEqual(self.builder.built, ['a-1-0', 'b-1-0'])
+
+    def test_refreshed_per_request(self):
+        refreshes = self.planner.refreshes
+        self.request('status')
+        self.assertEqual(self.planner.refreshes, refreshes + 1)
+
+    def test_unknown_command(self):
+        response = self.request('unknown')
+        self.assertEqual(response['status'], 'error')
+
+    def test_serialised_with_build(self):
+        self.builder.release.clear()
+        build = threading.Thread(target=self.request, args=('build',))
+        build.start()
+        self.assertTrue(self.builder.building.wait(10))
+        status = threading.Thread(target=self.request, args=('status',))
+        status.start()
+        # The status request waits for the build, rather than refreshing under it.
+        status.join(0.2)
+        self.assertTrue(status.is_alive())
+        self.builder.release.set()
+        build.join()
+        status.join()
+        self.assertFalse(self.planner.refreshed_whilst_building)
+
+    def test_stats_reset(self):
+        timings.record('build', 0, 1)
+        self.request('status')
+        self.assertNotIn('build', timings.phases)
+
+    def test_live_socket(self):
+        other = PlannerDaemon(DummyPlanner([]), DummyBuilder(),
+                              socket_path=self.socket_path, poll_interval=60)
+        with self.assertRaises(RuntimeError):
+            other.serve_forever()
+        # The running daemon is left untouched.
+        self.assertEqual(self.request('status')['status'], 'ok')
+
+
+class Test_PlannerDaemon_stale_socket(unittest.TestCase):
+    def test(self):
+        tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_planner_')
+        self.addCleanup(shutil.rmtree, tmpdir)
+        socket_path = os.path.join(tmpdir, 'planner.sock')
+        # Left behind by a daemon which was killed.
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(socket_path)
+        sock.close()
+        daemon = PlannerDaemon(DummyPlanner([DummyDist('a-1-0')]), DummyBuilder(),
+                               socket_path=socket_path, poll_interval=60)
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            for _ in range(100):
+                try:
+                    response = request('status', socket_path=socket_path, timeout=10)
+                except socket.error:
+                    time.sleep(0.01)
+                else:
+                    break
+            self.assertEqual(response['recipes'], 1)
+        finally:
+            daemon.stop()
+            thread.join()
+
+
+class Test_runtime_dir(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_planner_')
+        self.orig_runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+        os.environ['XDG_RUNTIME_DIR'] = self.tmpdir
+
+    def tearDown(self):
+        if self.orig_runtime_dir is None:
+            del os.environ['XDG_RUNTIME_DIR']
+        else:
+            os.environ['XDG_RUNTIME_DIR'] = self.orig_runtime_dir
+        shutil.rmtree(self.tmpdir)
+
+    def test_private(self):
+        directory = runtime_dir()
+        self.assertEqual(directory, os.path.join(self.tmpdir, 'obvci'))
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+        # It is reused once made.
+        self.assertEqual(runtime_dir(), directory)
+
+    def test_shared(self):
+        os.mkdir(os.path.join(self.tmpdir, 'obvci'))
+        os.chmod(os.path.join(self.tmpdir, 'obvci'), 0o777)
+        with self.assertRaises(RuntimeError):
+            runtime_dir()
+
+
+class WatchedPlanner(DummyPlanner):
+    """A planner whose recipe changes once, after which watching is interrupted."""
+    def __init__(self, recipes_root, extra_build_conditions=()):
+        dist = DummyMeta('a')
+        # A baked distribution's MetaData is its meta.
+        dist.meta = dist
+        super(WatchedPlanner, self).__init__([dist])
+        self.recipes_root = recipes_root
+        self.changes = list(self.changes)
+
+    #: The (changed recipes, whether the index changed) of each refresh.
+    changes = [({'a'}, False)]
+
+    def refresh(self, force_index=False):
+        if force_index:
+            return set(), True
+        if not self.changes:
+            raise KeyboardInterrupt()
+        changed, index_changed = self.changes.pop(0)
+        if index_changed:
+            # The new index adds a case to the matrix of b.
+            dist = DummyMeta('b')
+            dist.meta = dist
+            self._plan.append(dist)
+        return changed, index_changed
+
+    def dependents(self, names):
+        return set(names)
+
+
+class Test_Builder_watch_recipes(unittest.TestCase):
+    def setUp(self):
+        self.orig_planner = planner.Planner
+        planner.Planner = WatchedPlanner
+        # Avoid connecting to binstar by not calling __init__.
+        self.builder = Builder.__new__(Builder)
+        self.builder.conda_recipes_root = 'recipes'
+        self.builder.watch_interval = 0
+        self.builder.can_upload = True
+        self.builds = []
+        self.builder.build_distributions = self.build_distributions
+
+    def tearDown(self):
+        planner.Planner = self.orig_planner
+
+    def build_distributions(self, distributions, index, rebuild=False):
+        self.builds.append(([meta.dist() for meta in distributions], rebuild,
+                            self.builder.can_upload))
+
+    def test_local_only(self):
+        self.builder.watch_recipes()
+        # Neither the first build nor the rebuild is uploaded.
+        self.assertEqual(self.builds, [(['a-1-0'], False, False),
+                                       (['a-1-0'], True, False)])
+        self.assertTrue(self.builder.can_upload)
+
+    def test_index_changed(self):
+        orig_changes = WatchedPlanner.changes
+        WatchedPlanner.changes = [(set(), False), (set(), True)]
+        try:
+            self.builder.watch_recipes()
+        finally:
+            WatchedPlanner.changes = orig_changes
+        # Only the distribution which is new to the plan is built.
+        self.assertEqual(self.builds, [(['a-1-0'], False, False),
+                                       (['b-1-0'], True, False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
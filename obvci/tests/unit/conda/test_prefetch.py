@@ -0,0 +1,210 @@
+from collections import namedtuple
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import conda.config
+import conda_build.source
+
+from obvci.conda_tools import prefetch
+from obvci.tests.fakes import DummyMeta
+
+
+Spec = namedtuple('Spec', 'spec')
+
+
+class RecipeMeta(DummyMeta):
+    def __init__(self, name, build=(), run=(), test=(), source=None):
+        super(RecipeMeta, self).__init__(name)
+        self.specs = {'build': list(build), 'run': list(run)}
+        self.values = {'test/requires': list(test)}
+        for key, value in (source or {}).items():
+            self.values['source/' + key] = value
+
+    def ms_depends(self, typ):
+        return [Spec(spec) for spec in self.specs[typ]]
+
+    def get_value(self, key, default=None):
+        return self.values.get(key, default)
+
+
+class DummySolveCache(object):
+    """
+    Solves each spec to a package of its name (failing for ``missing``, and
+    raising a bug for ``broken``).
+
+    """
+    def __init__(self):
+        self.solved = []
+
+    def solve(self, index, specs):
+        self.solved.append(specs)
+        if 'missing' in specs:
+            raise SystemExit('Unsatisfiable')
+        if 'broken' in specs:
+            raise KeyError('broken')
+        return ['{}-1-0.tar.bz2'.format(spec.split(' ')[0]) for spec in specs]
+
+
+class Test_packages_to_fetch(unittest.TestCase):
+    def setUp(self):
+        self.solve_cache = DummySolveCache()
+
+    def test_environment_specs(self):
+        meta = RecipeMeta('a', build=['python 2.7*'], run=['python', 'numpy'], test=['nose'])
+        self.assertEqual(prefetch.environment_specs(meta),
+                         [['python 2.7*'], ['python', 'numpy', 'nose']])
+
+    def test_union(self):
+        metas = [RecipeMeta('a', build=['python'], test=['nose']),
+                 RecipeMeta('b', build=['python', 'numpy'])]
+        self.assertEqual(prefetch.packages_to_fetch(metas, {}, solve_cache=self.solve_cache),
+                         {'python-1-0.tar.bz2', 'nose-1-0.tar.bz2', 'numpy-1-0.tar.bz2'})
+
+    def test_excluded(self):
+        # b is being built, so can't be fetched (and an empty environment isn't solved).
+        metas = [RecipeMeta('c', build=['b', 'python'], run=['b'])]
+        self.assertEqual(prefetch.packages_to_fetch(metas, {}, exclude_names={'b'},
+                                                    solve_cache=self.solve_cache),
+                         {'python-1-0.tar.bz2'})
+        self.assertEqual(self.solve_cache.solved, [['python']])
+
+    def test_unsatisfiable(self):
+        metas = [RecipeMeta('a', build=['missing']), RecipeMeta('b', build=['python'])]
+        self.assertEqual(prefetch.packages_to_fetch(metas, {}, solve_cache=self.solve_cache),
+                         {'python-1-0.tar.bz2'})
+
+    def test_bug(self):
+        # Only unsatisfiable specs are skipped, not bugs.
+        metas = [RecipeMeta('a', build=['broken'])]
+        with self.assertRaises(KeyError):
+            prefetch.packages_to_fetch(metas, {}, solve_cache=self.solve_cache)
+
+
+class Test_sources_to_fetch(unittest.TestCase):
+    def test(self):
+        metas = [RecipeMeta('a', source={'url': 'http://example.com/a-1.tar.gz',
+                                         'md5': 'abc'}),
+                 RecipeMeta('b', source={'url': 'http://example.com/download?b',
+                                         'fn': 'b-1.tar.gz'}),
+                 RecipeMeta('c', source={'git_url': 'http://example.com/c.git'})]
+        src_cache = conda_build.source.SRC_CACHE
+        self.assertEqual(prefetch.sources_to_fetch(metas),
+                         {os.path.join(src_cache, 'a-1.tar.gz'):
+                              ('http://example.com/a-1.tar.gz', 'abc'),
+                          os.path.join(src_cache, 'b-1.tar.gz'):
+                              ('http://example.com/download?b', None)})
+
+
+class DummyResponse(object):
+    def __init__(self, chunks, during=None):
+        self.chunks = chunks
+        self.during = during
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i, chunk in enumerate(self.chunks):
+            if i == 1 and self.during is not None:
+                self.during()
+            yield chunk
+
+
+class DummySession(object):
+    def __init__(self, chunks=(b'con', b'tent'), during=None):
+        self.chunks = list(chunks)
+        self.during = during
+        self.urls = []
+
+    def get(self, url, stream=False):
+        self.urls.append(url)
+        return DummyResponse(self.chunks, self.during)
+
+
+class Test_download(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_prefetch_')
+        self.target = os.path.join(self.tmpdir, 'pkgs', 'a-1-0.tar.bz2')
+        self.md5 = hashlib.md5(b'content').hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self):
+        with open(self.target, 'rb') as fh:
+            return fh.read()
+
+    def test_verified(self):
+        prefetch.download('http://example.com/a', self.target, self.md5,
+                          session=DummySession())
+        self.assertEqual(self.read(), b'content')
+
+    def test_md5_mismatch(self):
+        with self.assertRaises(ValueError):
+            prefetch.download('http://example.com/a', self.target, 'not-the-md5',
+                              session=DummySession())
+        self.assertEqual(os.listdir(os.path.dirname(self.target)), [])
+
+    def test_existing(self):
+        os.makedirs(os.path.dirname(self.target))
+        with open(self.target, 'wb') as fh:
+            fh.write(b'fetched')
+        session = DummySession()
+        prefetch.download('http://example.com/a', self.target, self.md5, session=session)
+        self.assertEqual(session.urls, [])
+        self.assertEqual(self.read(), b'fetched')
+
+    def test_overlapping_build(self):
+        # A build fetches the same file whilst it is being prefetched.
+        def build_fetch():
+            with open(self.target, 'wb') as fh:
+                fh.write(b'content')
+        prefetch.download('http://example.com/a', self.target, self.md5,
+                          session=DummySession(during=build_fetch))
+        self.assertEqual(self.read(), b'content')
+        # The build's file is kept, and the prefetched copy removed.
+        self.assertEqual(os.listdir(os.path.dirname(self.target)), ['a-1-0.tar.bz2'])
+
+
+class Test_prefetch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_prefetch_')
+        self.orig_pkgs_dirs = conda.config.pkgs_dirs
+        conda.config.pkgs_dirs = [os.path.join(self.tmpdir, 'pkgs')]
+        self.orig_download = prefetch.download
+        prefetch.download = self.download
+        self.downloaded = []
+
+    def tearDown(self):
+        prefetch.download = self.orig_download
+        conda.config.pkgs_dirs = self.orig_pkgs_dirs
+        shutil.rmtree(self.tmpdir)
+
+    def download(self, url, target, md5=None, session=None):
+        self.downloaded.append((url, target, md5))
+        if 'fail' in url:
+            raise IOError('Failed')
+        return target
+
+    def test(self):
+        index = {'python-1-0.tar.bz2': {'channel': 'http://repo/', 'md5': 'abc'},
+                 'nose-1-0.tar.bz2': {'channel': 'http://fail/'},
+                 'numpy-1-0.tar.bz2': {'channel': 'http://repo/'}}
+        # numpy has already been extracted, so isn't fetched again.
+        os.makedirs(os.path.join(self.tmpdir, 'pkgs', 'numpy-1-0'))
+        metas = [RecipeMeta('a', build=['python', 'numpy'], test=['nose'])]
+        fetched = prefetch.prefetch(metas, index, workers=2, solve_cache=DummySolveCache())
+        self.assertEqual(fetched, 1)
+        pkgs_dir = os.path.join(self.tmpdir, 'pkgs')
+        self.assertEqual(sorted(self.downloaded),
+                         [('http://fail/nose-1-0.tar.bz2',
+                           os.path.join(pkgs_dir, 'nose-1-0.tar.bz2'), None),
+                          ('http://repo/python-1-0.tar.bz2',
+                           os.path.join(pkgs_dir, 'python-1-0.tar.bz2'), 'abc')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from obvci.conda_tools.profiling import PhaseProfiler, tracemalloc
+
+
+def allocate():
+    return [str(i) * 10 for i in range(10000)]
+
+
+class Test_PhaseProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_profiling_')
+        self.profiler = PhaseProfiler(os.path.join(self.tmpdir, 'profiles'), top=5)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_pstats(self):
+        with self.profiler.phase('allocate'):
+            allocate()
+        stats = pstats.Stats(os.path.join(self.profiler.directory, '01-allocate.pstats'))
+        self.assertIn('allocate', [name for _, _, name in stats.stats])
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available.')
+    def test_tracemalloc(self):
+        with self.profiler.phase('allocate'):
+            # Keep the allocations alive until the end of the phase.
+            self.allocated = allocate()
+        with open(os.path.join(self.profiler.directory,
+                               '01-allocate.tracemalloc.txt')) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(len(lines), 2 + 5)
+        self.assertIn('test_profiling.py', lines[2])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_phases_numbered(self):
+        for phase in ['a', 'b']:
+            with self.profiler.phase(phase):
+                pass
+        self.assertEqual(sorted(fname for fname in os.listdir(self.profiler.directory)
+                                if fname.endswith('.pstats')),
+                         ['01-a.pstats', '02-b.pstats'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import shutil
+import tempfile
+import unittest
+
+from obvci.conda_tools import solve_cache
+from obvci.conda_tools.solve_cache import (SolveCache, environment_index, exact_specs,
+                                           prune_index, shared_index)
+from obvci.tests.unit.conda.dummy_index import DummyIndex
+
+
+class Test_prune_index(unittest.TestCase):
+    def setUp(self):
+        self.index = DummyIndex()
+        self.index.add_pkg('python', '2.7.10')
+        self.index.add_pkg('numpy', '1.9.0', depends=['python 2.7*'])
+        self.index.add_pkg('unrelated', '1.0')
+
+    def test_reachable(self):
+        pruned = prune_index(self.index, ['numpy'])
+        self.assertEqual(sorted(pruned), ['numpy-1.9.0-0.tar.bz2',
+                                          'python-2.7.10-0.tar.bz2'])
+
+    def test_leaf(self):
+        pruned = prune_index(self.index, ['python >=2.7'])
+        self.assertEqual(sorted(pruned), ['python-2.7.10-0.tar.bz2'])
+
+
+class Test_SolveCache(unittest.TestCase):
+    def setUp(self):
+        self.index = DummyIndex()
+        self.index.add_pkg('python', '2.7.10')
+        self.index.add_pkg('numpy', '1.9.0', depends=['python 2.7*'])
+        self.cache_dir = tempfile.mkdtemp(prefix='tmp_obvci_solve_cache_')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_unrelated_churn(self):
+        cache = SolveCache()
+        key = cache.key(['numpy'], self.index)
+        self.index.add_pkg('unrelated', '1.0')
+        self.assertEqual(cache.key(['numpy'], self.index), key)
+
+    def test_related_change(self):
+        cache = SolveCache()
+        key = cache.key(['numpy'], self.index)
+        self.index.add_pkg('python', '2.7.11')
+        self.assertNotEqual(cache.key(['numpy'], self.index), key)
+
+    def test_spec_order(self):
+        cache = SolveCache()
+        self.assertEqual(cache.key(['numpy', 'python'], self.index),
+                         cache.key(['python', 'numpy'], self.index))
+
+    def test_hit(self):
+        cache = SolveCache(self.cache_dir)
+        key = cache.key(['numpy'], self.index)
+        fns = ['python-2.7.10-0.tar.bz2', 'numpy-1.9.0-0.tar.bz2']
+        cache.put(key, fns)
+        self.assertEqual(cache.solve(self.index, ['numpy']), fns)
+        self.assertEqual(cache.hits, 1)
+        # The solution is persisted.
+        self.assertEqual(SolveCache(self.cache_dir).get(key), fns)
+
+    def test_new_index(self):
+        # A different index of the same length isn't mistaken for the last.
+        cache = SolveCache()
+        cache.key(['numpy'], self.index)
+        index = DummyIndex()
+        index.add_pkg('python', '3.4.3')
+        index.add_pkg('numpy', '1.9.0', depends=['python 3.4*'])
+        self.assertEqual(cache.key(['numpy'], index), SolveCache().key(['numpy'], index))
+
+    def test_exact_specs(self):
+        self.assertEqual(exact_specs(['numpy-1.9.0-0.tar.bz2'], self.index),
+                         ['numpy 1.9.0 0'])
+
+
+class Test_environment_index(unittest.TestCase):
+    def setUp(self):
+        import conda.api
+
+        self.fetched = []
+        self.orig_get_index = conda.api.get_index
+        conda.api.get_index = lambda **kwargs: self.fetched.append(kwargs) or {}
+
+    def tearDown(self):
+        import conda.api
+
+        conda.api.get_index = self.orig_get_index
+
+    def test_fetched(self):
+        environment_index({'channel_urls': ['http://channel']})
+        self.assertEqual(len(self.fetched), 1)
+        self.assertEqual(self.fetched[0]['channel_urls'][1:], ['http://channel'])
+
+    def test_shared(self):
+        index = {}
+        with shared_index(index):
+            self.assertIs(environment_index({}), index)
+        self.assertEqual(self.fetched, [])
+        self.assertIsNone(getattr(solve_cache._shared, 'index', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from obvci.conda_tools.binstar_gateway import BinstarGateway
+from obvci.conda_tools.streaming_upload import Progress, hash_file, stream_upload
+from obvci.tests.fake_binstar import DROP, LOSE_RESPONSE, FakeBinstar
+
+
+OWNER = 'owner'
+BASENAME = 'linux-64/foo-0.1-0.tar.bz2'
+KEY = (OWNER, 'foo', '0.1', BASENAME)
+
+
+class UploadTest(unittest.TestCase):
+    resumable = False
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='test_streaming_upload_')
+        self.fname = os.path.join(self.tmpdir, 'foo-0.1-0.tar.bz2')
+        self.data = os.urandom(10000)
+        with open(self.fname, 'wb') as fh:
+            fh.write(self.data)
+        self.server = FakeBinstar(login=OWNER, resumable=self.resumable).start()
+        self.cli = BinstarGateway(self.server.client(), backoff=0.01)
+        self.cli.add_package(OWNER, 'foo', 'A summary', 'BSD', public=True)
+        self.cli.add_release(OWNER, 'foo', '0.1', requirements=[], announce=None,
+                             description='')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def upload(self):
+        return stream_upload(self.cli, OWNER, 'foo', '0.1', BASENAME, self.fname, 'conda',
+                             attrs={'build': 0}, channels=['testing'], chunk_size=1000)
+
+    def assertUploaded(self, info):
+        self.assertEqual(info['md5'], hashlib.md5(self.data).hexdigest())
+        self.assertEqual(self.server.files[KEY]['data'], self.data)
+        self.assertEqual(self.server.files[KEY]['channels'], set(['testing']))
+        self.assertEqual(self.server.files[KEY]['attrs'], {'build': 0})
+
+
+class Test_stream_upload(UploadTest):
+    def test_upload(self):
+        self.assertUploaded(self.upload())
+        self.assertEqual(self.server.request_count('POST', '/s3/'), 1)
+        self.assertEqual(self.cli.report()['upload_data']['calls'], 1)
+
+    def test_dropped_connection(self):
+        self.server.inject_errors(status=DROP, path='/s3/')
+        self.assertUploaded(self.upload())
+        self.assertEqual(self.server.request_count('POST', '/s3/'), 2)
+
+    def test_server_error(self):
+        self.server.inject_errors(status=503, path='/s3/')
+        self.assertUploaded(self.upload())
+        self.assertEqual(self.cli.report()['upload_data']['retries'], 1)
+
+    def test_gives_up(self):
+        import requests
+
+        self.server.inject_errors(7, status=DROP, path='/s3/')
+        with self.assertRaises(requests.ConnectionError):
+            self.upload()
+        self.assertNotIn(KEY, self.server.files)
+
+
+class Test_stream_upload_resumable(UploadTest):
+    resumable = True
+
+    def test_upload(self):
+        self.assertUploaded(self.upload())
+        self.assertEqual(self.server.request_count('PUT', '/resumable/'), 10)
+        self.assertEqual(self.server.request_count('POST', '/s3/'), 0)
+
+    def test_resumes(self):
+        # Drop the connection whilst sending the fourth chunk.
+        self.server.inject_errors(status=DROP, path='/resumable/', after=3)
+        self.assertUploaded(self.upload())
+        # 3 chunks, the dropped one, the query of the offset, and 7 chunks.
+        self.assertEqual(self.server.request_count('PUT', '/resumable/'), 12)
+        self.assertEqual(self.cli.report()['upload_data']['bytes_sent'], 10000)
+
+    def test_query_interrupted(self):
+        # Drop the connection whilst sending the fourth chunk, and again
+        # whilst asking how much of it was received.
+        self.server.inject_errors(2, status=DROP, path='/resumable/', after=3)
+        self.assertUploaded(self.upload())
+        # 3 chunks, the dropped one, the dropped and repeated queries, and 7 chunks.
+        self.assertEqual(self.server.request_count('PUT', '/resumable/'), 13)
+
+    def test_unacknowledged_chunk(self):
+        # The server receives the fourth chunk, but its response is lost.
+        self.server.inject_errors(status=LOSE_RESPONSE, path='/resumable/', after=3)
+        self.assertUploaded(self.upload())
+        # 4 chunks, the query of the offset, and 6 chunks.
+        self.assertEqual(self.server.request_count('PUT', '/resumable/'), 11)
+
+    def test_empty(self):
+        self.data = b''
+        with open(self.fname, 'wb'):
+            pass
+        self.assertUploaded(self.upload())
+
+
+class Test_hash_file(unittest.TestCase):
+    def test(self):
+        with tempfile.NamedTemporaryFile(delete=False) as fh:
+            fh.write(b'content' * 1000)
+        try:
+            md5, size = hash_file(fh.name, chunk_size=10)
+        finally:
+            os.remove(fh.name)
+        self.assertEqual(md5.hexdigest(), hashlib.md5(b'content' * 1000).hexdigest())
+        self.assertEqual(size, 7000)
+
+
+class Test_Progress(unittest.TestCase):
+    def test(self):
+        progress = Progress('foo', 2 * 2 ** 20, interval=0)
+        progress.advance(2 ** 20)
+        progress.advance(2 ** 20)
+        self.assertEqual(progress.offset, 2 * 2 ** 20)
+        self.assertGreater(progress.rate(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import tempfile
+import unittest
+
+from obvci.conda_tools import timing
+from obvci.tests.fakes import DummyMeta
+
+
+@timing.timed_function('check', timing.dist_argument(1, 'meta'))
+def check(cli, meta, fail=False):
+    if fail:
+        raise ValueError('Failed')
+    return 'checked'
+
+
+class Test_timing(unittest.TestCase):
+    def setUp(self):
+        timing.timings.reset()
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_timing_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_timed(self):
+        with timing.timed('phase'):
+            pass
+        with timing.timed('phase', 'a-1-0'):
+            pass
+        self.assertEqual(timing.timings.phases['phase']['calls'], 2)
+        self.assertEqual(timing.timings.distributions['a-1-0']['phase']['calls'], 1)
+
+    def test_timed_function(self):
+        self.assertEqual(check(None, DummyMeta('a')), 'checked')
+        check(None, meta=DummyMeta('a'))
+        self.assertEqual(timing.timings.distributions['a-1-0']['check']['calls'], 2)
+
+    def test_timed_function_exception(self):
+        with self.assertRaises(ValueError):
+            check(None, DummyMeta('a'), fail=True)
+        self.assertEqual(timing.timings.phases['check']['calls'], 1)
+
+    def test_write_report(self):
+        check(None, DummyMeta('a'))
+        fname = os.path.join(self.tmpdir, 'report.json')
+        timing.timings.write_report(fname)
+        with open(fname, 'r') as fh:
+            report = json.load(fh)
+        self.assertEqual(sorted(report), ['distributions', 'phases', 'total_seconds'])
+        self.assertEqual(report['distributions']['a-1-0']['check']['calls'], 1)
+        self.assertGreaterEqual(report['phases']['check']['seconds'], 0)
+
+
+class Test_tracing(unittest.TestCase):
+    def setUp(self):
+        timing.timings.reset(tracing=True)
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_obvci_timing_')
+
+    def tearDown(self):
+        timing.timings.reset()
+        shutil.rmtree(self.tmpdir)
+
+    def spans(self):
+        return [event for event in timing.timings.events if event['ph'] == 'X']
+
+    def test_not_tracing(self):
+        timing.timings.reset()
+        check(None, DummyMeta('a'))
+        self.assertIsNone(timing.timings.events)
+
+    def test_span(self):
+        check(None, DummyMeta('a'))
+        [span] = self.spans()
+        self.assertEqual(span['name'], 'check')
+        self.assertEqual(span['args'], {'dist': 'a-1-0'})
+        self.assertGreaterEqual(span['dur'], 0)
+
+    def test_thread_tracks(self):
+        pool = ThreadPool(2)
+        try:
+            pool.map(lambda i: check(None, DummyMeta('a')), range(8))
+        finally:
+            pool.close()
+            pool.join()
+        track_names = [event['args']['name'] for event in timing.timings.events
+                       if event['name'] == 'thread_name']
+        self.assertEqual(len(track_names), len(set(span['tid'] for span in self.spans())))
+        self.assertEqual(len(self.spans()), 8)
+
+    def test_run_traced(self):
+        timing.timings.events.append({'name': 'from the parent'})
+        result, recorded = timing.run_traced(check, None, DummyMeta('a'))
+        self.assertEqual(result, 'checked')
+        self.assertEqual([event['name'] for event in recorded['events'] if event['ph'] == 'X'],
+                         ['check'])
+        self.assertEqual(recorded['phases']['check']['calls'], 1)
+        self.assertEqual(recorded['distributions']['a-1-0']['check']['calls'], 1)
+
+    def test_merge(self):
+        check(None, DummyMeta('a'))
+        recorded = timing.timings.recorded()
+        timing.timings.merge(recorded)
+        self.assertEqual(timing.timings.phases['check']['calls'], 2)
+        self.assertEqual(timing.timings.distributions['a-1-0']['check']['calls'], 2)
+        self.assertEqual(len(self.spans()), 2)
+
+    def test_write_trace(self):
+        check(None, DummyMeta('a'))
+        fname = os.path.join(self.tmpdir, 'trace.json')
+        timing.timings.write_trace(fname)
+        with open(fname, 'r') as fh:
+            trace = json.load(fh)
+        self.assertEqual(trace['traceEvents'], timing.timings.events)
+
+
+if __name__ == '__main__':
+    unittest.main()
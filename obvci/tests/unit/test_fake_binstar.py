@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import json
+import unittest
+
+from obvci.tests.fake_binstar import FakeBinstar, parse_multipart
+
+
+OWNER = 'owner'
+BASENAME = 'linux-64/foo-0.1-0.tar.bz2'
+
+
+def upload(cli, data, basename=BASENAME, channels=('main',)):
+    """Upload the given bytes as foo 0.1, the way the binstar client does."""
+    stage = cli.session.post('{}/stage/{}/foo/0.1/{}'.format(cli.domain, OWNER, basename),
+                             data=json.dumps({'distribution_type': 'conda',
+                                              'channels': list(channels)}))
+    stage.raise_for_status()
+    stage = stage.json()
+    md5 = base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+    s3 = cli.session.post(stage['post_url'], data={'Content-MD5': md5},
+                          files={'file': (basename, data)})
+    assert s3.status_code == 201, s3.text
+    cli.session.post('{}/commit/{}/foo/0.1/{}'.format(cli.domain, OWNER, basename),
+                     data=json.dumps({'dist_id': stage['dist_id']})).raise_for_status()
+
+
+class Test_FakeBinstar(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeBinstar(login=OWNER).start()
+        self.cli = self.server.client()
+        self.cli.add_package(OWNER, 'foo', 'A summary', 'BSD', public=True)
+        self.cli.add_release(OWNER, 'foo', '0.1', requirements=[], announce=None,
+                             description='')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_user(self):
+        self.assertEqual(self.cli.user()['login'], OWNER)
+
+    def test_package(self):
+        import binstar_client
+
+        self.assertEqual(self.cli.package(OWNER, 'foo')['versions'], ['0.1'])
+        self.assertEqual([package['name'] for package in self.cli.user_packages(OWNER)],
+                         ['foo'])
+        with self.assertRaises(binstar_client.Conflict):
+            self.cli.add_package(OWNER, 'foo', 'A summary', 'BSD', public=True)
+        self.cli.remove_package(OWNER, 'foo')
+        with self.assertRaises(binstar_client.NotFound):
+            self.cli.package(OWNER, 'foo')
+
+    def test_upload(self):
+        import binstar_client
+
+        data = b'Some distribution' * 10000
+        upload(self.cli, data, channels=['testing'])
+        dist = self.cli.distribution(OWNER, 'foo', '0.1', BASENAME)
+        self.assertEqual(dist['md5'], hashlib.md5(data).hexdigest())
+        self.assertEqual(dist['size'], len(data))
+        self.assertEqual(self.cli.download(OWNER, 'foo', '0.1', BASENAME).content, data)
+        self.assertEqual([dist['basename'] for dist in
+                          self.cli.release(OWNER, 'foo', '0.1')['distributions']],
+                         [BASENAME])
+
+        self.cli.remove_dist(OWNER, 'foo', '0.1', BASENAME)
+        with self.assertRaises(binstar_client.NotFound):
+            self.cli.distribution(OWNER, 'foo', '0.1', BASENAME)
+
+    def test_upload_bad_md5(self):
+        stage = self.cli.session.post('{}/stage/{}/foo/0.1/{}'.format(self.cli.domain, OWNER,
+                                                                    BASENAME),
+                                      data=json.dumps({})).json()
+        md5 = base64.b64encode(hashlib.md5(b'Other').digest()).decode('ascii')
+        response = self.cli.session.post(stage['post_url'], data={'Content-MD5': md5},
+                                         files={'file': (BASENAME, b'Data')})
+        self.assertEqual(response.status_code, 400)
+
+    def test_channels(self):
+        upload(self.cli, b'foo', channels=['testing'])
+        upload(self.cli, b'bar', basename='linux-64/foo-0.1-1.tar.bz2', channels=['testing'])
+        self.assertEqual(sorted(self.cli.list_channels(OWNER)), ['testing'])
+
+        self.cli.add_channel('main', OWNER, 'foo', '0.1', filename=BASENAME)
+        self.assertEqual([dist['basename'] for dist in
+                          self.cli.show_channel('main', OWNER)['files']], [BASENAME])
+        self.cli.add_channel('main', OWNER, 'foo', '0.1')
+        self.assertEqual(len(self.cli.show_channel('main', OWNER)['files']), 2)
+
+        self.cli.remove_channel('main', OWNER)
+        self.assertEqual(self.cli.show_channel('main', OWNER)['files'], [])
+        self.assertEqual(len(self.cli.show_channel('testing', OWNER)['files']), 2)
+
+    def test_injected_errors(self):
+        import binstar_client
+
+        self.server.inject_errors(2, status=500, path='/package/')
+        self.assertEqual(self.cli.user()['login'], OWNER)
+        for _ in range(2):
+            with self.assertRaises(binstar_client.errors.ServerError):
+                self.cli.package(OWNER, 'foo')
+        self.assertEqual(self.cli.package(OWNER, 'foo')['name'], 'foo')
+
+    def test_retry_after(self):
+        self.server.retry_after = 3
+        self.server.inject_errors(status=429)
+        response = self.cli.session.get('{}/user'.format(self.cli.domain))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '3')
+
+    def test_error_rate(self):
+        self.server.error_rate = 1
+        response = self.cli.session.get('{}/user'.format(self.cli.domain))
+        self.assertEqual(response.status_code, 503)
+
+    def test_requests(self):
+        self.cli.package(OWNER, 'foo')
+        self.assertEqual(self.server.requests[-1][:3], ('GET', '/package/owner/foo', 200))
+        self.assertEqual(self.server.request_count('GET', '/package/'), 1)
+        self.assertEqual(self.server.request_count('POST'), 2)
+
+
+class Test_parse_multipart(unittest.TestCase):
+    def test_fields(self):
+        body = (b'--XyZ\r\nContent-Disposition: form-data; name="key"\r\n\r\nvalue\r\n'
+                b'--XyZ\r\nContent-Disposition: form-data; name="file"; filename="a"\r\n'
+                b'Content-Type: application/octet-stream\r\n\r\n\x00\r\n\x01\r\n'
+                b'--XyZ--\r\n')
+        self.assertEqual(parse_multipart(body, 'multipart/form-data; boundary=XyZ'),
+                         {'key': b'value', 'file': b'\x00\r\n\x01'})
+
+
+if __name__ == '__main__':
+    unittest.main()
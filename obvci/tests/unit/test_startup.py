@@ -0,0 +1,56 @@
+"""
+Guard the startup of the obvci_conda_build_dir entry point, which is run
+(with --help) in the test section of every obvci build. Its time is
+measured by the startup suite of the benchmarks.
+
+"""
+import subprocess
+import sys
+import unittest
+
+
+#: The modules which are slow to import, and must only be imported once
+#: they are needed.
+HEAVY_MODULES = ['conda', 'conda_build', 'binstar_client', 'requests']
+
+
+def run_python(*args):
+    return subprocess.check_output([sys.executable] + list(args)).decode('utf-8')
+
+
+class Test_startup(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        code = ('import sys\n'
+                'from obvci.cli import conda_build_dir\n'
+                'sys.argv = ["obvci_conda_build_dir", "--help"]\n'
+                'try:\n'
+                '    conda_build_dir.main()\n'
+                'except SystemExit:\n'
+                '    pass\n'
+                'sys.stdout.write("\\nimported:" + ",".join(sorted(\n'
+                '    name for name in sys.modules if name.split(".")[0] in {!r})))'
+                ''.format(HEAVY_MODULES))
+        output = run_python('-c', code)
+        self.assertIn('usage:', output)
+        self.assertEqual(output.rsplit('\n', 1)[1], 'imported:')
+
+    def test_import_runs_no_subprocesses(self):
+        # Computing the version of a source checkout runs git, which must
+        # wait until the version is asked for.
+        code = ('import subprocess\n'
+                'class Popen(object):\n'
+                '    def __init__(self, args, *a, **kw):\n'
+                '        raise AssertionError("Ran {}".format(args))\n'
+                'subprocess.Popen = Popen\n'
+                'import obvci\n'
+                'from obvci.cli import conda_build_dir\n'
+                'print("ok")')
+        self.assertEqual(run_python('-c', code).strip(), 'ok')
+
+    def test_version(self):
+        code = 'import obvci; print(obvci.__version__ is obvci.__version__)'
+        self.assertEqual(run_python('-c', code).strip(), 'True')
+
+
+if __name__ == '__main__':
+    unittest.main()
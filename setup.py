@@ -21,7 +21,8 @@ setup(name='Obvious-ci',
       packages=['obvci', 'obvci.conda_tools', 'obvci.cli'],
       entry_points={
           'console_scripts': [
-              'obvci_conda_build_dir = obvci.cli.conda_build_dir:main'
+              'obvci_conda_build_dir = obvci.cli.conda_build_dir:main',
+              'obvci_conda_planner = obvci.cli.conda_planner:main',
           ]
       },
      )